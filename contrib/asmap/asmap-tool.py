@@ -173,13 +173,11 @@ IPv6: {ipv6_entries_changed} entries with {ipv6_changed}{ipv6_change_str} addres
         state1 = load_file(args.infile1)
         state2 = load_file(args.infile2)
         address_info = json.load(args.addrs_file)
-        addrs = {a["address"] for a in address_info if a["network"] in ["ipv4", "ipv6"]}
+        addrs = sorted({a["address"] for a in address_info if a["network"] in ["ipv4", "ipv6"]})
         reassignments = defaultdict(list)
-        for addr in addrs:
-            net = ipaddress.ip_network(addr)
-            prefix = asmap.net_to_prefix(net)
-            old_asn = state1.lookup(prefix)
-            new_asn = state2.lookup(prefix)
+        old_asns = state1.compile().lookup_many(addrs)
+        new_asns = state2.compile().lookup_many(addrs)
+        for addr, old_asn, new_asn in zip(addrs, old_asns, new_asns):
             if new_asn != old_asn:
                 reassignments[(old_asn, new_asn)].append(addr)
         reassignments = sorted(reassignments.items(), key=lambda item: len(item[1]), reverse=True)
@@ -3,14 +3,19 @@
 # file LICENSE or http://www.opensource.org/licenses/mit-license.php.
 
 """
-This module provides the ASNEntry and ASMap classes.
+This module provides the ASNEntry and ASMap classes, and the CompiledASMap and
+BinaryASMap classes for fast address lookups.
 """
 
+import array
+import bisect
 import copy
 import ipaddress
 import random
+import socket
+import struct
 import unittest
-from collections.abc import Callable, Iterable
+from collections.abc import Iterable
 from enum import Enum
 from functools import total_ordering
 from typing import Optional, Union, overload
@@ -50,6 +55,36 @@ def prefix_to_net(prefix: list[bool]) -> Union[ipaddress.IPv4Network,ipaddress.I
 # Shortcut for (prefix, ASN) entries.
 ASNEntry = tuple[list[bool], int]
 
+# Addresses accepted by the lookup methods of CompiledASMap and BinaryASMap.
+Address = Union[str, ipaddress.IPv4Address, ipaddress.IPv6Address,
+                ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+# Start of the IPv4-mapped IPv6 range (::ffff:0:0/96), as a 128-bit integer.
+_IPV4_MAPPED_START = 0xffff << 32
+
+def address_to_int(addr: Address) -> int:
+    """
+    Convert an IPv4 or IPv6 address to a 128-bit integer.
+
+    IPv4 addresses are remapped into the IPv4-mapped IPv6 range, like in
+    net_to_prefix. For networks, the network address is used.
+    """
+    if isinstance(addr, str):
+        # Faster than parsing with the ipaddress module.
+        try:
+            return _IPV4_MAPPED_START + int.from_bytes(socket.inet_pton(socket.AF_INET, addr), 'big')
+        except OSError:
+            pass
+        try:
+            return int.from_bytes(socket.inet_pton(socket.AF_INET6, addr), 'big')
+        except OSError:
+            raise ValueError(f"'{addr}' does not appear to be an IPv4 or IPv6 address") from None
+    if isinstance(addr, (ipaddress.IPv4Network, ipaddress.IPv6Network)):
+        addr = addr.network_address
+    if isinstance(addr, ipaddress.IPv4Address):
+        return _IPV4_MAPPED_START + int(addr)
+    return int(addr)
+
 # Shortcut for (prefix, old ASN, new ASN) entries.
 ASNDiff = tuple[list[bool], int, int]
 
@@ -81,63 +116,134 @@ class _VarLenCoder:
         self._minval = minval
         self._clsbits = clsbits
         self._maxval = minval + sum(1 << b for b in clsbits) - 1
+        # The first value of every class, and for every class: the encoding of the
+        # class ("1"-bits followed by a "0"-bit) as an integer, its length, and the
+        # number of bits following it.
+        self._clsstart = []
+        self._classes = []
+        val = minval
+        for k, bits in enumerate(clsbits):
+            prefix_len = k + 1 if k + 1 < len(clsbits) else k
+            self._clsstart.append(val)
+            self._classes.append((val, ((1 << k) - 1) << (prefix_len - k), prefix_len, bits))
+            val += 1 << bits
+        # For decoding, the (first value, encoding size, value mask) of the class
+        # of an encoding starting with any number of up to 64 "1"-bits.
+        self._decode_classes = []
+        for ones in range(65):
+            start, _, prefix_len, bits = self._classes[min(ones, len(self._classes) - 1)]
+            self._decode_classes.append((start, prefix_len + bits, (1 << bits) - 1))
+        # Caches of encode and encode_size results, as the same values are encoded many times.
+        self._codes: dict[int, tuple[int, int]] = {}
+        self._sizes: dict[int, int] = {}
 
     def can_encode(self, val: int) -> bool:
         """Check whether value val is in the range this coder supports."""
         return self._minval <= val <= self._maxval
 
-    def encode(self, val: int, ret: list[int]) -> None:
-        """Append encoding of val onto integer list ret."""
-
-        assert self._minval <= val <= self._maxval
-        val -= self._minval
-        bits = 0
-        for k, bits in enumerate(self._clsbits):
-            if val >> bits:
-                # If the value will not fit in class k, subtract its range from v,
-                # emit a "1" bit and continue with the next class.
-                val -= 1 << bits
-                ret.append(1)
-            else:
-                if k + 1 < len(self._clsbits):
-                    # Unless we're in the last class, emit a "0" bit.
-                    ret.append(0)
-                break
-        # And then encode v (now the position within the class) in big endian.
-        ret.extend((val >> (bits - 1 - b)) & 1 for b in range(bits))
+    def encode(self, val: int, writer: "_BitWriter") -> None:
+        """Append the encoding of val to writer."""
+        code = self._codes.get(val)
+        if code is None:
+            assert self._minval <= val <= self._maxval
+            # Find the class the value falls in.
+            start, prefix, prefix_len, bits = self._classes[bisect.bisect_right(self._clsstart, val) - 1]
+            # The class prefix, followed by the position within the class in big endian.
+            code = self._codes[val] = ((prefix << bits) | (val - start), prefix_len + bits)
+        writer.write(*code)
 
     def encode_size(self, val: int) -> int:
         """Compute how many bits are needed to encode val."""
         assert self._minval <= val <= self._maxval
-        val -= self._minval
-        ret = 0
-        bits = 0
-        for k, bits in enumerate(self._clsbits):
-            if val >> bits:
-                val -= 1 << bits
-                ret += 1
-            else:
-                ret += k + 1 < len(self._clsbits)
-                break
-        return ret + bits
-
-    def decode(self, stream, bitpos) -> tuple[int,int]:
-        """Decode a number starting at bitpos in stream, returning value and new bitpos."""
-        val = self._minval
-        bits = 0
-        for k, bits in enumerate(self._clsbits):
-            bit = 0
-            if k + 1 < len(self._clsbits):
-                bit = stream[bitpos]
-                bitpos += 1
-            if not bit:
-                break
-            val += 1 << bits
-        for i in range(bits):
-            bit = stream[bitpos]
-            bitpos += 1
-            val += bit << (bits - 1 - i)
-        return val, bitpos
+        size = self._sizes.get(val)
+        if size is None:
+            _, _, prefix_len, bits = self._classes[bisect.bisect_right(self._clsstart, val) - 1]
+            size = self._sizes[val] = prefix_len + bits
+        return size
+
+    def decode(self, stream: bytes, bitpos: int, end: int) -> tuple[int,int]:
+        """
+        Decode a number starting at bitpos in stream, returning value and new bitpos.
+
+        The stream holds end bits, packed most significant bit first, followed by at
+        least 8 zero bytes (see _bit_stream). IndexError is raised if it ends before
+        the number does.
+        """
+        if bitpos >= end:
+            raise IndexError("stream ends before the number")
+        # The next 57 to 64 bits of the stream, starting at the most significant bit.
+        # This covers the longest encoding of every coder.
+        window = (_read_u64(stream, bitpos >> 3)[0] << (bitpos & 7)) & _MASK64
+        # The class is the number of leading "1"-bits, up to the highest class.
+        start, size, mask = self._decode_classes[64 - (window ^ _MASK64).bit_length()]
+        if bitpos + size > end:
+            raise IndexError("stream ends within a number")
+        return start + ((window >> (64 - size)) & mask), bitpos + size
+
+_MASK64 = (1 << 64) - 1
+_read_u64 = struct.Struct(">Q").unpack_from
+
+# Every byte value with its bits in reverse order. The binary asmap format stores
+# the first bit of each byte in its least significant bit.
+_REVERSED_BITS = bytes.maketrans(bytes(range(256)), bytes(int(f"{byte:08b}"[::-1], 2) for byte in range(256)))
+
+def _bit_stream(data: bytes) -> bytes:
+    """Convert binary asmap data to the stream that _VarLenCoder.decode reads."""
+    return data.translate(_REVERSED_BITS) + bytes(8)
+
+class _BitWriter:
+    """
+    Collects a stream of bits, and converts it to the binary asmap format.
+
+    Bits are packed into bytes most significant bit first, so that multi-bit values
+    can be appended with shifts. Up to a few dozen of the latest bits are held in
+    an integer until they fill whole bytes.
+    """
+
+    def __init__(self) -> None:
+        self._out = bytearray()
+        self._acc = 0
+        self._acc_bits = 0
+
+    def __len__(self) -> int:
+        """Return the number of bits written."""
+        return len(self._out) * 8 + self._acc_bits
+
+    def write(self, val: int, bits: int) -> None:
+        """Append the bits lowest bits of val, most significant first."""
+        self._acc = (self._acc << bits) | val
+        self._acc_bits += bits
+        if self._acc_bits >= 32:
+            self._flush()
+
+    def _flush(self) -> None:
+        """Move all whole bytes from the integer to the output."""
+        rem = self._acc_bits & 7
+        self._out += (self._acc >> rem).to_bytes(self._acc_bits >> 3, 'big')
+        self._acc &= (1 << rem) - 1
+        self._acc_bits = rem
+
+    def copy(self, start: int, end: int) -> None:
+        """Append a copy of the bits written at positions start up to end."""
+        self._flush()
+        # Bits from the output bytes, and from the integer if the range reaches into it.
+        out_end = min(end, len(self._out) * 8)
+        val = 0
+        if start < out_end:
+            val = int.from_bytes(self._out[start >> 3:(out_end + 7) >> 3], 'big')
+            val = (val >> (-out_end & 7)) & ((1 << (out_end - start)) - 1)
+        if end > out_end:
+            acc_start = max(start, out_end) - len(self._out) * 8
+            acc_end = end - len(self._out) * 8
+            val = (val << (acc_end - acc_start)) | ((self._acc >> (self._acc_bits - acc_end)) & ((1 << (acc_end - acc_start)) - 1))
+        self.write(val, end - start)
+
+    def getvalue(self) -> bytes:
+        """Return the bits in the binary asmap format. The last byte is padded with zero bits."""
+        if self._acc_bits & 7:
+            self.write(0, 8 - (self._acc_bits & 7))
+        self._flush()
+        return bytes(self._out).translate(_REVERSED_BITS)
 
 # Variable-length encoders used in the binary asmap format.
 _CODER_INS = _VarLenCoder(0, [0, 0, 1])
@@ -175,6 +281,7 @@ class _Instruction(Enum):
 
 class _BinNode:
     """A class representing a (node of) the parsed binary asmap format."""
+    __slots__ = ("ins", "arg1", "arg2", "size")
 
     @overload
     def __init__(self, ins: _Instruction): ...
@@ -200,20 +307,20 @@ class _BinNode:
         if ins == _Instruction.RETURN:
             assert isinstance(arg1, int)
             assert arg2 is None
-            self.size = _CODER_INS.encode_size(ins.value) + _CODER_ASN.encode_size(arg1)
+            self.size = _INS_SIZE_RETURN + _CODER_ASN.encode_size(arg1)
         elif ins == _Instruction.JUMP:
             assert isinstance(arg1, _BinNode)
             assert isinstance(arg2, _BinNode)
-            self.size = (_CODER_INS.encode_size(ins.value) + _CODER_JUMP.encode_size(arg1.size) +
+            self.size = (_INS_SIZE_JUMP + _CODER_JUMP.encode_size(arg1.size) +
                          arg1.size + arg2.size)
         elif ins == _Instruction.DEFAULT:
             assert isinstance(arg1, int)
             assert isinstance(arg2, _BinNode)
-            self.size = _CODER_INS.encode_size(ins.value) + _CODER_ASN.encode_size(arg1) + arg2.size
+            self.size = _INS_SIZE_DEFAULT + _CODER_ASN.encode_size(arg1) + arg2.size
         elif ins == _Instruction.MATCH:
             assert isinstance(arg1, int)
             assert isinstance(arg2, _BinNode)
-            self.size = (_CODER_INS.encode_size(ins.value) + _CODER_MATCH.encode_size(arg1)
+            self.size = (_INS_SIZE_MATCH + _CODER_MATCH.encode_size(arg1)
                          + arg2.size)
         elif ins == _Instruction.END:
             assert arg1 is None
@@ -253,6 +360,32 @@ class _BinNode:
             return _BinNode(_Instruction.MATCH, 2, node0)
         return _BinNode(_Instruction.JUMP, node0, node1)
 
+    @staticmethod
+    def branch_size(node0: "_BinNode", node1: "_BinNode") -> int:
+        """The size of make_branch(node0, node1), without constructing it."""
+        if node0.ins == _Instruction.END:
+            if node1.ins == _Instruction.END:
+                return 0
+            if node1.ins == _Instruction.MATCH and node1.arg1 <= 0xFF:
+                return (_INS_SIZE_MATCH + _CODER_MATCH.encode_size(node1.arg1 + (1 << node1.arg1.bit_length()))
+                        + node1.arg2.size)
+            return _INS_SIZE_MATCH + _CODER_MATCH.encode_size(3) + node1.size
+        if node1.ins == _Instruction.END:
+            if node0.ins == _Instruction.MATCH and node0.arg1 <= 0xFF:
+                return (_INS_SIZE_MATCH + _CODER_MATCH.encode_size(node0.arg1 + (1 << (node0.arg1.bit_length() - 1)))
+                        + node0.arg2.size)
+            return _INS_SIZE_MATCH + _CODER_MATCH.encode_size(2) + node0.size
+        return _INS_SIZE_JUMP + _CODER_JUMP.encode_size(node0.size) + node0.size + node1.size
+
+    @staticmethod
+    def default_size(val: int, sub: "_BinNode") -> int:
+        """The size of make_default(val, sub), without constructing it."""
+        if sub.ins == _Instruction.END:
+            return _INS_SIZE_RETURN + _CODER_ASN.encode_size(val)
+        if sub.ins in (_Instruction.RETURN, _Instruction.DEFAULT):
+            return sub.size
+        return _INS_SIZE_DEFAULT + _CODER_ASN.encode_size(val) + sub.size
+
     @staticmethod
     def make_default(val: int, sub: "_BinNode") -> "_BinNode":
         """
@@ -266,6 +399,44 @@ class _BinNode:
             return sub
         return _BinNode(_Instruction.DEFAULT, val, sub)
 
+# Number of bits used to encode each instruction.
+_INS_SIZE_RETURN = _CODER_INS.encode_size(_Instruction.RETURN.value)
+_INS_SIZE_JUMP = _CODER_INS.encode_size(_Instruction.JUMP.value)
+_INS_SIZE_MATCH = _CODER_INS.encode_size(_Instruction.MATCH.value)
+_INS_SIZE_DEFAULT = _CODER_INS.encode_size(_Instruction.DEFAULT.value)
+
+# Markers used when walking a trie.
+_FLIP = object()
+_JOIN = object()
+
+# A list of ASNEntry objects, represented lazily so it can be concatenated in constant
+# time: None (empty), a single ASNEntry, or a pair of _EntryList objects to be
+# concatenated.
+_EntryList = Union[None, ASNEntry, tuple["_EntryList", "_EntryList"]]
+
+def _entry_list_concat(left: _EntryList, right: _EntryList) -> _EntryList:
+    """Concatenate two _EntryList objects."""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    return (left, right)
+
+def _entry_list_materialize(entries: _EntryList) -> list[ASNEntry]:
+    """Convert an _EntryList object to a list of ASNEntry objects."""
+    ret: list[ASNEntry] = []
+    stack = [entries]
+    while stack:
+        item = stack.pop()
+        if item is None:
+            continue
+        if isinstance(item[0], list):
+            ret.append((list(item[0]), item[1]))
+        else:
+            stack.append(item[1])
+            stack.append(item[0])
+    return ret
+
 @total_ordering
 class ASMap:
     """
@@ -315,13 +486,19 @@ class ASMap:
 
     def _set_trie(self, trie) -> None:
         """Set trie directly. Internal use only."""
-        def recurse(node: list) -> None:
+        # Merge identical leaf children, bottom up.
+        stack = [(trie, False)]
+        while stack:
+            node, expanded = stack.pop()
             if len(node) < 2:
-                return
-            recurse(node[0])
-            recurse(node[1])
+                continue
+            if not expanded:
+                stack.append((node, True))
+                stack.append((node[1], False))
+                stack.append((node[0], False))
+                continue
             if len(node[0]) == 2:
-                return
+                continue
             if node[0] == node[1]:
                 if len(node[0]) == 0:
                     node.clear()
@@ -329,7 +506,6 @@ class ASMap:
                     asn = node[0][0]
                     node.clear()
                     node.append(asn)
-        recurse(trie)
         self._trie = trie
 
     def __init__(self, entries: Optional[Iterable[ASNEntry]] = None) -> None:
@@ -354,49 +530,83 @@ class ASMap:
             return node[0]
         return None
 
+    def compile(self) -> "CompiledASMap":
+        """
+        Convert this ASMap object to a CompiledASMap for fast address lookups.
+
+        The result does not reflect later updates to this object.
+        """
+        intervals = []
+        stack = [(self._trie, 0, 0)]
+        while stack:
+            node, start, depth = stack.pop()
+            if len(node) == 1:
+                intervals.append((start, node[0]))
+            else:
+                # Push the upper half first, so that intervals are produced in order.
+                stack.append((node[1], start + (1 << (127 - depth)), depth + 1))
+                stack.append((node[0], start, depth + 1))
+        return CompiledASMap(intervals)
+
+    def lookup_many(self, addrs: Iterable[Address]) -> list[int]:
+        """Look up the ASNs of multiple addresses, returning 0 for unassigned ones."""
+        return self.compile().lookup_many(addrs)
+
     def _to_entries_flat(self, fill: bool = False) -> list[ASNEntry]:
         """Convert an ASMap object to a list of non-overlapping (prefix, asn) objects."""
         prefix : list[bool] = []
-
-        def recurse(node: list) -> list[ASNEntry]:
-            ret = []
-            if len(node) == 1:
-                if node[0] > 0:
-                    ret = [(list(prefix), node[0])]
-            elif len(node) == 2:
-                prefix.append(False)
-                ret = recurse(node[0])
+        # The stack holds trie nodes to visit, and the markers _FLIP (continue with the
+        # right child) and _JOIN (combine the entries of both children).
+        results: list[list[ASNEntry]] = []
+        stack: list = [self._trie]
+        while stack:
+            node = stack.pop()
+            if node is _FLIP:
                 prefix[-1] = True
-                ret += recurse(node[1])
+            elif node is _JOIN:
+                right = results.pop()
+                ret = results[-1]
+                ret += right
                 prefix.pop()
                 if fill and len(ret) > 1:
                     asns = set(x[1] for x in ret)
                     if len(asns) == 1:
-                        ret = [(list(prefix), list(asns)[0])]
-            return ret
-        return recurse(self._trie)
+                        results[-1] = [(list(prefix), list(asns)[0])]
+            elif len(node) == 1:
+                results.append([(list(prefix), node[0])] if node[0] > 0 else [])
+            else:
+                prefix.append(False)
+                stack.extend((_JOIN, node[1], _FLIP, node[0]))
+        return results[0]
 
     def _to_entries_minimal(self, fill: bool = False) -> list[ASNEntry]:
         """Convert a trie to a minimal list of ASNEntry objects, exploiting overlap."""
-        prefix : list[bool] = []
-
-        def recurse(node: list) -> (tuple[dict[Optional[int], list[ASNEntry]], bool]):
+        # For every node, candidate entry lists (with their length, as _EntryList) are
+        # computed bottom up, for every context ASN the node may be placed in.
+        results: list[tuple[dict[Optional[int], tuple[int, _EntryList]], bool]] = []
+        stack: list[tuple[list, list[bool], bool]] = [(self._trie, [], False)]
+        while stack:
+            node, prefix, expanded = stack.pop()
             if len(node) == 1 and node[0] == 0:
-                return {None if fill else 0: []}, True
+                results.append(({None if fill else 0: (0, None)}, True))
+                continue
             if len(node) == 1:
-                return {node[0]: [], None: [(list(prefix), node[0])]}, False
-            ret: dict[Optional[int], list[ASNEntry]] = {}
-            prefix.append(False)
-            left, lhole = recurse(node[0])
-            prefix[-1] = True
-            right, rhole = recurse(node[1])
-            prefix.pop()
+                results.append(({node[0]: (0, None), None: (1, (prefix, node[0]))}, False))
+                continue
+            if not expanded:
+                stack.append((node, prefix, True))
+                stack.append((node[1], prefix + [True], False))
+                stack.append((node[0], prefix + [False], False))
+                continue
+            right, rhole = results.pop()
+            left, lhole = results.pop()
+            ret: dict[Optional[int], tuple[int, _EntryList]] = {}
             hole = not fill and (lhole or rhole)
-            def candidate(ctx: Optional[int], res0: Optional[list[ASNEntry]],
-                    res1: Optional[list[ASNEntry]]):
+            def candidate(ctx: Optional[int], res0: Optional[tuple[int, _EntryList]],
+                    res1: Optional[tuple[int, _EntryList]]):
                 if res0 is not None and res1 is not None:
-                    if ctx not in ret or len(res0) + len(res1) < len(ret[ctx]):
-                        ret[ctx] = res0 + res1
+                    if ctx not in ret or res0[0] + res1[0] < ret[ctx][0]:
+                        ret[ctx] = (res0[0] + res1[0], _entry_list_concat(res0[1], res1[1]))
             for ctx in set(left) | set(right):
                 candidate(ctx, left.get(ctx), right.get(ctx))
                 candidate(ctx, left.get(None), right.get(ctx))
@@ -404,15 +614,15 @@ class ASMap:
             if not hole:
                 for ctx in list(ret):
                     if ctx is not None:
-                        candidate(None, [(list(prefix), ctx)], ret[ctx])
+                        candidate(None, (1, (prefix, ctx)), ret[ctx])
             if None in ret:
                 ret = {ctx:entries for ctx, entries in ret.items()
-                       if ctx is None or len(entries) < len(ret[None])}
+                       if ctx is None or entries[0] < ret[None][0]}
             if hole:
                 ret = {ctx:entries for ctx, entries in ret.items() if ctx is None or ctx == 0}
-            return ret, hole
-        res, _ = recurse(self._trie)
-        return res[0] if 0 in res else res[None]
+            results.append((ret, hole))
+        res, _ = results[0]
+        return _entry_list_materialize(res[0][1] if 0 in res else res[None][1])
 
     def __str__(self) -> str:
         """Convert this ASMap object to a string containing Python code constructing it."""
@@ -471,68 +681,101 @@ class ASMap:
         ret._set_trie(trie)
         return ret
 
+    def _to_dag(self) -> tuple[list[Union[int, tuple[int, int]]], int]:
+        """
+        Convert the trie to a DAG in which identical subtrees are shared.
+
+        Returns a list with, for every distinct subtree, its ASN if it is a leaf, or
+        the indexes of its children, and the index of the root. Children always
+        come before their parents.
+        """
+        ids: dict[Union[int, tuple[int, int]], int] = {}
+        dag: list[Union[int, tuple[int, int]]] = []
+        results: list[int] = []
+        stack = [(self._trie, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if len(node) == 2 and not expanded:
+                stack.append((node, True))
+                stack.append((node[1], False))
+                stack.append((node[0], False))
+                continue
+            if len(node) == 1:
+                key: Union[int, tuple[int, int]] = node[0]
+            else:
+                right = results.pop()
+                key = (results.pop(), right)
+            idx = ids.get(key)
+            if idx is None:
+                idx = ids[key] = len(dag)
+                dag.append(key)
+            results.append(idx)
+        return dag, results[0]
+
     def _to_binnode(self, fill: bool = False) -> _BinNode:
         """Convert a trie to a _BinNode object."""
-        def recurse(node: list) -> tuple[dict[Optional[int], _BinNode], bool]:
-            if len(node) == 1 and node[0] == 0:
+        def leaf(asn: int) -> tuple[dict[Optional[int], _BinNode], bool]:
+            if asn == 0:
                 return {(None if fill else 0): _BinNode.make_end()}, True
-            if len(node) == 1:
-                return {None: _BinNode.make_leaf(node[0]), node[0]: _BinNode.make_end()}, False
-            ret: dict[Optional[int], _BinNode] = {}
-            left, lhole = recurse(node[0])
-            right, rhole = recurse(node[1])
+            return {None: _BinNode.make_leaf(asn), asn: _BinNode.make_end()}, False
+
+        def combine(left: dict[Optional[int], _BinNode], lhole: bool,
+                    right: dict[Optional[int], _BinNode], rhole: bool) -> tuple[dict[Optional[int], _BinNode], bool]:
             hole = (lhole or rhole) and not fill
+            # The candidates are compared by size before the best ones are constructed.
+            best: dict[Optional[int], tuple[int, _BinNode, _BinNode]] = {}
 
-            def candidate(ctx: Optional[int], arg1, arg2, func: Callable):
+            def candidate(ctx: Optional[int], arg1, arg2):
                 if arg1 is not None and arg2 is not None:
-                    cand = func(arg1, arg2)
-                    if ctx not in ret or cand.size < ret[ctx].size:
-                        ret[ctx] = cand
+                    size = _BinNode.branch_size(arg1, arg2)
+                    if ctx not in best or size < best[ctx][0]:
+                        best[ctx] = (size, arg1, arg2)
 
             union = set(left) | set(right)
             sorted_union = sorted(union, key=lambda x: (x is None, x))
             for ctx in sorted_union:
-                candidate(ctx, left.get(ctx), right.get(ctx), _BinNode.make_branch)
-                candidate(ctx, left.get(None), right.get(ctx), _BinNode.make_branch)
-                candidate(ctx, left.get(ctx), right.get(None), _BinNode.make_branch)
+                candidate(ctx, left.get(ctx), right.get(ctx))
+                candidate(ctx, left.get(None), right.get(ctx))
+                candidate(ctx, left.get(ctx), right.get(None))
+            ret = {ctx: _BinNode.make_branch(arg1, arg2) for ctx, (_, arg1, arg2) in best.items()}
             if not hole:
+                best_default = None
                 for ctx in sorted(set(ret) - set([None])):
-                    candidate(None, ctx, ret[ctx], _BinNode.make_default)
+                    size = _BinNode.default_size(ctx, ret[ctx])
+                    if (None not in ret or size < ret[None].size) and (best_default is None or size < best_default[0]):
+                        best_default = (size, ctx)
+                if best_default is not None:
+                    ret[None] = _BinNode.make_default(best_default[1], ret[best_default[1]])
             if None in ret:
                 ret = {ctx:enc for ctx, enc in ret.items()
                        if ctx is None or enc.size < ret[None].size}
             if hole:
                 ret = {ctx:enc for ctx, enc in ret.items() if ctx is None or ctx == 0}
             return ret, hole
-        res, _ = recurse(self._trie)
-        return res[0] if 0 in res else res[None]
 
-    @staticmethod
-    def _from_binnode(binnode: _BinNode) -> "ASMap":
-        """Construct an ASMap object from a _BinNode. Internal use only."""
-        def recurse(node: _BinNode, default: int) -> list:
-            if node.ins == _Instruction.RETURN:
-                return [node.arg1]
-            if node.ins == _Instruction.JUMP:
-                return [recurse(node.arg1, default), recurse(node.arg2, default)]
-            if node.ins == _Instruction.MATCH:
-                val = node.arg1
-                sub = recurse(node.arg2, default)
-                while val >= 2:
-                    bit = val & 1
-                    val >>= 1
-                    if bit:
-                        sub = [[default], sub]
-                    else:
-                        sub = [sub, [default]]
-                return sub
-            assert node.ins == _Instruction.DEFAULT
-            return recurse(node.arg2, node.arg1)
-        ret = ASMap()
-        if binnode.ins != _Instruction.END:
-            #pylint: disable=protected-access
-            ret._set_trie(recurse(binnode, 0))
-        return ret
+        # Every distinct subtree is encoded once. Results are dropped once all the
+        # subtrees using them have been encoded.
+        dag, root = self._to_dag()
+        uses = [0] * len(dag)
+        for key in dag:
+            if isinstance(key, tuple):
+                uses[key[0]] += 1
+                uses[key[1]] += 1
+        results: list[Optional[tuple[dict[Optional[int], _BinNode], bool]]] = [None] * len(dag)
+        for idx, key in enumerate(dag):
+            if isinstance(key, int):
+                results[idx] = leaf(key)
+                continue
+            left_res, right_res = results[key[0]], results[key[1]]
+            assert left_res is not None and right_res is not None
+            results[idx] = combine(*left_res, *right_res)
+            for child in key:
+                uses[child] -= 1
+                if uses[child] == 0:
+                    results[child] = None
+        res = results[root]
+        assert res is not None
+        return res[0][0] if 0 in res[0] else res[0][None]
 
     def to_binary(self, fill: bool = False) -> bytes:
         """
@@ -545,85 +788,98 @@ class ASMap:
         Returns:
             A bytes object with the encoding of this ASMap object.
         """
-        bits: list[int] = []
-
-        def recurse(node: _BinNode) -> None:
-            _CODER_INS.encode(node.ins.value, bits)
-            if node.ins == _Instruction.RETURN:
+        bits = _BitWriter()
+        # Subprograms that are shared between several parts of the program are
+        # encoded once, and copied whenever they appear again.
+        spans: dict[int, tuple[int, int]] = {}
+        binnode = self._to_binnode(fill)
+        stack: list[Union[_BinNode, tuple[int, int]]] = []
+        if binnode.ins != _Instruction.END:
+            stack.append(binnode)
+        while stack:
+            item = stack.pop()
+            if isinstance(item, tuple):
+                spans[item[0]] = (item[1], len(bits))
+                continue
+            node = item
+            span = spans.get(id(node))
+            if span is not None:
+                bits.copy(*span)
+                continue
+            stack.append((id(node), len(bits)))
+            ins = node.ins
+            _CODER_INS.encode(ins.value, bits)
+            if ins == _Instruction.RETURN:
                 _CODER_ASN.encode(node.arg1, bits)
-            elif node.ins == _Instruction.JUMP:
+            elif ins == _Instruction.JUMP:
                 _CODER_JUMP.encode(node.arg1.size, bits)
-                recurse(node.arg1)
-                recurse(node.arg2)
-            elif node.ins == _Instruction.DEFAULT:
+                stack.append(node.arg2)
+                stack.append(node.arg1)
+            elif ins == _Instruction.DEFAULT:
                 _CODER_ASN.encode(node.arg1, bits)
-                recurse(node.arg2)
+                stack.append(node.arg2)
             else:
-                assert node.ins == _Instruction.MATCH
+                assert ins == _Instruction.MATCH
                 _CODER_MATCH.encode(node.arg1, bits)
-                recurse(node.arg2)
-
-        binnode = self._to_binnode(fill)
-        if binnode.ins != _Instruction.END:
-            recurse(binnode)
-
-        val = 0
-        nbits = 0
-        ret = []
-        for bit in bits:
-            val += (bit << nbits)
-            nbits += 1
-            if nbits == 8:
-                ret.append(val)
-                val = 0
-                nbits = 0
-        if nbits:
-            ret.append(val)
-        return bytes(ret)
+                stack.append(node.arg2)
+        return bits.getvalue()
 
     @staticmethod
     def from_binary(bindata: bytes) -> Optional["ASMap"]:
         """Decode an ASMap object from the provided binary encoding."""
+        bits = _bit_stream(bindata)
+        num_bits = len(bindata) * 8
+        ret = ASMap()
+        if num_bits == 0:
+            return ret
 
-        bits: list[int] = []
-        for byte in bindata:
-            bits.extend((byte >> i) & 1 for i in range(8))
-
-        def recurse(bitpos: int) -> tuple[_BinNode, int]:
-            insval, bitpos = _CODER_INS.decode(bits, bitpos)
-            ins = _Instruction(insval)
-            if ins == _Instruction.RETURN:
-                asn, bitpos = _CODER_ASN.decode(bits, bitpos)
-                return _BinNode(ins, asn), bitpos
-            if ins == _Instruction.JUMP:
-                jump, bitpos = _CODER_JUMP.decode(bits, bitpos)
-                left, bitpos1 = recurse(bitpos)
-                if bitpos1 != bitpos + jump:
-                    raise ValueError("Inconsistent jump")
-                right, bitpos = recurse(bitpos1)
-                return _BinNode(ins, left, right), bitpos
-            if ins == _Instruction.MATCH:
-                match, bitpos = _CODER_MATCH.decode(bits, bitpos)
-                sub, bitpos = recurse(bitpos)
-                return _BinNode(ins, match, sub), bitpos
-            assert ins == _Instruction.DEFAULT
-            asn, bitpos = _CODER_ASN.decode(bits, bitpos)
-            sub, bitpos = recurse(bitpos)
-            return _BinNode(ins, asn, sub), bitpos
-
-        if len(bits) == 0:
-            binnode = _BinNode(_Instruction.END)
-        else:
-            try:
-                binnode, bitpos = recurse(0)
-            except (ValueError, IndexError):
-                return None
-            if bitpos < len(bits) - 7:
-                return None
-            if not all(bit == 0 for bit in bits[bitpos:]):
-                return None
+        # The program is decoded directly into a trie. The stack holds the subprograms
+        # still to be decoded: their position, the trie node to decode them into, and
+        # the default ASN. As subprograms are decoded in order, each must start where
+        # the previous one ended, or a JUMP was inconsistent.
+        trie: list = []
+        stack: list[tuple[int, list, int]] = [(0, trie, 0)]
+        end = 0
+        try:
+            while stack:
+                bitpos, node, default = stack.pop()
+                if bitpos != end:
+                    return None
+                while True:
+                    insval, bitpos = _CODER_INS.decode(bits, bitpos, num_bits)
+                    if insval == _Instruction.RETURN.value:
+                        asn, bitpos = _CODER_ASN.decode(bits, bitpos, num_bits)
+                        node.append(asn)
+                        break
+                    if insval == _Instruction.JUMP.value:
+                        jump, bitpos = _CODER_JUMP.decode(bits, bitpos, num_bits)
+                        node.extend(([], []))
+                        stack.append((bitpos + jump, node[1], default))
+                        node = node[0]
+                    elif insval == _Instruction.MATCH.value:
+                        match, bitpos = _CODER_MATCH.decode(bits, bitpos, num_bits)
+                        for i in range(match.bit_length() - 2, -1, -1):
+                            if (match >> i) & 1:
+                                node.extend(([default], []))
+                                node = node[1]
+                            else:
+                                node.extend(([], [default]))
+                                node = node[0]
+                    else:
+                        assert insval == _Instruction.DEFAULT.value
+                        default, bitpos = _CODER_ASN.decode(bits, bitpos, num_bits)
+                end = bitpos
+        except (ValueError, IndexError):
+            return None
+        if end < num_bits - 7:
+            return None
+        # The padding bits of the last byte must be zero.
+        if end < num_bits and (bits[end >> 3] << (end & 7)) & 0xff:
+            return None
 
-        return ASMap._from_binnode(binnode)
+        #pylint: disable=protected-access
+        ret._set_trie(trie)
+        return ret
 
     def __lt__(self, other: "ASMap") -> bool:
         return self._trie < other._trie
@@ -651,26 +907,23 @@ class ASMap:
 
     def diff(self, other: "ASMap") -> list[ASNDiff]:
         """Compute the diff from self to other."""
-        prefix: list[bool] = []
+        assert isinstance(other, ASMap)
         ret: list[ASNDiff] = []
-
-        def recurse(old_node: list, new_node: list):
+        #pylint: disable=protected-access
+        stack: list[tuple[list, list, list[bool]]] = [(self._trie, other._trie, [])]
+        while stack:
+            old_node, new_node, prefix = stack.pop()
             if len(old_node) == 1 and len(new_node) == 1:
                 if old_node[0] != new_node[0]:
-                    ret.append((list(prefix), old_node[0], new_node[0]))
-            else:
+                    ret.append((prefix, old_node[0], new_node[0]))
+            elif old_node != new_node:
+                # Identical subtrees are skipped without walking them.
                 old_left: list = old_node if len(old_node) == 1 else old_node[0]
                 old_right: list = old_node if len(old_node) == 1 else old_node[1]
                 new_left: list = new_node if len(new_node) == 1 else new_node[0]
                 new_right: list = new_node if len(new_node) == 1 else new_node[1]
-                prefix.append(False)
-                recurse(old_left, new_left)
-                prefix[-1] = True
-                recurse(old_right, new_right)
-                prefix.pop()
-        assert isinstance(other, ASMap)
-        #pylint: disable=protected-access
-        recurse(self._trie, other._trie)
+                stack.append((old_right, new_right, prefix + [True]))
+                stack.append((old_left, new_left, prefix + [False]))
         return ret
 
     def __copy__(self) -> "ASMap":
@@ -685,6 +938,155 @@ class ASMap:
         return self.__copy__()
 
 
+class CompiledASMap:
+    """
+    A read-only mapping from addresses to ASNs, optimized for lookups.
+
+    The address space is stored as sorted arrays of interval start addresses and
+    their ASNs, which are searched with bisect. IPv4 addresses are looked up in a
+    separate table of 32-bit intervals covering the IPv4-mapped range.
+    """
+
+    def __init__(self, intervals: Iterable[tuple[int, int]]) -> None:
+        """
+        Construct a CompiledASMap from (start, asn) intervals covering the whole
+        IPv6 address space, in order of start address and starting at 0.
+        """
+        starts: list[int] = []
+        asns: list[int] = []
+        for start, asn in intervals:
+            if asns and asns[-1] == asn:
+                continue
+            starts.append(start)
+            asns.append(asn)
+        assert starts and starts[0] == 0
+        self._starts = starts
+        self._asns = asns
+        first = bisect.bisect_right(starts, _IPV4_MAPPED_START) - 1
+        last = bisect.bisect_left(starts, _IPV4_MAPPED_START + (1 << 32))
+        self._ipv4_starts = array.array('I', [0] + [start - _IPV4_MAPPED_START for start in starts[first + 1:last]])
+        self._ipv4_asns = array.array('I', asns[first:last])
+
+    def lookup(self, addr: Address) -> int:
+        """Look up the ASN of an address. Returns 0 if unassigned."""
+        return self.lookup_int(address_to_int(addr))
+
+    def lookup_int(self, val: int) -> int:
+        """Look up the ASN of an address given as 128-bit integer (see address_to_int)."""
+        if 0 <= val - _IPV4_MAPPED_START < (1 << 32):
+            return self._ipv4_asns[bisect.bisect_right(self._ipv4_starts, val - _IPV4_MAPPED_START) - 1]
+        return self._asns[bisect.bisect_right(self._starts, val) - 1]
+
+    def lookup_many(self, addrs: Iterable[Address]) -> list[int]:
+        """Look up the ASNs of multiple addresses, returning 0 for unassigned ones."""
+        return [self.lookup_int(address_to_int(addr)) for addr in addrs]
+
+    def __len__(self) -> int:
+        """Return the number of intervals."""
+        return len(self._starts)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, CompiledASMap):
+            return self._starts == other._starts and self._asns == other._asns
+        return False
+
+
+class BinaryASMap:
+    """
+    An asmap in the binary format, which is interpreted directly for lookups,
+    like Bitcoin Core does. This avoids decoding it with ASMap.from_binary.
+
+    The encoding is not validated up front. Errors are only detected (and
+    raised as ValueError) on the paths that lookups or compile() take.
+    """
+
+    def __init__(self, bindata: bytes) -> None:
+        self._bits = _bit_stream(bindata)
+        self._num_bits = len(bindata) * 8
+
+    def _decode(self, coder: _VarLenCoder, pos: int) -> tuple[int, int]:
+        try:
+            return coder.decode(self._bits, pos, self._num_bits)
+        except IndexError:
+            raise ValueError("Unexpected end of asmap") from None
+
+    def lookup(self, addr: Address) -> int:
+        """Look up the ASN of an address. Returns 0 if unassigned."""
+        return self.lookup_int(address_to_int(addr))
+
+    def lookup_int(self, val: int) -> int:
+        """Look up the ASN of an address given as 128-bit integer (see address_to_int)."""
+        if self._num_bits == 0:
+            return 0
+        pos = 0
+        bits_left = 128
+        default = 0
+        while True:
+            insval, pos = self._decode(_CODER_INS, pos)
+            if insval == _Instruction.RETURN.value:
+                asn, _ = self._decode(_CODER_ASN, pos)
+                return asn
+            if insval == _Instruction.JUMP.value:
+                jump, pos = self._decode(_CODER_JUMP, pos)
+                if bits_left == 0:
+                    raise ValueError("Jump after the last address bit")
+                bits_left -= 1
+                if (val >> bits_left) & 1:
+                    pos += jump
+            elif insval == _Instruction.MATCH.value:
+                match, pos = self._decode(_CODER_MATCH, pos)
+                matchlen = match.bit_length() - 1
+                if bits_left < matchlen:
+                    raise ValueError("Match beyond the last address bit")
+                bits_left -= matchlen
+                if (val >> bits_left) & ((1 << matchlen) - 1) != match - (1 << matchlen):
+                    return default
+            else:
+                default, pos = self._decode(_CODER_ASN, pos)
+
+    def lookup_many(self, addrs: Iterable[Address]) -> list[int]:
+        """Look up the ASNs of multiple addresses, returning 0 for unassigned ones."""
+        return [self.lookup_int(address_to_int(addr)) for addr in addrs]
+
+    def compile(self) -> CompiledASMap:
+        """Convert to a CompiledASMap by walking all paths through the program."""
+        if self._num_bits == 0:
+            return CompiledASMap([(0, 0)])
+        intervals = []
+        # Paths still to be walked: (position in program, address prefix, prefix length, default)
+        stack = [(0, 0, 0, 0)]
+        while stack:
+            pos, prefix, depth, default = stack.pop()
+            while True:
+                insval, pos = self._decode(_CODER_INS, pos)
+                if insval == _Instruction.RETURN.value:
+                    asn, _ = self._decode(_CODER_ASN, pos)
+                    intervals.append((prefix << (128 - depth), asn))
+                    break
+                if insval == _Instruction.JUMP.value:
+                    jump, pos = self._decode(_CODER_JUMP, pos)
+                    if depth == 128:
+                        raise ValueError("Jump after the last address bit")
+                    stack.append((pos + jump, (prefix << 1) | 1, depth + 1, default))
+                    prefix <<= 1
+                    depth += 1
+                elif insval == _Instruction.MATCH.value:
+                    match, pos = self._decode(_CODER_MATCH, pos)
+                    matchlen = match.bit_length() - 1
+                    if depth + matchlen > 128:
+                        raise ValueError("Match beyond the last address bit")
+                    for i in range(matchlen - 1, -1, -1):
+                        bit = (match >> i) & 1
+                        # The sibling of the matching path returns the default.
+                        intervals.append((((prefix << 1) | (bit ^ 1)) << (127 - depth), default))
+                        prefix = (prefix << 1) | bit
+                        depth += 1
+                else:
+                    default, pos = self._decode(_CODER_ASN, pos)
+        intervals.sort()
+        return CompiledASMap(intervals)
+
+
 class TestASMap(unittest.TestCase):
     """Unit tests for this module."""
 
@@ -747,6 +1149,50 @@ class TestASMap(unittest.TestCase):
                     assert asmap3 is not None
                     self.assertTrue(asmap3.extends(asmap))
 
+    def test_compiled_lookups(self) -> None:
+        """Test that CompiledASMap and BinaryASMap lookups match ASMap.lookup."""
+        for leaves in range(1, 40):
+            for pct in range(0, 101, 25):
+                if leaves % 2:
+                    asmap = ASMap.from_random(num_leaves=leaves, max_asn=1 + (1 << 20),
+                                              unassigned_prob=0.01 * pct)
+                else:
+                    # Construct an asmap from random IPv4 and IPv6 networks, so that the
+                    # IPv4-mapped range is subdivided too.
+                    entries = []
+                    for _ in range(leaves):
+                        if random.random() < 0.5:
+                            net = ipaddress.IPv4Network((random.getrandbits(32), random.randrange(33)), False)
+                        else:
+                            net = ipaddress.IPv6Network((random.getrandbits(128), random.randrange(129)), False)
+                        asn = 0 if random.random() < 0.01 * pct else random.randrange(1, 1000)
+                        entries.append((net_to_prefix(net), asn))
+                    asmap = ASMap(entries)
+                compiled = asmap.compile()
+                enc = asmap.to_binary(fill=False)
+                self.assertEqual(BinaryASMap(enc).compile(), compiled)
+                enc_filled = asmap.to_binary(fill=True)
+                filled = ASMap.from_binary(enc_filled)
+                assert filled is not None
+                self.assertEqual(BinaryASMap(enc_filled).compile(), filled.compile())
+
+                # Look up random addresses, and the addresses around interval boundaries.
+                #pylint: disable=protected-access
+                vals = [random.getrandbits(128) for _ in range(20)]
+                vals += [_IPV4_MAPPED_START + random.getrandbits(32) for _ in range(20)]
+                vals += [start + delta for start in compiled._starts for delta in (-1, 0, 1)
+                         if 0 <= start + delta < (1 << 128)]
+                for val in vals:
+                    prefix = [((val >> (127 - i)) & 1) != 0 for i in range(128)]
+                    asn = asmap.lookup(prefix)
+                    self.assertEqual(compiled.lookup_int(val), asn)
+                    self.assertEqual(BinaryASMap(enc).lookup_int(val), asn)
+                    self.assertEqual(BinaryASMap(enc_filled).lookup_int(val), filled.lookup(prefix))
+                addrs = [prefix_to_net([((val >> (127 - i)) & 1) != 0 for i in range(128)]) for val in vals]
+                self.assertEqual(compiled.lookup_many(addrs), [asmap.lookup(net_to_prefix(addr)) for addr in addrs])
+                self.assertEqual(asmap.lookup_many(str(addr.network_address) for addr in addrs),
+                                 compiled.lookup_many(addrs))
+
     def test_patching(self) -> None:
         """Test behavior of update, lookup, extends, and diff."""
         #pylint: disable=too-many-locals,too-many-nested-blocks
@@ -0,0 +1,110 @@
+// Copyright (c) The Bitcoin Core developers
+// Distributed under the MIT software license, see the accompanying
+// file COPYING or https://opensource.org/license/mit/.
+
+//! Comparison of `llvm-cov show` reports, shared by the deterministic coverage tools.
+
+use std::collections::{BTreeMap, BTreeSet};
+use std::fs;
+use std::path::Path;
+
+/// A source location: the file name and the line number (0 for the file header).
+type Location<'a> = (&'a str, u32);
+
+/// Group the lines of an `llvm-cov show` report by the source location they belong to. Branch,
+/// expansion and instantiation lines are attributed to the source line they follow.
+fn lines_by_location(report: &str) -> BTreeMap<Location<'_>, Vec<&str>> {
+    let mut location = ("", 0);
+    let mut lines = BTreeMap::<Location, Vec<&str>>::new();
+    for text in report.lines() {
+        if !text.starts_with([' ', '|', '-']) && text.ends_with(':') {
+            location = (text.trim_end_matches(':'), 0);
+        } else if let Some((number, _)) = text.trim_start().split_once('|') {
+            if let Ok(number) = number.parse() {
+                location.1 = number;
+            }
+        }
+        lines.entry(location).or_default().push(text);
+    }
+    lines
+}
+
+/// Return the source locations ("file:line") whose coverage differs between two `llvm-cov show`
+/// reports.
+///
+/// The lines of both reports are matched up by their source location, not by their position, so
+/// that lines present in only one report (for example an extra branch or instantiation) do not
+/// shift the comparison of all following lines.
+pub fn diff_coverage_reports(a: &str, b: &str) -> Vec<String> {
+    if a == b {
+        return vec![];
+    }
+    let (a, b) = (lines_by_location(a), lines_by_location(b));
+    a.keys()
+        .chain(b.keys())
+        .filter(|location| a.get(location) != b.get(location))
+        .collect::<BTreeSet<_>>()
+        .into_iter()
+        .map(|(file, line)| format!("{file}:{line}"))
+        .collect()
+}
+
+/// Like `diff_coverage_reports`, for two report files.
+pub fn diff_coverage(a: &Path, b: &Path) -> Result<Vec<String>, String> {
+    let read = |p: &Path| {
+        fs::read_to_string(p).map_err(|e| format!("Failed to read {} ({e})", p.display()))
+    };
+    Ok(diff_coverage_reports(&read(a)?, &read(b)?))
+}
+
+#[cfg(test)]
+mod tests {
+    use super::diff_coverage_reports;
+
+    const REPORT: &str = r#"/src/a.cpp:
+    1|      1|int f(int x) {
+    2|      1|    if (x) {
+  ------------------
+  |  Branch (2:9): [True: 1, False: 0]
+  ------------------
+    3|      1|        return 1;
+    4|      1|    }
+    5|      0|    return 0;
+    6|      1|}
+/src/b.cpp:
+    1|      2|int g() { return 0; }
+"#;
+
+    #[test]
+    fn same_reports() {
+        assert!(diff_coverage_reports(REPORT, REPORT).is_empty());
+    }
+
+    #[test]
+    fn changed_counts() {
+        let other = REPORT
+            .replace("[True: 1, False: 0]", "[True: 1, False: 1]")
+            .replace("    5|      0|", "    5|      1|");
+        assert_eq!(
+            diff_coverage_reports(REPORT, &other),
+            ["/src/a.cpp:2", "/src/a.cpp:5"]
+        );
+    }
+
+    #[test]
+    fn lines_in_one_report_only() {
+        // An extra line only affects its own location, not the lines following it.
+        let other = REPORT.replace(
+            "    6|      1|}\n",
+            "    6|      1|}\n  ------------------\n  | f(int):\n  ------------------\n",
+        );
+        assert_eq!(diff_coverage_reports(REPORT, &other), ["/src/a.cpp:6"]);
+        assert_eq!(diff_coverage_reports(&other, REPORT), ["/src/a.cpp:6"]);
+        // A file missing in one report only affects that file.
+        let other = REPORT.replace("/src/b.cpp:\n    1|      2|int g() { return 0; }\n", "");
+        assert_eq!(
+            diff_coverage_reports(REPORT, &other),
+            ["/src/b.cpp:0", "/src/b.cpp:1"]
+        );
+    }
+}
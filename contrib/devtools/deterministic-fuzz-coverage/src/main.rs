@@ -2,12 +2,16 @@
 // Distributed under the MIT software license, see the accompanying
 // file COPYING or https://opensource.org/license/mit/.
 
-use std::collections::VecDeque;
+use deterministic_coverage_diff::diff_coverage;
+use std::collections::BTreeMap;
 use std::env;
-use std::fs::{read_dir, DirEntry, File};
+use std::fs::{self, read_dir, File};
+use std::io::Write;
 use std::path::{Path, PathBuf};
-use std::process::{Command, ExitCode};
+use std::process::{Command, ExitCode, Stdio};
 use std::str;
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::sync::Mutex;
 use std::thread;
 
 /// A type for a complete and readable error message.
@@ -19,13 +23,14 @@ const LLVM_COV: &str = "llvm-cov";
 const GIT: &str = "git";
 
 const DEFAULT_PAR: usize = 1;
+const ALL_TARGETS: &str = "all";
 
 fn exit_help(err: &str) -> AppError {
     format!(
         r#"
 Error: {err}
 
-Usage: program ./build_dir ./qa-assets/fuzz_corpora fuzz_target_name [parallelism={DEFAULT_PAR}]
+Usage: program ./build_dir ./qa-assets/fuzz_corpora fuzz_target_name[,fuzz_target_name...]|{ALL_TARGETS} [parallelism={DEFAULT_PAR}]
 
 Refer to the devtools/README.md for more details."#
     )
@@ -62,11 +67,7 @@ fn app() -> AppResult {
         Err(exit_help("--help requested"))?;
     }
     let corpora_dir = args.get(2).ok_or(exit_help("Must set fuzz corpora dir"))?;
-    let fuzz_target = args
-        .get(3)
-        // Require fuzz target for now. In the future it could be optional and the tool could
-        // iterate over all compiled fuzz targets
-        .ok_or(exit_help("Must set fuzz target"))?;
+    let fuzz_targets = args.get(3).ok_or(exit_help("Must set fuzz target(s)"))?;
     let par = match args.get(4) {
         Some(s) => s
             .parse::<usize>()
@@ -84,7 +85,25 @@ fn app() -> AppResult {
 
     sanity_check(corpora_dir, &fuzz_exe)?;
 
-    deterministic_coverage(build_dir, corpora_dir, &fuzz_exe, fuzz_target, par)
+    let fuzz_targets = if fuzz_targets == ALL_TARGETS {
+        all_fuzz_targets(&fuzz_exe)?
+            .into_iter()
+            .filter(|t| {
+                let has_corpus = corpora_dir.join(t).is_dir();
+                if !has_corpus {
+                    println!("Skipping {t}, it has no fuzz inputs directory.");
+                }
+                has_corpus
+            })
+            .collect()
+    } else {
+        fuzz_targets
+            .split(',')
+            .map(str::to_string)
+            .collect::<Vec<_>>()
+    };
+
+    deterministic_coverage(build_dir, corpora_dir, &fuzz_exe, &fuzz_targets, par)
 }
 
 fn using_libfuzzer(fuzz_exe: &Path) -> Result<bool, AppError> {
@@ -100,11 +119,75 @@ fn using_libfuzzer(fuzz_exe: &Path) -> Result<bool, AppError> {
     Ok(help_output.contains("libFuzzer"))
 }
 
+fn all_fuzz_targets(fuzz_exe: &Path) -> Result<Vec<String>, AppError> {
+    let output = Command::new(fuzz_exe)
+        .env("PRINT_ALL_FUZZ_TARGETS_AND_ABORT", "1")
+        .output()
+        .map_err(|e| format!("fuzz failed with {e}"))?;
+    let targets = str::from_utf8(&output.stdout)
+        .map_err(|e| format!("The fuzz target list must be valid text ({e})"))?
+        .lines()
+        .map(str::to_string)
+        .collect::<Vec<_>>();
+    if targets.is_empty() {
+        Err("No fuzz targets found".to_string())?;
+    }
+    Ok(targets)
+}
+
+/// Return the git object hashes of the given files, or of the given text if no files are given.
+fn git_hash_object(paths: &[PathBuf], text: &str) -> Result<Vec<String>, AppError> {
+    let mut child = Command::new(GIT)
+        .arg("hash-object")
+        .arg(if paths.is_empty() {
+            "--stdin"
+        } else {
+            "--stdin-paths"
+        })
+        .stdin(Stdio::piped())
+        .stdout(Stdio::piped())
+        .spawn()
+        .map_err(|e| format!("{GIT} hash-object failed with {e}"))?;
+    {
+        let mut stdin = child.stdin.take().expect("stdin is piped");
+        let input = if paths.is_empty() {
+            text.to_string()
+        } else {
+            paths
+                .iter()
+                .map(|p| format!("{}\n", p.display()))
+                .collect::<String>()
+        };
+        stdin
+            .write_all(input.as_bytes())
+            .map_err(|e| format!("{GIT} hash-object failed with {e}"))?;
+    }
+    let output = child
+        .wait_with_output()
+        .map_err(|e| format!("{GIT} hash-object failed with {e}"))?;
+    if !output.status.success() {
+        Err(format!("{GIT} hash-object failed"))?;
+    }
+    Ok(String::from_utf8_lossy(&output.stdout)
+        .lines()
+        .map(str::to_string)
+        .collect())
+}
+
+/// A single determinism check: running the fuzz target on an input file or on its whole corpus
+/// directory twice and comparing the coverage.
+struct Check {
+    target: String,
+    input: PathBuf,
+    /// Marker in the cache, present once the check passed with the current fuzz executable.
+    cache_marker: PathBuf,
+}
+
 fn deterministic_coverage(
     build_dir: &Path,
     corpora_dir: &Path,
     fuzz_exe: &Path,
-    fuzz_target: &str,
+    fuzz_targets: &[String],
     par: usize,
 ) -> AppResult {
     let using_libfuzzer = using_libfuzzer(fuzz_exe)?;
@@ -113,19 +196,80 @@ fn deterministic_coverage(
         println!("This tool may be tripped by libFuzzer misbehavior.");
         println!("It is recommended to compile without libFuzzer.");
     }
-    let corpus_dir = corpora_dir.join(fuzz_target);
-    let mut entries = read_dir(&corpus_dir)
-        .map_err(|err| {
-            exit_help(&format!(
-                "The fuzz target's input directory must exist! ({}; {})",
-                corpus_dir.display(),
-                err
-            ))
-        })?
-        .map(|entry| entry.expect("IO error"))
+    // Inputs that were found to be deterministic are remembered by their content hash, per fuzz
+    // executable, so that they are not checked again on the next run.
+    let fuzz_exe_hash = git_hash_object(&[fuzz_exe.to_path_buf()], "")?.remove(0);
+    let cache_dir = build_dir.join("fuzz_det_cov_cache").join(fuzz_exe_hash);
+
+    // Collect the checks for all targets. The checks running over a whole corpus in one process
+    // take the longest, so they are scheduled first.
+    let mut corpus_checks = Vec::new();
+    let mut input_checks = Vec::new();
+    let mut num_cached = 0;
+    for fuzz_target in fuzz_targets {
+        let corpus_dir = corpora_dir.join(fuzz_target);
+        let mut entries = read_dir(&corpus_dir)
+            .map_err(|err| {
+                exit_help(&format!(
+                    "The fuzz target's input directory must exist! ({}; {})",
+                    corpus_dir.display(),
+                    err
+                ))
+            })?
+            .map(|entry| entry.expect("IO error").path())
+            .collect::<Vec<_>>();
+        entries.sort();
+        if let Some(entry) = entries.iter().find(|entry| !entry.is_file()) {
+            Err(format!("{} should be a file", entry.display()))?;
+        }
+        let hashes = if entries.is_empty() {
+            vec![]
+        } else {
+            git_hash_object(&entries, "")?
+        };
+        let target_cache_dir = cache_dir.join(fuzz_target);
+        fs::create_dir_all(&target_cache_dir)
+            .map_err(|e| format!("Failed to create {} ({e})", target_cache_dir.display()))?;
+        // First, check that each fuzz input is deterministic running by itself in a process.
+        //
+        // This can catch issues and isolate where a single fuzz input triggers non-determinism, but
+        // all other fuzz inputs are deterministic.
+        //
+        // Also, This can catch issues where several fuzz inputs are non-deterministic, but the sum of
+        // their overall coverage trace remains the same across runs and thus remains undetected.
+        for (entry, hash) in entries.iter().zip(&hashes) {
+            let check = Check {
+                target: fuzz_target.clone(),
+                input: entry.clone(),
+                cache_marker: target_cache_dir.join(hash),
+            };
+            if check.cache_marker.exists() {
+                num_cached += 1;
+            } else {
+                input_checks.push(check);
+            }
+        }
+        // Finally, check that running over all fuzz inputs in one process is deterministic as well.
+        // This can catch issues where mutable global state is leaked from one fuzz input execution to
+        // the next.
+        let corpus_hash = git_hash_object(&[], &hashes.join("\n"))?.remove(0);
+        let check = Check {
+            target: fuzz_target.clone(),
+            input: corpus_dir,
+            cache_marker: target_cache_dir.join(format!("corpus-{corpus_hash}")),
+        };
+        if check.cache_marker.exists() {
+            num_cached += 1;
+        } else {
+            corpus_checks.push(check);
+        }
+    }
+    let checks = corpus_checks
+        .into_iter()
+        .chain(input_checks)
         .collect::<Vec<_>>();
-    entries.sort_by_key(|entry| entry.file_name());
-    let run_single = |run_id: char, entry: &Path, thread_id: usize| -> Result<PathBuf, AppError> {
+
+    let run_single = |run_id: char, check: &Check, thread_id: usize| -> Result<PathBuf, AppError> {
         let cov_txt_path = build_dir.join(format!("fuzz_det_cov.show.t{thread_id}.{run_id}.txt"));
         let profraw_file = build_dir.join(format!("fuzz_det_cov.t{thread_id}.{run_id}.profraw"));
         let profdata_file = build_dir.join(format!("fuzz_det_cov.t{thread_id}.{run_id}.profdata"));
@@ -138,8 +282,8 @@ fn deterministic_coverage(
                 cmd
             }
             .env("LLVM_PROFILE_FILE", &profraw_file)
-            .env("FUZZ", fuzz_target)
-            .arg(entry)
+            .env("FUZZ", &check.target)
+            .arg(&check.input)
             .output()
             .map_err(|e| format!("fuzz failed: {e}"))?;
             if !output.status.success() {
@@ -186,88 +330,98 @@ fn deterministic_coverage(
         };
         Ok(cov_txt_path)
     };
-    let check_diff = |a: &Path, b: &Path, err: &str| -> AppResult {
-        let same = Command::new(GIT)
-            .args(["--no-pager", "diff", "--no-index"])
-            .arg(a)
-            .arg(b)
-            .status()
-            .map_err(|e| format!("{GIT} diff failed with {e}"))?
-            .success();
-        if !same {
-            Err(format!(
-                r#"
-The coverage was not deterministic between runs.
-{err}"#
-            ))?;
+    let run_check = |check: &Check, thread_id: usize| -> Result<Vec<String>, AppError> {
+        let cov_txt_base = run_single('a', check, thread_id)?;
+        let cov_txt_repeat = run_single('b', check, thread_id)?;
+        let diff = diff_coverage(&cov_txt_base, &cov_txt_repeat)?;
+        if diff.is_empty() {
+            File::create(&check.cache_marker)
+                .map_err(|e| format!("Failed to create {} ({e})", check.cache_marker.display()))?;
         }
-        Ok(())
+        Ok(diff)
     };
-    // First, check that each fuzz input is deterministic running by itself in a process.
-    //
-    // This can catch issues and isolate where a single fuzz input triggers non-determinism, but
-    // all other fuzz inputs are deterministic.
-    //
-    // Also, This can catch issues where several fuzz inputs are non-deterministic, but the sum of
-    // their overall coverage trace remains the same across runs and thus remains undetected.
+
     println!(
-        "Check each fuzz input individually ... ({} inputs with parallelism {par})",
-        entries.len()
+        "Check {} fuzz target(s): {} checks with parallelism {par}, {num_cached} checks passed before",
+        fuzz_targets.len(),
+        checks.len()
     );
-    let check_individual = |entry: &DirEntry, thread_id: usize| -> AppResult {
-        let entry = entry.path();
-        if !entry.is_file() {
-            Err(format!("{} should be a file", entry.display()))?;
-        }
-        let cov_txt_base = run_single('a', &entry, thread_id)?;
-        let cov_txt_repeat = run_single('b', &entry, thread_id)?;
-        check_diff(
-            &cov_txt_base,
-            &cov_txt_repeat,
-            &format!("The fuzz target input was {}.", entry.display()),
-        )?;
-        Ok(())
-    };
-    thread::scope(|s| -> AppResult {
-        let mut handles = VecDeque::with_capacity(par);
-        let mut res = Ok(());
-        for (i, entry) in entries.iter().enumerate() {
-            println!("[{}/{}]", i + 1, entries.len());
-            handles.push_back(s.spawn(move || check_individual(entry, i % par)));
-            while handles.len() >= par || i == (entries.len() - 1) || res.is_err() {
-                if let Some(th) = handles.pop_front() {
-                    let thread_result = match th.join() {
-                        Err(_e) => Err("A scoped thread panicked".to_string()),
-                        Ok(r) => r,
-                    };
-                    if thread_result.is_err() {
-                        res = thread_result;
+    // The non-deterministic source locations of each target, with the inputs that triggered them.
+    let report = Mutex::new(BTreeMap::<String, BTreeMap<String, Vec<PathBuf>>>::new());
+    let error = Mutex::new(None);
+    let next = AtomicUsize::new(0);
+    thread::scope(|s| {
+        for thread_id in 0..par {
+            let (checks, report, error, next) = (&checks, &report, &error, &next);
+            s.spawn(move || loop {
+                let i = next.fetch_add(1, Ordering::Relaxed);
+                if i >= checks.len() || error.lock().unwrap().is_some() {
+                    break;
+                }
+                let check = &checks[i];
+                println!(
+                    "[{}/{}] {} {}",
+                    i + 1,
+                    checks.len(),
+                    check.target,
+                    check.input.display()
+                );
+                match run_check(check, thread_id) {
+                    Ok(diff) => {
+                        let mut report = report.lock().unwrap();
+                        let locations = report.entry(check.target.clone()).or_default();
+                        for location in diff {
+                            locations
+                                .entry(location)
+                                .or_default()
+                                .push(check.input.clone());
+                        }
+                    }
+                    Err(e) => {
+                        error.lock().unwrap().get_or_insert(e);
                     }
-                } else {
-                    return res;
                 }
-            }
+            });
         }
-        res
-    })?;
-    // Finally, check that running over all fuzz inputs in one process is deterministic as well.
-    // This can catch issues where mutable global state is leaked from one fuzz input execution to
-    // the next.
-    println!("Check all fuzz inputs in one go ...");
-    {
-        if !corpus_dir.is_dir() {
-            Err(format!("{} should be a folder", corpus_dir.display()))?;
+    });
+    if let Some(e) = error.into_inner().unwrap() {
+        Err(e)?;
+    }
+
+    let report = report.into_inner().unwrap();
+    if report.is_empty() {
+        println!(
+            "✨ Coverage test passed for {}. ✨",
+            fuzz_targets.join(", ")
+        );
+        return Ok(());
+    }
+    let report_dir = build_dir.join("fuzz_det_cov_report");
+    fs::create_dir_all(&report_dir)
+        .map_err(|e| format!("Failed to create {} ({e})", report_dir.display()))?;
+    let mut summary = String::new();
+    for (fuzz_target, locations) in &report {
+        let mut text = String::new();
+        for (location, inputs) in locations {
+            text += &format!("{location}\n");
+            for input in inputs {
+                text += &format!("    {}\n", input.display());
+            }
         }
-        let cov_txt_base = run_single('a', &corpus_dir, 0)?;
-        let cov_txt_repeat = run_single('b', &corpus_dir, 0)?;
-        check_diff(
-            &cov_txt_base,
-            &cov_txt_repeat,
-            &format!("All fuzz inputs in {} were used.", corpus_dir.display()),
-        )?;
+        let report_file = report_dir.join(format!("{fuzz_target}.txt"));
+        fs::write(&report_file, &text)
+            .map_err(|e| format!("Failed to write {} ({e})", report_file.display()))?;
+        summary += &format!(
+            "{fuzz_target}: {} non-deterministic line(s), see {}\n",
+            locations.len(),
+            report_file.display()
+        );
     }
-    println!("✨ Coverage test passed for {fuzz_target}. ✨");
-    Ok(())
+    Err(format!(
+        r#"
+The coverage was not deterministic between runs.
+{summary}"#
+    ))
 }
 
 fn main() -> ExitCode {
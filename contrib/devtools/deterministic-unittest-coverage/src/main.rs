@@ -2,6 +2,7 @@
 // Distributed under the MIT software license, see the accompanying
 // file COPYING or https://opensource.org/license/mit/.
 
+use deterministic_coverage_diff::diff_coverage;
 use std::env;
 use std::fs::File;
 use std::path::{Path, PathBuf};
@@ -127,7 +128,11 @@ fn deterministic_coverage(build_dir: &Path, test_exe: &Path, filter: &str) -> Ap
             .map_err(|e| format!("{GIT} diff failed with {e}"))?
             .success();
         if !same {
-            Err("The coverage was not deterministic between runs.".to_string())?;
+            let locations = diff_coverage(a, b)?;
+            Err(format!(
+                "The coverage was not deterministic between runs. Non-deterministic lines:\n{}",
+                locations.join("\n")
+            ))?;
         }
         Ok(())
     };
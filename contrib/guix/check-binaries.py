@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+'''
+Run the checks of security-check.py and symbol-check.py on a series of
+executables, analyzing the executables concurrently. Each executable is parsed
+once, and the result is shared between both sets of checks.
+
+Exit status will be 0 if successful. Otherwise the exit status will be 1 and it
+will log which executables failed which checks. With --json, a report of all
+executables is written in addition.
+
+Example usage:
+
+    find ../path/to/guix/binaries -type f -executable | xargs python3 contrib/guix/check-binaries.py --json report.json
+'''
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import lief
+
+def load_script(name: str):
+    path = Path(__file__).resolve().parent / f'{name}.py'
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), path)
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+security_check = load_script('security-check')
+symbol_check = load_script('symbol-check')
+
+def check_binary(filename: str) -> dict:
+    '''
+    Parse a binary and run all checks on it. Returns its entry of the report.
+    '''
+    result: dict = {'file': filename}
+    binary = lief.parse(filename)
+    if binary is None:
+        result['error'] = 'not an ELF, PE or Mach-O binary'
+        return result
+    result['format'] = binary.format.name
+    result['architecture'] = binary.abstract.header.architecture.name
+
+    # The checks print the details of failures
+    output = io.StringIO()
+    for key, run_checks in [
+        ('security', lambda: security_check.run_checks(binary)),
+        ('symbols', lambda: symbol_check.run_checks(filename, binary)),
+    ]:
+        try:
+            with contextlib.redirect_stdout(output):
+                result[key] = {'failed': run_checks()}
+        except Exception as e:
+            result[key] = {'error': f'{type(e).__name__}: {e}'}
+    result['messages'] = output.getvalue().splitlines()
+    return result
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of binaries to analyze concurrently (default: %(default)s)')
+    parser.add_argument('--json', metavar='FILE', help="write a JSON report of all binaries to FILE ('-' for stdout)")
+    parser.add_argument('binaries', nargs='+', help='the executables to check')
+    args = parser.parse_args()
+
+    with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(args.binaries)))) as pool:
+        results = list(pool.map(check_binary, args.binaries))
+
+    retval: int = 0
+    # Keep the output of the separate scripts on stderr if the report goes to stdout
+    log = sys.stderr if args.json == '-' else sys.stdout
+    for result in results:
+        for message in result.get('messages', []):
+            print(message, file=log)
+        checks = [result[key] for key in ('security', 'symbols') if key in result]
+        errors = [result['error']] if 'error' in result else [c['error'] for c in checks if 'error' in c]
+        failed = [name for c in checks for name in c.get('failed', [])]
+        for error in errors:
+            print(f'{result["file"]}: error: {error}', file=log)
+        if failed:
+            print(f'{result["file"]}: failed {" ".join(failed)}', file=log)
+        result['ok'] = not errors and not failed
+        if not result['ok']:
+            retval = 1
+
+    if args.json:
+        report = json.dumps({'binaries': results, 'ok': retval == 0}, indent=2)
+        if args.json == '-':
+            print(report)
+        else:
+            with open(args.json, 'w', encoding='utf8') as f:
+                f.write(report + '\n')
+    return retval
+
+if __name__ == '__main__':
+    sys.exit(main())
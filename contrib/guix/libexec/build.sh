@@ -195,12 +195,10 @@ mkdir -p "$DISTSRC"
             ;;
     esac
 
-    # Perform basic security checks on installed executables.
-    echo "Checking binary security on installed executables..."
-    python3 "${DISTSRC}/contrib/guix/security-check.py" "${INSTALLPATH}/bin/"* "${INSTALLPATH}/libexec/"*
-    # Check that executables only contain allowed version symbols.
-    echo "Running symbol and dynamic library checks on installed executables..."
-    python3 "${DISTSRC}/contrib/guix/symbol-check.py" "${INSTALLPATH}/bin/"* "${INSTALLPATH}/libexec/"*
+    # Perform basic security checks on installed executables, and check that
+    # they only contain allowed version symbols and libraries.
+    echo "Running security, symbol and dynamic library checks on installed executables..."
+    python3 "${DISTSRC}/contrib/guix/check-binaries.py" --jobs "$JOBS" "${INSTALLPATH}/bin/"* "${INSTALLPATH}/libexec/"*
 )  # $DISTSRC
 
 # shellcheck source=package.sh
@@ -275,18 +275,24 @@ CHECKS = {
     }
 }
 
+def run_checks(binary) -> list[str]:
+    '''
+    Return the names of the checks a parsed binary failed.
+    '''
+    etype = binary.format
+    arch = binary.abstract.header.architecture
+
+    failed: list[str] = []
+    for (name, func) in CHECKS[etype][arch]:
+        if not func(binary):
+            failed.append(name)
+    return failed
+
 if __name__ == '__main__':
     retval: int = 0
     for filename in sys.argv[1:]:
         binary = lief.parse(filename)
-
-        etype = binary.format
-        arch = binary.abstract.header.architecture
-
-        failed: list[str] = []
-        for (name, func) in CHECKS[etype][arch]:
-            if not func(binary):
-                failed.append(name)
+        failed = run_checks(binary)
         if failed:
             print(f'{filename}: failed {" ".join(failed)}')
             retval = 1
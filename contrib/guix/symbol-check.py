@@ -44,6 +44,9 @@ MAX_VERSIONS = {
     }
 }
 
+# The binary being checked, for messages
+filename = ''
+
 # Ignore symbols that are exported as part of every executable
 IGNORE_EXPORTS = {
 'stdin', 'stdout', 'stderr',
@@ -301,17 +304,26 @@ lief.Binary.FORMATS.PE: [
 ]
 }
 
+def run_checks(path: str, binary) -> list[str]:
+    '''
+    Return the names of the checks a parsed binary failed. Details are printed
+    with the given path.
+    '''
+    global filename
+    filename = path
+    etype = binary.format
+
+    failed: list[str] = []
+    for (name, func) in CHECKS[etype]:
+        if not func(binary):
+            failed.append(name)
+    return failed
+
 if __name__ == '__main__':
     retval: int = 0
     for filename in sys.argv[1:]:
         binary = lief.parse(filename)
-
-        etype = binary.format
-
-        failed: list[str] = []
-        for (name, func) in CHECKS[etype]:
-            if not func(binary):
-                failed.append(name)
+        failed = run_checks(filename, binary)
         if failed:
             print(f'{filename}: failed {" ".join(failed)}')
             retval = 1
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+'''
+Test check-binaries.py on ELF executables built locally with the compiler in CC
+(default: gcc), for the architecture of this machine.
+
+Example usage:
+
+    python3 contrib/guix/test-check-binaries.py
+'''
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+CHECK_BINARIES = Path(__file__).resolve().parent / 'check-binaries.py'
+
+SOURCE = '''
+#include <stdio.h>
+#include <string.h>
+
+int main(int argc, char **argv)
+{
+    char buf[16];
+    strcpy(buf, argv[0]);
+    printf("%s %d\\n", buf, argc);
+    return 0;
+}
+'''
+
+# Flags of the release build, see CMakeLists.txt
+HARDENED = ['-O2', '-D_FORTIFY_SOURCE=3', '-fstack-protector-all', '-fPIE', '-pie',
+            '-Wl,-z,relro', '-Wl,-z,now', '-Wl,-z,separate-code', '-Wl,-z,noexecstack']
+if platform.machine() == 'x86_64':
+    HARDENED.append('-fcf-protection=full')
+
+# Executables built with the hardened flags plus some changes, and the checks
+# they are expected to fail
+FIXTURES = {
+    'hardened': ([], []),
+    'no_canary': (['-fno-stack-protector'], ['CANARY']),
+    'no_fortify': (['-U_FORTIFY_SOURCE', '-D_FORTIFY_SOURCE=0'], ['FORTIFY']),
+    'no_pie': (['-fno-PIE', '-no-pie'], ['PIE']),
+    'no_relro': (['-Wl,-z,norelro'], ['RELRO']),
+    'lazy_binding': (['-Wl,-z,lazy'], ['RELRO']),
+    'no_separate_code': (['-Wl,-z,noseparate-code'], ['SEPARATE_CODE']),
+    'exec_stack': (['-Wl,-z,execstack'], ['NX']),
+    'exports': (['-rdynamic'], ['EXPORTED_SYMBOLS']),
+    'libraries': (['-Wl,--no-as-needed', '-L.', '-lfixture'], ['LIBRARY_DEPENDENCIES']),
+}
+if platform.machine() == 'x86_64':
+    FIXTURES['no_control_flow'] = (['-fcf-protection=none'], ['CONTROL_FLOW'])
+
+# Whether these pass depends on the versions of the libraries on this machine
+HOST_DEPENDENT_CHECKS = {'IMPORTED_SYMBOLS'}
+
+def build(cc: list[str], directory: Path, name: str, flags: list[str]) -> Path:
+    source = directory / 'test.c'
+    source.write_text(SOURCE)
+    executable = directory / name
+    subprocess.run(cc + HARDENED + flags + [str(source), '-o', str(executable)], check=True, cwd=directory)
+    return executable
+
+def build_library(cc: list[str], directory: Path) -> None:
+    source = directory / 'fixture.c'
+    source.write_text('int fixture(void) { return 0; }\n')
+    subprocess.run(cc + ['-shared', '-fPIC', str(source), '-o', str(directory / 'libfixture.so')], check=True)
+
+def failed_checks(entry: dict) -> list[str]:
+    return sorted(set(entry['security']['failed'] + entry['symbols']['failed']) - HOST_DEPENDENT_CHECKS)
+
+class TestCheckBinaries(unittest.TestCase):
+    def test_ELF(self):
+        cc = os.getenv('CC', 'gcc').split()
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp_dir = Path(tmp)
+            build_library(cc, tmp_dir)
+            executables = {build(cc, tmp_dir, name, flags): expected for name, (flags, expected) in FIXTURES.items()}
+            # symbol-check.py asserts that there is no RUNPATH. The error is
+            # reported without hiding the results of the security checks.
+            runpath = build(cc, tmp_dir, 'runpath', ['-Wl,-rpath,/tmp', '-Wl,--enable-new-dtags'])
+            not_a_binary = tmp_dir / 'test.c'
+            report_file = tmp_dir / 'report.json'
+
+            # All executables are analyzed by a single concurrent run
+            result = subprocess.run(
+                [sys.executable, CHECK_BINARIES, '--json', report_file, '-j', '4', *executables, runpath, not_a_binary],
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+            self.assertEqual(result.returncode, 1, result.stdout)
+            report = json.loads(report_file.read_text())
+            self.assertFalse(report['ok'])
+
+            entries = report['binaries']
+            self.assertEqual([e['file'] for e in entries], [str(e) for e in [*executables, runpath, not_a_binary]])
+            self.assertEqual(entries[-1]['error'], 'not an ELF, PE or Mach-O binary')
+            self.assertEqual(entries[-2]['security']['failed'], [])
+            self.assertTrue(entries[-2]['symbols']['error'].startswith('AssertionError'))
+            self.assertFalse(entries[-2]['ok'])
+            for entry, (executable, expected) in zip(entries, executables.items()):
+                with self.subTest(executable=executable.name):
+                    self.assertEqual(entry['format'], 'ELF')
+                    self.assertNotIn('error', entry['security'])
+                    self.assertNotIn('error', entry['symbols'])
+                    self.assertEqual(failed_checks(entry), sorted(expected))
+                    self.assertEqual(entry['ok'], not entry['security']['failed'] and not entry['symbols']['failed'])
+                    if expected:
+                        self.assertIn(f"{executable}: failed {' '.join(entry['security']['failed'] + entry['symbols']['failed'])}", result.stdout)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,6 +9,8 @@
 
 import struct
 import re
+import mmap
+import multiprocessing
 import os
 import os.path
 import sys
@@ -16,13 +18,20 @@ import hashlib
 import datetime
 import time
 import glob
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from contextlib import nullcontext
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../test/functional'))
+
+from test_framework.util import util_xor  # noqa: E402
 
 settings = {}
 
+def calc_hash(blk_hdr):
+    return hashlib.sha256(hashlib.sha256(blk_hdr).digest()).digest()
+
 def calc_hash_str(blk_hdr):
-    blk_hdr_hash = hashlib.sha256(hashlib.sha256(blk_hdr).digest()).digest()
-    return blk_hdr_hash[::-1].hex()
+    return calc_hash(blk_hdr)[::-1].hex()
 
 def get_blk_dt(blk_hdr):
     members = struct.unpack("<I", blk_hdr[68:68+4])
@@ -32,14 +41,22 @@ def get_blk_dt(blk_hdr):
     return (dt_ym, nTime)
 
 # When getting the list of block hashes, undo any byte reversals.
+# Hashes are kept as raw bytes in internal byte order, as in the block headers,
+# so a binary hash list from linearize-hashes.py can be used without parsing.
 def get_block_hashes(settings):
     blkindex = []
-    with open(settings['hashlist'], "r") as f:
-        for line in f:
-            line = line.rstrip()
-            if settings['rev_hash_bytes'] == 'true':
-                line = bytes.fromhex(line)[::-1].hex()
-            blkindex.append(line)
+    if settings['hash_format'] == 'binary':
+        with open(settings['hashlist'], "rb") as f:
+            data = f.read()
+        blkindex = [data[pos:pos + 32] for pos in range(0, len(data) - 31, 32)]
+    else:
+        with open(settings['hashlist'], "r") as f:
+            for line in f:
+                line = line.rstrip()
+                if settings['rev_hash_bytes'] == 'true':
+                    blkindex.append(bytes.fromhex(line))
+                else:
+                    blkindex.append(bytes.fromhex(line)[::-1])
 
     print("Read " + str(len(blkindex)) + " hashes")
 
@@ -86,10 +103,83 @@ def read_xor_key(blocks_path):
     except FileNotFoundError:
         return bytes([0] * NUM_XOR_BYTES)
 
-# Block header and extent on disk
-BlockExtent = namedtuple('BlockExtent', ['fn', 'offset', 'inhdr', 'blkhdr', 'size'])
+def find_magic(data, start, magic_patterns):
+    '''Return the position of the next network magic at or after start, or -1.
+
+    magic_patterns[i] is the network magic as it appears on disk at positions
+    that are equal to i modulo the XOR key length.'''
+    found = -1
+    for phase, pattern in enumerate(magic_patterns):
+        end = len(data) if found < 0 else found
+        pos = data.find(pattern, start, end)
+        while pos >= 0 and pos % len(magic_patterns) != phase:
+            pos = data.find(pattern, pos + 1, end)
+        if pos >= 0:
+            found = pos
+    return found
+
+def scan_block_file(args):
+    '''Find the blocks in a block file.
+
+    Returns the file number and a list of (hash, offset, size) tuples, where offset
+    is the position of the 8-byte magic and length header in the file and size is
+    the length of the block that follows it. Only the headers are de-obfuscated.'''
+    fn, fname, netmagic, xor_key = args
+    blocks = []
+    with open(fname, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        if file_size == 0:
+            return fn, blocks
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic_patterns = [util_xor(netmagic, xor_key, offset=phase) for phase in range(len(xor_key))]
+            pos = 0
+            while pos + 8 + 80 <= file_size:
+                inhdr = util_xor(mm[pos:pos + 8], xor_key, offset=pos)
+                if inhdr[:4] != netmagic:
+                    # Skip to the next magic bytes, e.g. over the zero padding at the end of the file
+                    pos = find_magic(mm, pos + 1, magic_patterns)
+                    if pos < 0:
+                        break
+                    continue
+                size = struct.unpack("<I", inhdr[4:])[0]
+                if size < 80 or pos + 8 + size > file_size:
+                    pos = find_magic(mm, pos + 1, magic_patterns)
+                    if pos < 0:
+                        break
+                    continue
+                blk_hdr = util_xor(mm[pos + 8:pos + 8 + 80], xor_key, offset=pos + 8)
+                blocks.append((calc_hash(blk_hdr), pos, size))
+                pos += 8 + size
+    return fn, blocks
+
+def copy_file_data(in_fd, out_fd, offset, count):
+    '''Append count bytes at offset of in_fd to out_fd, letting the kernel copy the data where possible.'''
+    end = offset + count
+    while offset < end:
+        try:
+            if hasattr(os, "copy_file_range"):
+                copied = os.copy_file_range(in_fd, out_fd, end - offset, offset)
+            else:
+                copied = os.sendfile(out_fd, in_fd, offset, end - offset)
+        except (AttributeError, OSError):
+            copied = 0
+        if copied == 0:
+            # Kernel copy not supported between these files: copy through user space
+            data = os.pread(in_fd, end - offset, offset)
+            if not data:
+                raise IOError("Unexpected end of block file")
+            copied = os.write(out_fd, data)
+        offset += copied
+
+# Block extent on disk: position of the 8-byte magic and length header, and length of the block
+BlockExtent = namedtuple('BlockExtent', ['fn', 'offset', 'size'])
 
 class BlockDataCopier:
+    '''Copy blocks to the output in height order.
+
+    Runs in two phases: first all input block files are scanned in parallel to
+    build an index of the block extents, then the blocks are copied in height
+    order from that index. Without an XOR key, the data is copied by the kernel.'''
     def __init__(self, settings, blkindex, blkmap):
         self.settings = settings
         self.blkindex = blkindex
@@ -98,7 +188,6 @@ class BlockDataCopier:
         # Get first occurring block file id - for pruned nodes this
         # will not necessarily be 0
         self.inFn = getFirstBlockFileId(self.settings['input'])
-        self.inF = None
         self.outFn = 0
         self.outsz = 0
         self.outF = None
@@ -119,20 +208,11 @@ class BlockDataCopier:
             self.setFileTime = True
         if settings['split_timestamp'] != 0:
             self.timestampSplit = True
-        # Extents and cache for out-of-order blocks
-        self.blockExtents = {}
-        self.outOfOrderData = {}
-        self.outOfOrderSize = 0 # running total size for items in outOfOrderData
-
-    def read_xored(self, f, size):
-        offset = f.tell()
-        data = bytearray(f.read(size))
-        for i in range(len(data)):
-            data[i] ^= self.xor_key[(i + offset) % len(self.xor_key)]
-        return bytes(data)
-
-    def writeBlock(self, inhdr, blk_hdr, rawblock):
-        blockSizeOnDisk = len(inhdr) + len(blk_hdr) + len(rawblock)
+        # Open input files (file, mmap) by file number, least recently used first
+        self.inFiles = OrderedDict()
+
+    def startBlock(self, blockSizeOnDisk, blk_hdr):
+        '''Switch to a new output file if needed before writing a block.'''
         if not self.fileOutput and ((self.outsz + blockSizeOnDisk) > self.maxOutSz):
             self.outF.close()
             if self.setFileTime:
@@ -162,11 +242,10 @@ class BlockDataCopier:
                 self.outFname = os.path.join(self.settings['output'], "blk%05d.dat" % self.outFn)
             print("Output file " + self.outFname)
             self.outF = open(self.outFname, "wb")
+        return blkTS
 
-        self.outF.write(inhdr)
-        self.outF.write(blk_hdr)
-        self.outF.write(rawblock)
-        self.outsz = self.outsz + len(inhdr) + len(blk_hdr) + len(rawblock)
+    def finishBlock(self, blockSizeOnDisk, blkTS):
+        self.outsz = self.outsz + blockSizeOnDisk
 
         self.blkCountOut = self.blkCountOut + 1
         if blkTS > self.highTS:
@@ -179,86 +258,81 @@ class BlockDataCopier:
     def inFileName(self, fn):
         return os.path.join(self.settings['input'], "blk%05d.dat" % fn)
 
-    def fetchBlock(self, extent):
-        '''Fetch block contents from disk given extents'''
-        with open(self.inFileName(extent.fn), "rb") as f:
-            f.seek(extent.offset)
-            return self.read_xored(f, extent.size)
-
-    def copyOneBlock(self):
-        '''Find the next block to be written in the input, and copy it to the output.'''
-        extent = self.blockExtents.pop(self.blkCountOut)
-        if self.blkCountOut in self.outOfOrderData:
-            # If the data is cached, use it from memory and remove from the cache
-            rawblock = self.outOfOrderData.pop(self.blkCountOut)
-            self.outOfOrderSize -= len(rawblock)
-        else: # Otherwise look up data on disk
-            rawblock = self.fetchBlock(extent)
-
-        self.writeBlock(extent.inhdr, extent.blkhdr, rawblock)
+    def inFile(self, fn):
+        '''Return the open file and mmap of an input file, keeping a bounded number of them open.'''
+        if fn in self.inFiles:
+            self.inFiles.move_to_end(fn)
+            return self.inFiles[fn]
+        if len(self.inFiles) >= self.settings['max_open_files']:
+            _, (f, mm) = self.inFiles.popitem(last=False)
+            mm.close()
+            f.close()
+        f = open(self.inFileName(fn), "rb")
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.inFiles[fn] = (f, mm)
+        return f, mm
+
+    def buildIndex(self):
+        '''Scan all input files and return the extents of the known blocks by height.'''
+        fns = []
+        fn = self.inFn
+        while os.path.exists(self.inFileName(fn)):
+            fns.append(fn)
+            fn += 1
+        jobs = [(fn, self.inFileName(fn), self.settings['netmagic'], self.xor_key) for fn in fns]
+
+        extents = {}
+        workers = min(self.settings['scan_workers'], len(jobs))
+        with multiprocessing.Pool(workers) if workers > 1 else nullcontext() as pool:
+            results = pool.imap_unordered(scan_block_file, jobs) if pool else map(scan_block_file, jobs)
+            for fn, blocks in results:
+                print("Input file " + self.inFileName(fn))
+                for blk_hash, offset, size in blocks:
+                    if blk_hash not in self.blkmap:
+                        # Because blocks can be written to files out-of-order as of 0.10, the script
+                        # may encounter blocks it doesn't know about. Treat as debug output.
+                        if self.settings['debug_output'] == 'true':
+                            print("Skipping unknown block " + blk_hash[::-1].hex())
+                        continue
+                    blkHeight = self.blkmap[blk_hash]
+                    extent = BlockExtent(fn, offset, size)
+                    if blkHeight not in extents:
+                        self.blkCountIn += 1
+                    elif (extents[blkHeight].fn, extents[blkHeight].offset) < (fn, offset):
+                        # Keep the first copy of a block that is stored more than once
+                        continue
+                    extents[blkHeight] = extent
+        return extents
+
+    def copyBlock(self, extent):
+        '''Copy a block, including its magic and length header, to the output.'''
+        f, mm = self.inFile(extent.fn)
+        hdr_offset = extent.offset + 8
+        blk_hdr = util_xor(mm[hdr_offset:hdr_offset + 80], self.xor_key, offset=hdr_offset)
+        self.hash_str = calc_hash_str(blk_hdr)
+        blockSizeOnDisk = 8 + extent.size
+        blkTS = self.startBlock(blockSizeOnDisk, blk_hdr)
+        if any(self.xor_key):
+            self.outF.write(util_xor(mm[extent.offset:extent.offset + blockSizeOnDisk], self.xor_key, offset=extent.offset))
+        else:
+            self.outF.flush()
+            copy_file_data(f.fileno(), self.outF.fileno(), extent.offset, blockSizeOnDisk)
+        self.finishBlock(blockSizeOnDisk, blkTS)
 
     def run(self):
-        while self.blkCountOut < len(self.blkindex):
-            if not self.inF:
-                fname = self.inFileName(self.inFn)
-                print("Input file " + fname)
-                try:
-                    self.inF = open(fname, "rb")
-                except IOError:
+        extents = self.buildIndex()
+        try:
+            while self.blkCountOut < len(self.blkindex):
+                if self.blkCountOut not in extents:
                     print("Premature end of block data")
                     return
-
-            inhdr = self.read_xored(self.inF, 8)
-            if (not inhdr or (inhdr[0] == "\0")):
-                self.inF.close()
-                self.inF = None
-                self.inFn = self.inFn + 1
-                continue
-
-            inMagic = inhdr[:4]
-            if (inMagic != self.settings['netmagic']):
-                # Seek backwards 7 bytes (skipping the first byte in the previous search)
-                # and continue searching from the new position if the magic bytes are not
-                # found.
-                self.inF.seek(-7, os.SEEK_CUR)
-                continue
-            inLenLE = inhdr[4:]
-            su = struct.unpack("<I", inLenLE)
-            inLen = su[0] - 80 # length without header
-            blk_hdr = self.read_xored(self.inF, 80)
-            inExtent = BlockExtent(self.inFn, self.inF.tell(), inhdr, blk_hdr, inLen)
-
-            self.hash_str = calc_hash_str(blk_hdr)
-            if self.hash_str not in blkmap:
-                # Because blocks can be written to files out-of-order as of 0.10, the script
-                # may encounter blocks it doesn't know about. Treat as debug output.
-                if settings['debug_output'] == 'true':
-                    print("Skipping unknown block " + self.hash_str)
-                self.inF.seek(inLen, os.SEEK_CUR)
-                continue
-
-            blkHeight = self.blkmap[self.hash_str]
-            self.blkCountIn += 1
-
-            if self.blkCountOut == blkHeight:
-                # If in-order block, just copy
-                rawblock = self.read_xored(self.inF, inLen)
-                self.writeBlock(inhdr, blk_hdr, rawblock)
-
-                # See if we can catch up to prior out-of-order blocks
-                while self.blkCountOut in self.blockExtents:
-                    self.copyOneBlock()
-
-            else: # If out-of-order, skip over block data for now
-                self.blockExtents[blkHeight] = inExtent
-                if self.outOfOrderSize < self.settings['out_of_order_cache_sz']:
-                    # If there is space in the cache, read the data
-                    # Reading the data in file sequence instead of seeking and fetching it later is preferred,
-                    # but we don't want to fill up memory
-                    self.outOfOrderData[blkHeight] = self.read_xored(self.inF, inLen)
-                    self.outOfOrderSize += inLen
-                else: # If no space in cache, seek forward
-                    self.inF.seek(inLen, os.SEEK_CUR)
+                self.copyBlock(extents[self.blkCountOut])
+        finally:
+            if self.outF:
+                self.outF.close()
+            for f, mm in self.inFiles.values():
+                mm.close()
+                f.close()
 
         print("Done (%i blocks written)" % (self.blkCountOut))
 
@@ -300,17 +374,23 @@ if __name__ == '__main__':
         settings['split_timestamp'] = 0
     if 'max_out_sz' not in settings:
         settings['max_out_sz'] = 1000 * 1000 * 1000
-    if 'out_of_order_cache_sz' not in settings:
-        settings['out_of_order_cache_sz'] = 100 * 1000 * 1000
+    if 'scan_workers' not in settings:
+        settings['scan_workers'] = os.cpu_count() or 1
+    if 'max_open_files' not in settings:
+        settings['max_open_files'] = 64
     if 'debug_output' not in settings:
         settings['debug_output'] = 'false'
+    if 'hash_format' not in settings:
+        settings['hash_format'] = 'hex'
 
     settings['max_out_sz'] = int(settings['max_out_sz'])
     settings['split_timestamp'] = int(settings['split_timestamp'])
     settings['file_timestamp'] = int(settings['file_timestamp'])
     settings['netmagic'] = bytes.fromhex(settings['netmagic'])
-    settings['out_of_order_cache_sz'] = int(settings['out_of_order_cache_sz'])
+    settings['scan_workers'] = int(settings['scan_workers'])
+    settings['max_open_files'] = int(settings['max_open_files'])
     settings['debug_output'] = settings['debug_output'].lower()
+    settings['hash_format'] = settings['hash_format'].lower()
 
     if 'output_file' not in settings and 'output' not in settings:
         print("Missing output file / directory")
@@ -320,7 +400,7 @@ if __name__ == '__main__':
     blkmap = mkblockmap(blkindex)
 
     # Block hash map won't be byte-reversed. Neither should the genesis hash.
-    if settings['genesis'] not in blkmap:
+    if bytes.fromhex(settings['genesis'])[::-1] not in blkmap:
         print("Genesis block not found in hashlist")
     else:
         BlockDataCopier(settings, blkindex, blkmap).run()
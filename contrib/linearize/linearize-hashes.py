@@ -7,6 +7,8 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 #
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from http.client import HTTPConnection
 import json
 import re
@@ -14,6 +16,7 @@ import base64
 import sys
 import os
 import os.path
+import threading
 
 settings = {}
 
@@ -58,32 +61,106 @@ class BitcoinRPC:
     def response_is_error(resp_obj):
         return 'error' in resp_obj and resp_obj['error'] is not None
 
-def get_block_hashes(settings, max_blocks_per_call=10000):
-    rpc = BitcoinRPC(settings['host'], settings['port'],
-             settings['rpcuser'], settings['rpcpassword'])
-
+# Per-thread RPC connection used by fetch_block_hashes
+rpc_local = threading.local()
+
+def fetch_block_hashes(settings, height, num_blocks):
+    '''Fetch the hashes of num_blocks blocks starting at height, as hex strings.'''
+    if not hasattr(rpc_local, 'rpc'):
+        rpc_local.rpc = BitcoinRPC(settings['host'], settings['port'],
+                 settings['rpcuser'], settings['rpcpassword'])
+    rpc = rpc_local.rpc
+
+    batch = []
+    for x in range(num_blocks):
+        batch.append(rpc.build_request(x, 'getblockhash', [height + x]))
+
+    reply = rpc.execute(batch)
+    if reply is None:
+        return None
+
+    hashes = []
+    for x,resp_obj in enumerate(reply):
+        if rpc.response_is_error(resp_obj):
+            print('JSON-RPC: error at height', height+x, ': ', resp_obj['error'], file=sys.stderr)
+            sys.exit(1)
+        assert resp_obj['id'] == x  # assume replies are in-sequence
+        hashes.append(resp_obj['result'])
+    return hashes
+
+def encode_hashes(settings, hashes):
+    if settings['hash_format'] == 'binary':
+        # Raw 32-byte hashes in internal byte order, as in serialized block headers
+        return b"".join(bytes.fromhex(h)[::-1] for h in hashes)
+    if settings['rev_hash_bytes'] == 'true':
+        hashes = [bytes.fromhex(h)[::-1].hex() for h in hashes]
+    return "".join(h + "\n" for h in hashes).encode()
+
+def open_hashes_file(settings):
+    '''Open the hashes file for appending and return it with the height to continue at.
+
+    A checkpoint next to the hashes file records the file size and next height
+    after every batch that has been written and synced to disk. When resuming,
+    anything written after the last checkpoint is discarded.'''
+    filename = settings['hashes_file']
+    checkpoint_filename = filename + '.checkpoint'
+    params = {key: settings[key] for key in ('min_height', 'hash_format', 'rev_hash_bytes')}
     height = settings['min_height']
-    while height < settings['max_height']+1:
-        num_blocks = min(settings['max_height']+1-height, max_blocks_per_call)
-        batch = []
-        for x in range(num_blocks):
-            batch.append(rpc.build_request(x, 'getblockhash', [height + x]))
-
-        reply = rpc.execute(batch)
-        if reply is None:
-            print('Cannot continue. Program will halt.')
-            return None
+    size = 0
+    if os.path.exists(checkpoint_filename):
+        with open(checkpoint_filename, 'r') as f:
+            checkpoint = json.load(f)
+        if checkpoint['params'] != params:
+            print('Checkpoint %s was written with different settings %s' % (checkpoint_filename, checkpoint['params']), file=sys.stderr)
+            sys.exit(1)
+        height = checkpoint['height']
+        size = checkpoint['size']
+        print('Resuming at height %d' % height, file=sys.stderr)
+    elif os.path.exists(filename) and os.path.getsize(filename) > 0:
+        print('%s exists but has no checkpoint, not appending to it' % filename, file=sys.stderr)
+        sys.exit(1)
+    f = open(filename, 'ab')
+    f.truncate(size)
+    return f, height, lambda height: write_checkpoint(checkpoint_filename, params, f, height)
 
-        for x,resp_obj in enumerate(reply):
-            if rpc.response_is_error(resp_obj):
-                print('JSON-RPC: error at height', height+x, ': ', resp_obj['error'], file=sys.stderr)
-                sys.exit(1)
-            assert resp_obj['id'] == x  # assume replies are in-sequence
-            if settings['rev_hash_bytes'] == 'true':
-                resp_obj['result'] = bytes.fromhex(resp_obj['result'])[::-1].hex()
-            print(resp_obj['result'])
+def write_checkpoint(checkpoint_filename, params, f, height):
+    f.flush()
+    os.fsync(f.fileno())
+    with open(checkpoint_filename + '.new', 'w') as cf:
+        json.dump({'params': params, 'height': height, 'size': f.tell()}, cf)
+    os.replace(checkpoint_filename + '.new', checkpoint_filename)
 
-        height += num_blocks
+def get_block_hashes(settings, max_blocks_per_call=10000):
+    '''Fetch the block hashes over several RPC connections and output them in height order.
+
+    Up to two batches per connection are in flight at the same time.'''
+    if 'hashes_file' in settings:
+        out, height, checkpoint = open_hashes_file(settings)
+    else:
+        out, height, checkpoint = sys.stdout.buffer, settings['min_height'], lambda height: out.flush()
+
+    max_in_flight = 2 * settings['rpc_connections']
+    try:
+        with ThreadPoolExecutor(settings['rpc_connections']) as executor:
+            pending = deque()
+            while height < settings['max_height']+1 or pending:
+                while height < settings['max_height']+1 and len(pending) < max_in_flight:
+                    num_blocks = min(settings['max_height']+1-height, max_blocks_per_call)
+                    pending.append((height + num_blocks, executor.submit(fetch_block_hashes, settings, height, num_blocks)))
+                    height += num_blocks
+
+                next_height, future = pending.popleft()
+                hashes = future.result()
+                if hashes is None:
+                    for _, f in pending:
+                        f.cancel()
+                    print('Cannot continue. Program will halt.')
+                    return None
+                out.write(encode_hashes(settings, hashes))
+                checkpoint(next_height)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
 
 def get_rpc_cookie():
     # Open the cookie file
@@ -121,6 +198,10 @@ if __name__ == '__main__':
         settings['max_height'] = 313000
     if 'rev_hash_bytes' not in settings:
         settings['rev_hash_bytes'] = 'false'
+    if 'hash_format' not in settings:
+        settings['hash_format'] = 'hex'
+    if 'rpc_connections' not in settings:
+        settings['rpc_connections'] = 4
 
     use_userpass = True
     use_datadir = False
@@ -135,6 +216,11 @@ if __name__ == '__main__':
     settings['port'] = int(settings['port'])
     settings['min_height'] = int(settings['min_height'])
     settings['max_height'] = int(settings['max_height'])
+    settings['rpc_connections'] = int(settings['rpc_connections'])
+    settings['hash_format'] = settings['hash_format'].lower()
+    if settings['hash_format'] not in ('hex', 'binary'):
+        print("hash_format must be hex or binary", file=sys.stderr)
+        sys.exit(1)
 
     # Force hash byte format setting to be lowercase to make comparisons easier.
     settings['rev_hash_bytes'] = settings['rev_hash_bytes'].lower()
@@ -5,22 +5,31 @@
 """Parse message capture binary files.  To be used in conjunction with -capturemessages."""
 
 import argparse
+from collections import deque
+import heapq
+import multiprocessing
 import os
 import shutil
 import sys
 from io import BytesIO
 import json
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Iterable, Iterator, Optional
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../../test/functional'))
 
+from test_framework.message_capture import (    # noqa: E402
+    HEADER_SIZE,
+    MSGTYPE_SIZE,
+    TIME_SIZE,
+    CapturedMessage,
+    read_capture_file,
+)
 from test_framework.messages import ser_uint256     # noqa: E402
 from test_framework.p2p import MESSAGEMAP           # noqa: E402
 
-TIME_SIZE = 8
-LENGTH_SIZE = 4
-MSGTYPE_SIZE = 12
+# Number of messages sent to a worker process at once
+BATCH_SIZE = 256
 
 # The test framework classes stores hashes as large ints in many cases.
 # These are variables of type uint256 in core.
@@ -92,79 +101,135 @@ def to_jsonable(obj: Any) -> Any:
         return obj
 
 
-def process_file(path: str, messages: list[Any], recv: bool, progress_bar: Optional[ProgressBar]) -> None:
-    with open(path, 'rb') as f_in:
+def message_to_json(path: str, peer: str, recv: bool, msg: CapturedMessage) -> tuple[str, Optional[str]]:
+    """Deserialize a captured message and return it as JSON, plus a warning if it could not be deserialized."""
+    msgtype = msg.msgtype
+    # Start converting the message to a dictionary
+    msg_dict = {}
+    msg_dict["direction"] = "recv" if recv else "sent"
+    msg_dict["peer"] = peer
+    msg_dict["time"] = msg.time
+    msg_dict["size"] = len(msg.payload)   # "size" is less readable here, but more readable in the output
+
+    # Determine message type
+    if msgtype not in MESSAGEMAP:
+        # Unrecognized message type
+        try:
+            msgtype_tmp = msgtype.decode()
+            if not msgtype_tmp.isprintable():
+                raise UnicodeDecodeError
+            msg_dict["msgtype"] = msgtype_tmp
+        except UnicodeDecodeError:
+            msg_dict["msgtype"] = "UNREADABLE"
+        msg_dict["body"] = msg.payload.hex()
+        msg_dict["error"] = "Unrecognized message type."
+        return json.dumps(msg_dict), f"WARNING - Unrecognized message type {msgtype} in {path}"
+
+    # Deserialize the message
+    msg_obj = MESSAGEMAP[msgtype]()
+    msg_dict["msgtype"] = msgtype.decode()
+
+    try:
+        msg_obj.deserialize(BytesIO(msg.payload))
+    except KeyboardInterrupt:
+        raise
+    except Exception:
+        # Unable to deserialize message body
+        msg_dict["body"] = msg.payload.hex()
+        msg_dict["error"] = "Unable to deserialize message."
+        return json.dumps(msg_dict), f"WARNING - Unable to deserialize message in {path}"
+
+    # Convert body of message into a jsonable object
+    if msg.payload:
+        msg_dict["body"] = to_jsonable(msg_obj)
+    return json.dumps(msg_dict), None
+
+
+def messages_to_json(batch: list[tuple[str, str, bool, CapturedMessage]]) -> list[tuple[str, Optional[str]]]:
+    return [message_to_json(*item) for item in batch]
+
+
+def capture_peer(capture: Path) -> str:
+    """Return the peer address of a capture file, from the name of its directory."""
+    # The node replaces colons in the address, since Windows folder names cannot include them
+    return capture.parent.name.replace('_', ':')
+
+
+def is_chronological(capture: Path) -> bool:
+    """Return whether the messages of a capture file are in chronological order.
+
+    The node takes the capture timestamps from the mockable clock, so e.g.
+    setmocktime can move them backwards. Only the record headers are read."""
+    size = capture.stat().st_size
+    last_time = 0
+    with open(capture, 'rb') as f:
+        pos = 0
+        while pos + HEADER_SIZE <= size:
+            header = f.read(HEADER_SIZE)
+            msg_time = int.from_bytes(header[:TIME_SIZE], "little")
+            if msg_time < last_time:
+                return False
+            last_time = msg_time
+            pos += HEADER_SIZE + int.from_bytes(header[TIME_SIZE + MSGTYPE_SIZE:], "little")
+            f.seek(pos)
+    return True
+
+
+def read_messages(capture: Path, msgtypes: Optional[set[bytes]], exclude_msgtypes: set[bytes], progress_bar: Optional[ProgressBar]) -> Iterator[tuple[str, str, bool, CapturedMessage]]:
+    """Iterate over the messages of a capture file that pass the message type filters.
+
+    The filters are applied before a message is deserialized, so that skipping
+    large messages like blocks is cheap."""
+    path = str(capture)
+    peer = capture_peer(capture)
+    recv = "recv" in capture.stem
+    for msg in read_capture_file(path):
         if progress_bar:
-            bytes_read = 0
+            progress_bar.update(HEADER_SIZE + len(msg.payload))
+        if (msgtypes is not None and msg.msgtype not in msgtypes) or msg.msgtype in exclude_msgtypes:
+            continue
+        yield path, peer, recv, msg
+
 
+def batched(iterable: Iterable[Any], size: int) -> Iterator[list[Any]]:
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def process_messages(messages: Iterable[tuple[str, str, bool, CapturedMessage]], jobs: int) -> Iterator[str]:
+    """Deserialize the messages, in order, and iterate over them as JSON.
+
+    With more than one job, batches of messages are deserialized in a process
+    pool. Up to two batches per process are in flight at the same time, so the
+    input is only read as fast as it is processed."""
+    if jobs <= 1:
+        for msg_json, warning in (message_to_json(*item) for item in messages):
+            if warning:
+                print(warning, file=sys.stderr)
+            yield msg_json
+        return
+
+    with multiprocessing.Pool(jobs) as pool:
+        pending = deque()   # type: deque[Any]
+        batches = batched(messages, BATCH_SIZE)
         while True:
-            if progress_bar:
-                # Update progress bar
-                diff = f_in.tell() - bytes_read - 1
-                progress_bar.update(diff)
-                bytes_read = f_in.tell() - 1
-
-            # Read the Header
-            tmp_header_raw = f_in.read(TIME_SIZE + LENGTH_SIZE + MSGTYPE_SIZE)
-            if not tmp_header_raw:
+            while len(pending) < 2 * jobs:
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                pending.append(pool.apply_async(messages_to_json, (batch,)))
+            if not pending:
                 break
-            tmp_header = BytesIO(tmp_header_raw)
-            time = int.from_bytes(tmp_header.read(TIME_SIZE), "little")      # type: int
-            msgtype = tmp_header.read(MSGTYPE_SIZE).split(b'\x00', 1)[0]     # type: bytes
-            length = int.from_bytes(tmp_header.read(LENGTH_SIZE), "little")  # type: int
-
-            # Start converting the message to a dictionary
-            msg_dict = {}
-            msg_dict["direction"] = "recv" if recv else "sent"
-            msg_dict["time"] = time
-            msg_dict["size"] = length   # "size" is less readable here, but more readable in the output
-
-            msg_ser = BytesIO(f_in.read(length))
-
-            # Determine message type
-            if msgtype not in MESSAGEMAP:
-                # Unrecognized message type
-                try:
-                    msgtype_tmp = msgtype.decode()
-                    if not msgtype_tmp.isprintable():
-                        raise UnicodeDecodeError
-                    msg_dict["msgtype"] = msgtype_tmp
-                except UnicodeDecodeError:
-                    msg_dict["msgtype"] = "UNREADABLE"
-                msg_dict["body"] = msg_ser.read().hex()
-                msg_dict["error"] = "Unrecognized message type."
-                messages.append(msg_dict)
-                print(f"WARNING - Unrecognized message type {msgtype} in {path}", file=sys.stderr)
-                continue
-
-            # Deserialize the message
-            msg = MESSAGEMAP[msgtype]()
-            msg_dict["msgtype"] = msgtype.decode()
-
-            try:
-                msg.deserialize(msg_ser)
-            except KeyboardInterrupt:
-                raise
-            except Exception:
-                # Unable to deserialize message body
-                msg_ser.seek(0, os.SEEK_SET)
-                msg_dict["body"] = msg_ser.read().hex()
-                msg_dict["error"] = "Unable to deserialize message."
-                messages.append(msg_dict)
-                print(f"WARNING - Unable to deserialize message in {path}", file=sys.stderr)
-                continue
-
-            # Convert body of message into a jsonable object
-            if length:
-                msg_dict["body"] = to_jsonable(msg)
-            messages.append(msg_dict)
-
-        if progress_bar:
-            # Update the progress bar to the end of the current file
-            # in case we exited the loop early
-            f_in.seek(0, os.SEEK_END)   # Go to end of file
-            diff = f_in.tell() - bytes_read - 1
-            progress_bar.update(diff)
+            for msg_json, warning in pending.popleft().get():
+                if warning:
+                    print(warning, file=sys.stderr)
+                yield msg_json
 
 
 def main():
@@ -183,32 +248,74 @@ def main():
         "-n", "--no-progress-bar",
         action='store_true',
         help="disable the progress bar.  Automatically set if the output is not a terminal")
+    parser.add_argument(
+        "--ndjson",
+        action='store_true',
+        help="output one JSON object per line instead of a JSON array")
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of processes used to deserialize messages (default: number of CPUs)")
+    parser.add_argument(
+        "--msgtype",
+        action='append',
+        help="only output messages of this type.  Can be specified multiple times")
+    parser.add_argument(
+        "--exclude-msgtype",
+        action='append',
+        default=[],
+        help="do not output messages of this type, e.g. block.  Can be specified multiple times")
+    parser.add_argument(
+        "--peer",
+        action='append',
+        help="only output messages sent to or received from this peer address (as in the\n"
+             "capture directory name, with or without colons).  Can be specified multiple times")
     args = parser.parse_args()
     capturepaths = [Path.cwd() / Path(capturepath) for capturepath in args.capturepaths]
+    if args.peer is not None:
+        peers = {peer.replace('_', ':') for peer in args.peer}
+        capturepaths = [capture for capture in capturepaths if capture_peer(capture) in peers]
+    msgtypes = {msgtype.encode() for msgtype in args.msgtype} if args.msgtype is not None else None
+    exclude_msgtypes = {msgtype.encode() for msgtype in args.exclude_msgtype}
     output = Path.cwd() / Path(args.output) if args.output else False
     use_progress_bar = (not args.no_progress_bar) and sys.stdout.isatty()
 
-    messages = []   # type: list[Any]
     if use_progress_bar:
         total_size = sum(capture.stat().st_size for capture in capturepaths)
         progress_bar = ProgressBar(total_size)
     else:
         progress_bar = None
 
+    # Capture files are normally in chronological order, so merging them keeps
+    # all messages in chronological order without loading them into memory.
+    # Files that are not are sorted in memory first.
+    captures = []
     for capture in capturepaths:
-        process_file(str(capture), messages, "recv" in capture.stem, progress_bar)
+        file_messages = read_messages(capture, msgtypes, exclude_msgtypes, progress_bar)
+        if not is_chronological(capture):
+            print(f"WARNING - Messages in {capture} are not in chronological order, sorting them in memory", file=sys.stderr)
+            file_messages = iter(sorted(file_messages, key=lambda item: item[3].time))
+        captures.append(file_messages)
+    messages = heapq.merge(*captures, key=lambda item: item[3].time)
 
-    messages.sort(key=lambda msg: msg['time'])
+    f_out = open(str(output), 'w+') if output else sys.stdout
+    try:
+        if args.ndjson:
+            for msg_json in process_messages(messages, args.jobs):
+                f_out.write(msg_json + "\n")
+        else:
+            separator = "["
+            for msg_json in process_messages(messages, args.jobs):
+                f_out.write(separator + msg_json)
+                separator = ", "
+            f_out.write("[]\n" if separator == "[" else "]\n")
+    finally:
+        if output:
+            f_out.close()
 
     if use_progress_bar:
         progress_bar.set_progress(1)
 
-    jsonrep = json.dumps(messages)
-    if output:
-        with open(str(output), 'w+') as f_out:
-            f_out.write(jsonrep)
-    else:
-        print(jsonrep)
-
 if __name__ == "__main__":
     main()
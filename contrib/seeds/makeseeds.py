@@ -8,16 +8,18 @@
 
 import argparse
 import collections
-import ipaddress
+import itertools
+import multiprocessing
+import os
 from pathlib import Path
 import random
 import re
 import sys
-from typing import Union
+from typing import Iterable, Iterator, Union
 
 asmap_dir = Path(__file__).parent.parent / "asmap"
 sys.path.append(str(asmap_dir))
-from asmap import ASMap, net_to_prefix  # noqa: E402
+from asmap import BinaryASMap, CompiledASMap  # noqa: E402
 
 NSEEDS=512
 
@@ -28,6 +30,12 @@ MAX_SEEDS_PER_ASN = {
 
 MIN_BLOCKS = 910000
 
+# Number of lines parsed by a worker process at once
+CHUNK_LINES = 10000
+
+# Number of addresses whose ASN is looked up at once
+ASN_LOOKUP_BATCH = 1024
+
 PATTERN_IPV4 = re.compile(r"^(([0-2]?\d{1,2})\.([0-2]?\d{1,2})\.([0-2]?\d{1,2})\.([0-2]?\d{1,2})):(\d{1,5})$")
 PATTERN_IPV6 = re.compile(r"^\[([\da-f:]+)]:(\d{1,5})$", re.IGNORECASE)
 PATTERN_ONION = re.compile(r"^([a-z2-7]{56}\.onion):(\d+)$")
@@ -67,25 +75,30 @@ def parseline(line: str) -> Union[dict, None]:
     # Skip bad results.
     if int(sline[1]) == 0:
         return None
-    m = PATTERN_IPV4.match(sline[0])
+    # The address patterns are mutually exclusive, so only the one that can
+    # match is tried.
+    addr = sline[0]
     sortkey = None
     ip = None
+    if addr.startswith('['):
+        m = PATTERN_IPV6.match(addr)
+    elif '.onion:' in addr:
+        m = PATTERN_ONION.match(addr)
+    elif '.b32.i2p:' in addr:
+        m = PATTERN_I2P.match(addr)
+    else:
+        m = PATTERN_IPV4.match(addr)
     if m is None:
-        m = PATTERN_IPV6.match(sline[0])
-        if m is None:
-            m = PATTERN_ONION.match(sline[0])
-            if m is None:
-                m = PATTERN_I2P.match(sline[0])
-                if m is None:
-                    return None
-                else:
-                    net = 'i2p'
-                    ipstr = sortkey = m.group(1)
-                    port = int(m.group(2))
-            else:
-                net = 'onion'
-                ipstr = sortkey = m.group(1)
-                port = int(m.group(2))
+        return None
+    if m.re is not PATTERN_IPV4:
+        if m.re is PATTERN_I2P:
+            net = 'i2p'
+            ipstr = sortkey = m.group(1)
+            port = int(m.group(2))
+        elif m.re is PATTERN_ONION:
+            net = 'onion'
+            ipstr = sortkey = m.group(1)
+            port = int(m.group(2))
         else:
             net = 'ipv6'
             if m.group(1) in ['::']: # Not interested in localhost
@@ -135,8 +148,54 @@ def parseline(line: str) -> Union[dict, None]:
         'sortkey': sortkey,
     }
 
-def dedup(ips: list[dict]) -> list[dict]:
-    """ Remove duplicates from `ips` where multiple ips share address and port. """
+def parselines(lines: list[str]) -> list[dict]:
+    """ Parses a chunk of lines, leaving out the ones that could not be parsed. """
+    return [ip for ip in map(parseline, lines) if ip is not None]
+
+def read_chunks(paths: list[str]) -> Iterator[list[str]]:
+    """ Reads the seeds files in chunks of `CHUNK_LINES` lines. """
+    for path in paths:
+        with open(path, 'r') as f:
+            while chunk := list(itertools.islice(f, CHUNK_LINES)):
+                yield chunk
+
+def parse_seeds(paths: list[str], jobs: int) -> Iterator[dict]:
+    """ Parses the seeds files, yielding the valid entries in order.
+
+    With more than one job, chunks of lines are parsed in a process pool. Up to
+    two chunks per process are in flight at the same time, so the files are only
+    read as fast as they are parsed.
+    """
+    chunks = read_chunks(paths)
+    if jobs <= 1:
+        for chunk in chunks:
+            yield from parselines(chunk)
+        return
+
+    with multiprocessing.Pool(jobs) as pool:
+        pending: collections.deque = collections.deque()
+        while True:
+            while len(pending) < 2 * jobs:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                pending.append(pool.apply_async(parselines, (chunk,)))
+            if not pending:
+                break
+            yield from pending.popleft().get()
+
+def count_nets(ips: Iterable[dict], hist: dict[str, int]) -> Iterator[dict]:
+    """ Counts the ips per net in `hist` as they pass by. """
+    for ip in ips:
+        hist[ip['net']] += 1
+        yield ip
+
+def dedup(ips: Iterable[dict]) -> list[dict]:
+    """ Remove duplicates from `ips` where multiple ips share address and port.
+
+    Only one entry per address and port is kept at a time, so `ips` can be a
+    stream of any length.
+    """
     d = {}
     for ip in ips:
         ip_port = (ip["ip"], ip["port"])
@@ -152,7 +211,7 @@ def filtermultiport(ips: list[dict]) -> list[dict]:
     return [value[0] for (key,value) in list(hist.items()) if len(value)==1]
 
 # Based on Greg Maxwell's seed_filter.py
-def filterbyasn(asmap: ASMap, ips: list[dict], max_per_asn: dict, max_per_net: int) -> list[dict]:
+def filterbyasn(asmap: CompiledASMap, ips: list[dict], max_per_asn: dict, max_per_net: int) -> list[dict]:
     """ Prunes `ips` by
     (a) trimming ips to have at most `max_per_net` ips from each net (e.g. ipv4, ipv6); and
     (b) trimming ips to have at most `max_per_asn` ips from each asn in each net.
@@ -168,20 +227,24 @@ def filterbyasn(asmap: ASMap, ips: list[dict], max_per_asn: dict, max_per_net: i
     net_count: dict[str, int] = collections.defaultdict(int)
     asn_count: dict[int, int] = collections.defaultdict(int)
 
-    for i, ip in enumerate(ips_ipv46):
-        if net_count[ip['net']] == max_per_net:
-            # do not add this ip as we already too many
-            # ips from this network
-            continue
-        asn = asmap.lookup(net_to_prefix(ipaddress.ip_network(ip['ip'])))
-        if not asn or asn_count[ip['net'], asn] == max_per_asn[ip['net']]:
-            # do not add this ip as we already have too many
-            # ips from this ASN on this network
-            continue
-        asn_count[ip['net'], asn] += 1
-        net_count[ip['net']] += 1
-        ip['asn'] = asn
-        result.append(ip)
+    for start in range(0, len(ips_ipv46), ASN_LOOKUP_BATCH):
+        if net_count['ipv4'] == max_per_net and net_count['ipv6'] == max_per_net:
+            # no more ips can be added, so the remaining ASNs are not needed
+            break
+        batch = ips_ipv46[start:start + ASN_LOOKUP_BATCH]
+        for ip, asn in zip(batch, asmap.lookup_many(ip['ip'] for ip in batch)):
+            if net_count[ip['net']] == max_per_net:
+                # do not add this ip as we already too many
+                # ips from this network
+                continue
+            if not asn or asn_count[ip['net'], asn] == max_per_asn[ip['net']]:
+                # do not add this ip as we already have too many
+                # ips from this ASN on this network
+                continue
+            asn_count[ip['net'], asn] += 1
+            net_count[ip['net']] += 1
+            ip['asn'] = asn
+            result.append(ip)
 
     # Add back Onions (up to max_per_net)
     result.extend(ips_onion[0:max_per_net])
@@ -189,6 +252,10 @@ def filterbyasn(asmap: ASMap, ips: list[dict], max_per_asn: dict, max_per_net: i
     result.extend(ips_cjdns[0:max_per_net])
     return result
 
+def hist_stats(hist: dict[str, int]) -> str:
+    """ Format and return pretty string from a histogram of ips per net. """
+    return f"{hist['ipv4']:6d} {hist['ipv6']:6d} {hist['onion']:6d} {hist['i2p']:6d} {hist['cjdns']:6d}"
+
 def ip_stats(ips: list[dict]) -> str:
     """ Format and return pretty string from `ips`. """
     hist: dict[str, int] = collections.defaultdict(int)
@@ -196,13 +263,14 @@ def ip_stats(ips: list[dict]) -> str:
         if ip is not None:
             hist[ip['net']] += 1
 
-    return f"{hist['ipv4']:6d} {hist['ipv6']:6d} {hist['onion']:6d} {hist['i2p']:6d} {hist['cjdns']:6d}"
+    return hist_stats(hist)
 
 def parse_args():
     argparser = argparse.ArgumentParser(description='Generate a list of bitcoin node seed ip addresses.')
     argparser.add_argument("-a","--asmap", help='the location of the asmap asn database file (required)', required=True)
-    argparser.add_argument("-s","--seeds", help='the location of the DNS seeds file (required)', required=True)
+    argparser.add_argument("-s","--seeds", help='the location of the DNS seeds file, or several files from different seeders (required)', nargs='+', required=True)
     argparser.add_argument("-m", "--minblocks", help="The minimum number of blocks each node must have", default=MIN_BLOCKS, type=int)
+    argparser.add_argument("-j", "--jobs", help="The number of processes used to parse the DNS seeds (default: number of CPUs)", default=os.cpu_count() or 1, type=int)
     return argparser.parse_args()
 
 def main():
@@ -210,23 +278,20 @@ def main():
 
     print(f'Loading asmap database "{args.asmap}"…', end='', file=sys.stderr, flush=True)
     with open(args.asmap, 'rb') as f:
-        asmap = ASMap.from_binary(f.read())
+        asmap = BinaryASMap(f.read()).compile()
     print('Done.', file=sys.stderr)
 
     print('Loading and parsing DNS seeds…', end='', file=sys.stderr, flush=True)
-    with open(args.seeds, 'r') as f:
-        lines = f.readlines()
-    ips = [parseline(line) for line in lines]
+    # Entries with an invalid address are skipped while parsing, and duplicates
+    # (from multiple seeds files) are removed as the entries stream in.
+    parsed_hist: dict[str, int] = collections.defaultdict(int)
+    ips = dedup(count_nets(parse_seeds(args.seeds, args.jobs), parsed_hist))
     random.shuffle(ips)
     print('Done.', file=sys.stderr)
 
     print('\x1b[7m  IPv4   IPv6  Onion    I2P  CJDNS Pass                                               \x1b[0m', file=sys.stderr)
-    print(f'{ip_stats(ips):s} Initial', file=sys.stderr)
-    # Skip entries with invalid address.
-    ips = [ip for ip in ips if ip is not None]
-    print(f'{ip_stats(ips):s} Skip entries with invalid address', file=sys.stderr)
-    # Skip duplicates (in case multiple seeds files were concatenated)
-    ips = dedup(ips)
+    print(f'{hist_stats(parsed_hist):s} Initial', file=sys.stderr)
+    print(f'{hist_stats(parsed_hist):s} Skip entries with invalid address', file=sys.stderr)
     print(f'{ip_stats(ips):s} After removing duplicates', file=sys.stderr)
     # Enforce minimal number of blocks.
     ips = [ip for ip in ips if ip['blocks'] >= args.minblocks]
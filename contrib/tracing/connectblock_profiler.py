@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+""" Per-block validation latency profiler based on the validation:block_connected
+    and utxocache:flush tracepoints.
+
+    The `record` command hooks into a running bitcoind and writes every
+    connected block and UTXO cache flush into a compact binary file. The
+    `report` and `compare` commands analyze recorded files offline and don't
+    need BCC or a running bitcoind. """
+
+# USAGE:
+#   ./contrib/tracing/connectblock_profiler.py record <pid of bitcoind> <file>
+#   ./contrib/tracing/connectblock_profiler.py report <file>
+#   ./contrib/tracing/connectblock_profiler.py compare <baseline file> <file>
+
+import argparse
+import ctypes
+import struct
+import sys
+from collections import namedtuple
+
+# BCC: The C program to be compiled to an eBPF program (by BCC) and loaded into
+# a sandboxed Linux kernel VM.
+program = """
+# include <uapi/linux/ptrace.h>
+
+struct block_event
+{
+  u64 timestamp;
+  s32 height;
+  u64 transactions;
+  s32 inputs;
+  u64 sigops;
+  u64 duration;
+};
+
+struct flush_event
+{
+  u64 timestamp;
+  u64 duration;
+  u32 mode;
+  u64 coins_count;
+  u64 coins_mem_usage;
+  bool is_flush_for_prune;
+};
+
+// BPF perf buffers to push the data to user space.
+BPF_PERF_OUTPUT(blocks);
+BPF_PERF_OUTPUT(flushes);
+
+int trace_block_connected(struct pt_regs *ctx) {
+  struct block_event event = {};
+  event.timestamp = bpf_ktime_get_ns();
+  bpf_usdt_readarg(2, ctx, &event.height);
+  bpf_usdt_readarg(3, ctx, &event.transactions);
+  bpf_usdt_readarg(4, ctx, &event.inputs);
+  bpf_usdt_readarg(5, ctx, &event.sigops);
+  bpf_usdt_readarg(6, ctx, &event.duration);
+  blocks.perf_submit(ctx, &event, sizeof(event));
+  return 0;
+}
+
+int trace_flush(struct pt_regs *ctx) {
+  struct flush_event event = {};
+  event.timestamp = bpf_ktime_get_ns();
+  bpf_usdt_readarg(1, ctx, &event.duration);
+  bpf_usdt_readarg(2, ctx, &event.mode);
+  bpf_usdt_readarg(3, ctx, &event.coins_count);
+  bpf_usdt_readarg(4, ctx, &event.coins_mem_usage);
+  bpf_usdt_readarg(5, ctx, &event.is_flush_for_prune);
+  flushes.perf_submit(ctx, &event, sizeof(event));
+  return 0;
+}
+"""
+
+FLUSH_MODES = [
+    'NONE',
+    'IF_NEEDED',
+    'PERIODIC',
+    'FORCE_FLUSH',
+    'FORCE_SYNC',
+]
+
+# Recorded files start with FILE_MAGIC, followed by records made up of a one
+# byte tag and the fixed size little-endian fields of the event. Timestamps are
+# taken from the kernel's monotonic clock when the tracepoint fires.
+FILE_MAGIC = b"CBPROF\x00\x02"
+TAG_BLOCK = b"B"
+TAG_FLUSH = b"F"
+# timestamp (ns), height, transactions, inputs, sigops, duration (ns), with the
+# types of the validation:block_connected tracepoint arguments
+BLOCK_RECORD = struct.Struct("<QiQiQQ")
+# timestamp (ns), duration (µs), coins count, coins memory usage, mode, is flush for prune
+FLUSH_RECORD = struct.Struct("<QQQQB?")
+
+PERCENTILES = [50, 90, 99, 99.9]
+# Number of blocks connected since the last flush, grouped into ranges for the
+# flush correlation.
+FLUSH_DISTANCE_BUCKETS = [(0, 1), (1, 10), (10, 100), (100, None)]
+
+Block = namedtuple("Block", ["timestamp", "height", "transactions", "inputs", "sigops", "duration"])
+Flush = namedtuple("Flush", ["timestamp", "duration", "coins_count", "coins_mem_usage", "mode", "is_flush_for_prune"])
+
+
+class BlockEvent(ctypes.Structure):
+    # define output data structure corresponding to struct block_event
+    _fields_ = [
+        ("timestamp", ctypes.c_uint64),
+        ("height", ctypes.c_int32),
+        ("transactions", ctypes.c_uint64),
+        ("inputs", ctypes.c_int32),
+        ("sigops", ctypes.c_uint64),
+        ("duration", ctypes.c_uint64),
+    ]
+
+
+class FlushEvent(ctypes.Structure):
+    # define output data structure corresponding to struct flush_event
+    _fields_ = [
+        ("timestamp", ctypes.c_uint64),
+        ("duration", ctypes.c_uint64),
+        ("mode", ctypes.c_uint32),
+        ("coins_count", ctypes.c_uint64),
+        ("coins_mem_usage", ctypes.c_uint64),
+        ("is_flush_for_prune", ctypes.c_bool),
+    ]
+
+
+def record(pid, path):
+    # BCC is only needed for recording, the analysis works without it.
+    from bcc import BPF, USDT
+
+    print(f"Hooking into bitcoind with pid {pid}")
+    bitcoind_with_usdts = USDT(pid=int(pid))
+
+    # attaching the trace functions defined in the BPF program
+    # to the tracepoints
+    bitcoind_with_usdts.enable_probe(
+        probe="block_connected", fn_name="trace_block_connected")
+    bitcoind_with_usdts.enable_probe(
+        probe="flush", fn_name="trace_flush")
+    b = BPF(text=program, usdt_contexts=[bitcoind_with_usdts])
+
+    counts = {"blocks": 0, "flushes": 0, "lost": 0}
+
+    with open(path, "wb") as out:
+        out.write(FILE_MAGIC)
+
+        def handle_block(_, data, size):
+            """ Block connected handler.
+              Called each time a block is connected to the chain."""
+            event = ctypes.cast(data, ctypes.POINTER(BlockEvent)).contents
+            out.write(TAG_BLOCK + BLOCK_RECORD.pack(
+                event.timestamp, event.height, event.transactions,
+                event.inputs, event.sigops, event.duration))
+            counts["blocks"] += 1
+
+        def handle_flush(_, data, size):
+            """ Coins Flush handler.
+              Called each time coin caches and indexes are flushed."""
+            event = ctypes.cast(data, ctypes.POINTER(FlushEvent)).contents
+            out.write(TAG_FLUSH + FLUSH_RECORD.pack(
+                event.timestamp, event.duration, event.coins_count,
+                event.coins_mem_usage, event.mode, event.is_flush_for_prune))
+            counts["flushes"] += 1
+
+        def handle_lost(lost):
+            counts["lost"] += lost
+
+        b["blocks"].open_perf_buffer(handle_block, page_cnt=64, lost_cb=handle_lost)
+        b["flushes"].open_perf_buffer(handle_flush, lost_cb=handle_lost)
+        print(f"Recording connected blocks and utxocache flushes to {path}. Ctrl-C to end...")
+
+        while True:
+            try:
+                b.perf_buffer_poll()
+            except KeyboardInterrupt:
+                break
+
+    print(f"Recorded {counts['blocks']} blocks and {counts['flushes']} flushes.")
+    if counts["lost"]:
+        print(f"Warning: lost {counts['lost']} events, the recording is incomplete.")
+
+
+def load(path):
+    """Read a recorded file into lists of blocks and flushes sorted by time."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(FILE_MAGIC):
+        raise ValueError(f"{path} is not a connectblock_profiler recording")
+    blocks = []
+    flushes = []
+    pos = len(FILE_MAGIC)
+    end = len(data)
+    while pos < end:
+        tag = data[pos:pos + 1]
+        pos += 1
+        if tag == TAG_BLOCK:
+            record_struct, records, cls = BLOCK_RECORD, blocks, Block
+        elif tag == TAG_FLUSH:
+            record_struct, records, cls = FLUSH_RECORD, flushes, Flush
+        else:
+            raise ValueError(f"{path}: unknown record tag {tag!r} at offset {pos - 1}")
+        if pos + record_struct.size > end:
+            # A recording interrupted while writing can end in a partial record.
+            print(f"Warning: {path} ends with a truncated record", file=sys.stderr)
+            break
+        records.append(cls._make(record_struct.unpack_from(data, pos)))
+        pos += record_struct.size
+    # The two perf buffers are read independently, restore the event order.
+    blocks.sort(key=lambda b: b.timestamp)
+    flushes.sort(key=lambda f: f.timestamp)
+    return blocks, flushes
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[min(int(rank), len(sorted_values)) - 1]
+
+
+def fmt_ms(ns):
+    return f"{ns / 1e6:.2f} ms"
+
+
+def fmt_percentile(p):
+    return f"p{p:g}"
+
+
+def blocks_since_flush(blocks, flushes):
+    """For each block, the number of blocks connected after the last flush
+    before it, or None when no flush happened before the block."""
+    distances = []
+    flush_index = 0
+    since = None
+    for block in blocks:
+        while flush_index < len(flushes) and flushes[flush_index].timestamp < block.timestamp:
+            flush_index += 1
+            since = 0
+        distances.append(since)
+        if since is not None:
+            since += 1
+    return distances
+
+
+def print_percentiles(blocks):
+    durations = sorted(b.duration for b in blocks)
+    per_input = sorted(b.duration / b.inputs for b in blocks if b.inputs > 0)
+    per_sigop = sorted(b.duration / b.sigops for b in blocks if b.sigops > 0)
+    print("%-18s %12s %14s %14s" % ("", "per block", "per input", "per sigop"))
+    for p in PERCENTILES:
+        print("%-18s %12s %11.2f µs %11.2f µs" % (
+            fmt_percentile(p), fmt_ms(percentile(durations, p)),
+            percentile(per_input, p) / 1e3, percentile(per_sigop, p) / 1e3))
+    print("%-18s %12s" % ("max", fmt_ms(durations[-1])))
+
+
+def print_flush_correlation(blocks, flushes, slow_percentile, window):
+    durations = sorted(b.duration for b in blocks)
+    slow_threshold = percentile(durations, slow_percentile)
+    distances = blocks_since_flush(blocks, flushes)
+
+    print(f"Blocks by distance to the previous flush (slow: >= {fmt_ms(slow_threshold)}, {fmt_percentile(slow_percentile)}):")
+    print("%-18s %8s %12s %12s %8s" % ("blocks since flush", "blocks", "p50", "p99", "slow"))
+    buckets = [("no flush yet", lambda d: d is None)]
+    for lo, hi in FLUSH_DISTANCE_BUCKETS:
+        if hi is None:
+            buckets.append((f">= {lo}", lambda d, lo=lo: d is not None and d >= lo))
+        elif hi == lo + 1:
+            buckets.append((f"{lo}", lambda d, lo=lo: d == lo))
+        else:
+            buckets.append((f"{lo}-{hi - 1}", lambda d, lo=lo, hi=hi: d is not None and lo <= d < hi))
+    for name, matches in buckets:
+        bucket = sorted(b.duration for b, d in zip(blocks, distances) if matches(d))
+        if not bucket:
+            continue
+        slow = sum(1 for duration in bucket if duration >= slow_threshold)
+        print("%-18s %8d %12s %12s %7.1f%%" % (
+            name, len(bucket), fmt_ms(percentile(bucket, 50)),
+            fmt_ms(percentile(bucket, 99)), 100 * slow / len(bucket)))
+
+    # The correlation between a block being slow and it being connected
+    # within `window` blocks after a flush (phi coefficient).
+    near = [d is not None and d < window for d in distances]
+    slow = [b.duration >= slow_threshold for b in blocks]
+    n11 = sum(1 for a, b in zip(near, slow) if a and b)
+    n_near = sum(near)
+    n_slow = sum(slow)
+    n = len(blocks)
+    denominator = (n_near * (n - n_near) * n_slow * (n - n_slow)) ** 0.5
+    phi = (n * n11 - n_near * n_slow) / denominator if denominator else 0.0
+    print()
+    print(f"{n11} of {n_slow} slow blocks were connected within {window} blocks after a flush "
+          f"({100 * n_near / n:.1f}% of all blocks were). Correlation (phi): {phi:.3f}")
+
+
+def report(args):
+    blocks, flushes = load(args.file)
+    if not blocks:
+        print(f"No blocks recorded in {args.file}.")
+        return 0
+
+    total_duration = sum(b.duration for b in blocks)
+    print(f"Connected {len(blocks)} blocks between height {min(b.height for b in blocks)} "
+          f"and {max(b.height for b in blocks)} in {fmt_ms(total_duration)}: "
+          f"{sum(b.transactions for b in blocks)} tx, {sum(b.inputs for b in blocks)} inputs, "
+          f"{sum(b.sigops for b in blocks)} sigops.")
+    print()
+    print_percentiles(blocks)
+
+    print()
+    print(f"Slowest {args.top} blocks:")
+    for b in sorted(blocks, key=lambda b: b.duration, reverse=True)[:args.top]:
+        print("Block %-8d %8d tx %8d ins %8d sigops  took %s" % (
+            b.height, b.transactions, b.inputs, b.sigops, fmt_ms(b.duration)))
+
+    print()
+    print(f"{len(flushes)} utxocache flushes taking {sum(f.duration for f in flushes) / 1e3:.2f} ms in total.")
+    for mode in sorted(set(f.mode for f in flushes)):
+        of_mode = [f for f in flushes if f.mode == mode]
+        name = FLUSH_MODES[mode] if mode < len(FLUSH_MODES) else str(mode)
+        print("%-12s %6d flushes %12.2f ms" % (name, len(of_mode), sum(f.duration for f in of_mode) / 1e3))
+    if flushes:
+        print()
+        print_flush_correlation(blocks, flushes, args.slow_percentile, args.window)
+    return 0
+
+
+def compare(args):
+    baseline = {b.height: b for b in load(args.baseline)[0]}
+    candidate = {b.height: b for b in load(args.candidate)[0]}
+    heights = sorted(baseline.keys() & candidate.keys())
+    if not heights:
+        print("The recordings have no block heights in common.")
+        return 1
+    print(f"Comparing {len(heights)} blocks between height {heights[0]} and {heights[-1]} "
+          f"(regression threshold {args.threshold:g}%).")
+
+    regressions = 0
+
+    def print_change(name, base, cand):
+        nonlocal regressions
+        change = 100 * (cand - base) / base if base else 0.0
+        flag = ""
+        if change > args.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print("%-22s %12s %12s %+9.1f%%%s" % (name, fmt_ms(base), fmt_ms(cand), change, flag))
+
+    print()
+    print("%-22s %12s %12s %10s" % ("", "baseline", "candidate", "change"))
+    base_durations = sorted(baseline[h].duration for h in heights)
+    cand_durations = sorted(candidate[h].duration for h in heights)
+    for p in PERCENTILES:
+        print_change(fmt_percentile(p), percentile(base_durations, p), percentile(cand_durations, p))
+    print_change("total", sum(base_durations), sum(cand_durations))
+
+    print()
+    print(f"Median per {args.bucket} blocks:")
+    for start in range(heights[0] - heights[0] % args.bucket, heights[-1] + 1, args.bucket):
+        in_range = [h for h in heights if start <= h < start + args.bucket]
+        if not in_range:
+            continue
+        print_change(f"{start}-{start + args.bucket - 1}",
+                     percentile(sorted(baseline[h].duration for h in in_range), 50),
+                     percentile(sorted(candidate[h].duration for h in in_range), 50))
+
+    print()
+    print("Largest per-block slowdowns:")
+    slowdowns = sorted(heights, key=lambda h: candidate[h].duration - baseline[h].duration, reverse=True)
+    for h in slowdowns[:args.top]:
+        print("Block %-8d %8d ins %8d sigops  %s -> %s" % (
+            h, candidate[h].inputs, candidate[h].sigops,
+            fmt_ms(baseline[h].duration), fmt_ms(candidate[h].duration)))
+
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_record = subparsers.add_parser("record", help="record connected blocks and utxocache flushes of a running bitcoind")
+    parser_record.add_argument("pid", help="pid of bitcoind")
+    parser_record.add_argument("file", help="file to write the recording to")
+
+    parser_report = subparsers.add_parser("report", help="report latency percentiles and the flush correlation of a recording")
+    parser_report.add_argument("file", help="recorded file")
+    parser_report.add_argument("--top", type=int, default=10, help="number of slowest blocks to list (default: %(default)s)")
+    parser_report.add_argument("--slow-percentile", type=float, default=99,
+                               help="blocks at or above this connect time percentile are considered slow (default: %(default)s)")
+    parser_report.add_argument("--window", type=int, default=10,
+                               help="number of blocks after a flush to correlate slow blocks with (default: %(default)s)")
+
+    parser_compare = subparsers.add_parser("compare", help="compare the block connect times of two recordings")
+    parser_compare.add_argument("baseline", help="baseline recording")
+    parser_compare.add_argument("candidate", help="recording compared against the baseline")
+    parser_compare.add_argument("--threshold", type=float, default=10,
+                                help="report a regression if a connect time increased by more than this many percent (default: %(default)s)")
+    parser_compare.add_argument("--bucket", type=int, default=10000, help="height range to compare medians over (default: %(default)s)")
+    parser_compare.add_argument("--top", type=int, default=10, help="number of largest per-block slowdowns to list (default: %(default)s)")
+
+    args = parser.parse_args()
+    if args.command == "record":
+        record(args.pid, args.file)
+        return 0
+    if args.command == "report":
+        return report(args)
+    return compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+'''
+Test the offline report and compare commands of connectblock_profiler.py on
+small synthetic recordings. Neither BCC nor a running bitcoind is needed.
+
+Example usage:
+
+    python3 contrib/tracing/test-connectblock-profiler.py
+'''
+import contextlib
+import importlib.util
+import io
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+PROFILER = Path(__file__).resolve().parent / 'connectblock_profiler.py'
+
+spec = importlib.util.spec_from_file_location('connectblock_profiler', PROFILER)
+profiler = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(profiler)
+
+# Larger than the uint32 range, as the tracepoint passes them as uint64
+MANY_TXS = (1 << 32) + 5
+MANY_SIGOPS = (1 << 40) + 7
+
+def synthetic_blocks(first_height, count, slowdown=1.0):
+    '''Blocks connected one second apart, taking 10 ms each, and 100 ms for the ones
+    at heights divisible by 10.'''
+    blocks = []
+    for height in range(first_height, first_height + count):
+        duration = (100 if height % 10 == 0 else 10) * 1000 * 1000
+        blocks.append(profiler.Block(timestamp=height * 1000 * 1000 * 1000, height=height,
+                                     transactions=10, inputs=20, sigops=40, duration=int(duration * slowdown)))
+    return blocks
+
+def flushes_before(heights):
+    '''A flush shortly before each of the blocks at the given heights.'''
+    return [profiler.Flush(timestamp=height * 1000 * 1000 * 1000 - 1, duration=2000, coins_count=1000,
+                           coins_mem_usage=1 << 20, mode=2, is_flush_for_prune=False) for height in heights]
+
+def write_recording(path, blocks, flushes, trailer=b''):
+    # Blocks and flushes are interleaved out of order, like the two perf
+    # buffers are read.
+    with open(path, 'wb') as f:
+        f.write(profiler.FILE_MAGIC)
+        for flush in flushes:
+            f.write(profiler.TAG_FLUSH + profiler.FLUSH_RECORD.pack(*flush))
+        for block in reversed(blocks):
+            f.write(profiler.TAG_BLOCK + profiler.BLOCK_RECORD.pack(*block))
+        f.write(trailer)
+
+def run_profiler(*args):
+    return subprocess.run([sys.executable, PROFILER, *args], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+class TestConnectBlockProfiler(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.tmp_dir = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_load(self):
+        blocks = synthetic_blocks(100, 20)
+        blocks[3] = blocks[3]._replace(transactions=MANY_TXS, sigops=MANY_SIGOPS)
+        flushes = flushes_before([110, 105])
+        path = self.tmp_dir / 'load.cbp'
+        write_recording(path, blocks, flushes)
+        self.assertEqual(profiler.load(path), (blocks, sorted(flushes)))
+
+        # A partial last record is ignored
+        write_recording(path, blocks, flushes, trailer=profiler.TAG_BLOCK + b'\x00' * 10)
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            self.assertEqual(profiler.load(path), (blocks, sorted(flushes)))
+        self.assertIn('ends with a truncated record', stderr.getvalue())
+
+        path.write_bytes(b'CBPROF\x00\x01' + path.read_bytes()[len(profiler.FILE_MAGIC):])
+        self.assertRaisesRegex(ValueError, 'is not a connectblock_profiler recording', profiler.load, path)
+
+    def test_report(self):
+        blocks = synthetic_blocks(1000, 100)
+        blocks[0] = blocks[0]._replace(transactions=MANY_TXS, sigops=MANY_SIGOPS)
+        path = self.tmp_dir / 'report.cbp'
+        write_recording(path, blocks, flushes_before(range(1000, 1100, 10)))
+        result = run_profiler('report', path, '--top', '3', '--slow-percentile', '95', '--window', '1')
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn(f'Connected 100 blocks between height 1000 and 1099 in 1900.00 ms: '
+                      f'{MANY_TXS + 99 * 10} tx, 2000 inputs, {MANY_SIGOPS + 99 * 40} sigops.', result.stdout)
+        self.assertIn('p50                    10.00 ms', result.stdout)
+        self.assertIn('max                   100.00 ms', result.stdout)
+        self.assertIn(f'Block 1000     {MANY_TXS} tx       20 ins {MANY_SIGOPS} sigops  took 100.00 ms', result.stdout)
+        self.assertIn('10 utxocache flushes taking 20.00 ms in total.', result.stdout)
+        # All slow blocks are connected right after a flush
+        self.assertIn('10 of 10 slow blocks were connected within 1 blocks after a flush '
+                      '(10.0% of all blocks were). Correlation (phi): 1.000', result.stdout)
+
+        empty = self.tmp_dir / 'empty.cbp'
+        write_recording(empty, [], [])
+        result = run_profiler('report', empty)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('No blocks recorded', result.stdout)
+
+    def test_compare(self):
+        baseline = self.tmp_dir / 'baseline.cbp'
+        same = self.tmp_dir / 'same.cbp'
+        slower = self.tmp_dir / 'slower.cbp'
+        disjoint = self.tmp_dir / 'disjoint.cbp'
+        write_recording(baseline, synthetic_blocks(0, 50), [])
+        # Only the heights recorded in both files are compared
+        write_recording(same, synthetic_blocks(10, 50), [])
+        write_recording(slower, synthetic_blocks(0, 50, slowdown=1.5), [])
+        write_recording(disjoint, synthetic_blocks(100, 50), [])
+
+        result = run_profiler('compare', baseline, same, '--bucket', '20')
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('Comparing 40 blocks between height 10 and 49', result.stdout)
+        self.assertNotIn('REGRESSION', result.stdout)
+
+        result = run_profiler('compare', baseline, slower, '--bucket', '20', '--top', '1')
+        self.assertEqual(result.returncode, 1, result.stderr)
+        self.assertIn('p50                        10.00 ms     15.00 ms     +50.0%  REGRESSION', result.stdout)
+        self.assertIn('20-39                      10.00 ms     15.00 ms     +50.0%  REGRESSION', result.stdout)
+        self.assertIn('Block 0              20 ins       40 sigops  100.00 ms -> 150.00 ms', result.stdout)
+        # A threshold above the slowdown passes
+        result = run_profiler('compare', baseline, slower, '--threshold', '60')
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+        result = run_profiler('compare', baseline, disjoint)
+        self.assertEqual(result.returncode, 1, result.stderr)
+        self.assertIn('no block heights in common', result.stdout)
+
+if __name__ == '__main__':
+    unittest.main()
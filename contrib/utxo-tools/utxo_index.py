@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Tool to look up coins in a compact-serialized UTXO set without converting it.
+
+The input UTXO set can be generated by Bitcoin Core with the `dumptxoutset` RPC:
+$ bitcoin-cli dumptxoutset ~/utxos.dat latest
+
+First build a sidecar index next to the snapshot (by default <snapshot>.idx):
+$ ./utxo_index.py build ~/utxos.dat [--spk]
+
+Then look up coins by outpoint, by txid or, if the index was built with --spk,
+by scriptPubKey. Matching coins are printed as one JSON object per line:
+$ ./utxo_index.py lookup ~/utxos.dat --outpoint <txid>:<vout>
+$ ./utxo_index.py lookup ~/utxos.dat --txid <txid>
+$ ./utxo_index.py lookup ~/utxos.dat --spk <scriptPubKey hex>
+
+The snapshot stores the coins grouped by txid and sorted by the txid's bytes.
+The index maps every txid prefix of --bucket-bits bits to the file offset of
+the first txid group with that prefix, so a lookup only decodes the groups of
+one bucket. With --spk, it additionally contains a table of (scriptPubKey
+hash, txid group offset) entries sorted by hash, which is binary searched.
+The snapshot itself is not modified.
+
+Index file layout (integers little endian, unless noted otherwise):
+  magic                 8 bytes, "utxoidx" followed by a zero byte
+  version               uint16
+  bucket bits           uint8
+  flags                 uint8, bit 0 is set if the scriptPubKey table is present
+  snapshot size         uint64
+  snapshot block hash   32 bytes
+  number of coins       uint64
+  bucket offsets        uint64 for each of the 2^bits buckets, plus the end of the coins
+  scriptPubKey entries  uint64 count, then per entry the first 8 bytes of the
+                        SHA256 of the scriptPubKey and the txid group offset as
+                        big endian uint64
+"""
+import argparse
+import hashlib
+import heapq
+import json
+import os
+import struct
+import sys
+import tempfile
+
+from utxo_to_sqlite import (
+    NET_MAGIC_BYTES,
+    UTXO_DUMP_MAGIC,
+    UTXO_DUMP_VERSION,
+    SnapshotReader,
+    decompress_p2pk_scripts,
+)
+
+
+INDEX_MAGIC = b'utxoidx\x00'
+INDEX_VERSION = 1
+INDEX_HEADER_FORMAT = "<8sHBBQ32sQ"
+INDEX_HEADER_SIZE = struct.calcsize(INDEX_HEADER_FORMAT)
+INDEX_FLAG_SPK = 1
+SPK_ENTRY_SIZE = 16
+# Number of scriptPubKey entries sorted in memory before they are written to a
+# temporary file and merged with the others
+SPK_RUN_SIZE = 1 << 21
+
+
+def read_snapshot_header(f):
+    """Read the snapshot metadata, returns the network name, block hash and number of coins."""
+    magic_bytes = f.read(5)
+    version = int.from_bytes(f.read(2), 'little')
+    network_magic = f.read(4)
+    block_hash = f.read(32)
+    num_utxos = int.from_bytes(f.read(8), 'little')
+    if magic_bytes != UTXO_DUMP_MAGIC:
+        raise ValueError("not an UTXO dump")
+    if version != UTXO_DUMP_VERSION:
+        raise ValueError(f"unknown UTXO dump version {version} (only version {UTXO_DUMP_VERSION} supported)")
+    network_string = NET_MAGIC_BYTES.get(network_magic, f"unknown network ({network_magic.hex()})")
+    return network_string, block_hash, num_utxos
+
+
+def script_keys(scriptpubkey):
+    """Return the keys under which coins with this scriptPubKey are stored in the index.
+
+    P2PK outputs with uncompressed pubkeys are stored compressed in the snapshot.
+    They are indexed without decompressing the pubkey, using the key returned by
+    p2pk_key(). Scripts that merely look like such an output are stored as is, so
+    both keys are tried for them."""
+    keys = [script_hash(scriptpubkey)]
+    compressed_pubkey = compress_p2pk(scriptpubkey)
+    if compressed_pubkey is not None:
+        keys.append(p2pk_key(compressed_pubkey))
+    return keys
+
+
+def compress_p2pk(scriptpubkey):
+    """Return the compressed pubkey if the script looks like a P2PK output with an uncompressed pubkey."""
+    if len(scriptpubkey) == 67 and scriptpubkey[0] == 65 and scriptpubkey[1] == 4 and scriptpubkey[66] == 0xac:
+        return bytes([2 | (scriptpubkey[65] & 1)]) + scriptpubkey[2:34]
+    return None
+
+
+def script_hash(scriptpubkey):
+    return hashlib.sha256(scriptpubkey).digest()[:8]
+
+
+def p2pk_key(compressed_pubkey):
+    return script_hash(b"\x41" + compressed_pubkey + b"\xac")
+
+
+def txid_bucket(txid, bucket_bits):
+    return int.from_bytes(txid[:4], 'big') >> (32 - bucket_bits)
+
+
+def write_spk_run(entries, tmpdir, runs):
+    entries.sort()
+    path = os.path.join(tmpdir, f"run{len(runs)}")
+    with open(path, "wb") as f:
+        f.write(b"".join(entries))
+    runs.append(path)
+    entries.clear()
+
+
+def read_spk_run(path):
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(SPK_ENTRY_SIZE * 65536)
+            if not data:
+                return
+            for pos in range(0, len(data), SPK_ENTRY_SIZE):
+                yield data[pos:pos + SPK_ENTRY_SIZE]
+
+
+def build_index(snapshot_path, index_path, *, bucket_bits=16, spk_index=False):
+    """Build the index for a snapshot and return the number of coins indexed."""
+    with open(snapshot_path, 'rb') as f:
+        network_string, block_hash, num_utxos = read_snapshot_header(f)
+        print(f"UTXO Snapshot for {network_string} at block hash "
+              f"{block_hash[::-1].hex()[:32]}..., contains {num_utxos} coins")
+        reader = SnapshotReader(f)
+        if reader.mm is None:
+            raise ValueError("the snapshot must be a regular file")
+        snapshot_size = len(reader.mm)
+
+        num_buckets = 1 << bucket_bits
+        bucket_offsets = [0] * (num_buckets + 1)
+        next_bucket = 0
+        prev_txid = b""
+        spk_entries = []
+        spk_runs = []
+        coins_read = 0
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(index_path))) as tmpdir:
+            while coins_read < num_utxos:
+                offset = reader.pos
+                coins, uncompressed_p2pk = reader.decode_coins(1)
+                txid = coins[0][0]
+                if txid <= prev_txid:
+                    raise ValueError(f"coins are not sorted by txid at offset {offset}")
+                prev_txid = txid
+                bucket = txid_bucket(txid, bucket_bits)
+                while next_bucket <= bucket:
+                    bucket_offsets[next_bucket] = offset
+                    next_bucket += 1
+                if reader.coins_per_hash_left > 0:
+                    more_coins, more_p2pk = reader.decode_coins(reader.coins_per_hash_left)
+                    uncompressed_p2pk += [(len(coins) + i, pubkey) for i, pubkey in more_p2pk]
+                    coins += more_coins
+                coins_read += len(coins)
+
+                if spk_index:
+                    offset_bytes = offset.to_bytes(8, 'big')
+                    keys = {script_hash(coin[5]) for coin in coins if coin[5] is not None}
+                    keys.update(p2pk_key(pubkey) for _, pubkey in uncompressed_p2pk)
+                    spk_entries += [key + offset_bytes for key in keys]
+                    if len(spk_entries) >= SPK_RUN_SIZE:
+                        write_spk_run(spk_entries, tmpdir, spk_runs)
+            for bucket in range(next_bucket, num_buckets + 1):
+                bucket_offsets[bucket] = reader.pos
+            at_eof = reader.at_eof()
+            reader.close()
+            if not at_eof:
+                raise ValueError("snapshot has not reached EOF after the last coin")
+
+            with open(index_path + ".new", "wb") as out:
+                out.write(struct.pack(INDEX_HEADER_FORMAT, INDEX_MAGIC, INDEX_VERSION, bucket_bits,
+                                      INDEX_FLAG_SPK if spk_index else 0, snapshot_size, block_hash, num_utxos))
+                out.write(struct.pack(f"<{num_buckets + 1}Q", *bucket_offsets))
+                if spk_index:
+                    if spk_runs:
+                        write_spk_run(spk_entries, tmpdir, spk_runs)
+                        entries = heapq.merge(*(read_spk_run(path) for path in spk_runs))
+                    else:
+                        entries = sorted(spk_entries)
+                    count_pos = out.tell()
+                    out.write(struct.pack("<Q", 0))
+                    num_entries = 0
+                    for entry in entries:
+                        out.write(entry)
+                        num_entries += 1
+                    out.seek(count_pos)
+                    out.write(struct.pack("<Q", num_entries))
+            os.replace(index_path + ".new", index_path)
+    return num_utxos
+
+
+class SnapshotIndex:
+    """Point lookups in a snapshot through its index.
+
+    Coins are returned as (prevout_hash, prevout_index, amount, is_coinbase,
+    height, scriptpubkey) tuples, like in utxo_to_sqlite.py. Txids are in
+    internal byte order."""
+
+    def __init__(self, snapshot_path, index_path):
+        self.f = open(snapshot_path, 'rb')
+        _, block_hash, self.num_utxos = read_snapshot_header(self.f)
+        self.reader = SnapshotReader(self.f)
+        if self.reader.mm is None:
+            raise ValueError("the snapshot must be a regular file")
+        with open(index_path, 'rb') as f:
+            header = f.read(INDEX_HEADER_SIZE)
+            if len(header) < INDEX_HEADER_SIZE:
+                raise ValueError("index file is truncated")
+            (magic, version, self.bucket_bits, flags, snapshot_size,
+             index_block_hash, _) = struct.unpack(INDEX_HEADER_FORMAT, header)
+            if magic != INDEX_MAGIC or version != INDEX_VERSION:
+                raise ValueError("not a UTXO snapshot index, or unknown index version")
+            if snapshot_size != len(self.reader.mm) or index_block_hash != block_hash:
+                raise ValueError("index was built for a different snapshot, rebuild it")
+            num_offsets = (1 << self.bucket_bits) + 1
+            self.bucket_offsets = struct.unpack(f"<{num_offsets}Q", f.read(8 * num_offsets))
+            self.spk_entries = None
+            if flags & INDEX_FLAG_SPK:
+                num_entries, = struct.unpack("<Q", f.read(8))
+                self.spk_entries = f.read(num_entries * SPK_ENTRY_SIZE)
+                if len(self.spk_entries) != num_entries * SPK_ENTRY_SIZE:
+                    raise ValueError("index file is truncated")
+
+    def _read_group(self, offset, p2pk_filter=None):
+        """Decode the coins of the txid group at offset, returns them and the offset of the next group.
+
+        If p2pk_filter is given, only the P2PK outputs with this compressed
+        pubkey are decompressed and the other uncompressed P2PK outputs are
+        dropped."""
+        self.reader.seek(offset)
+        coins, uncompressed_p2pk = self.reader.decode_coins(1)
+        if self.reader.coins_per_hash_left > 0:
+            more_coins, more_p2pk = self.reader.decode_coins(self.reader.coins_per_hash_left)
+            uncompressed_p2pk += [(len(coins) + i, pubkey) for i, pubkey in more_p2pk]
+            coins += more_coins
+        if p2pk_filter is not None:
+            uncompressed_p2pk = [(i, pubkey) for i, pubkey in uncompressed_p2pk if pubkey == p2pk_filter]
+        decompress_p2pk_scripts(coins, uncompressed_p2pk)
+        return [coin for coin in coins if coin[5] is not None], self.reader.pos
+
+    def coins_by_txid(self, txid):
+        """Return all unspent coins of the transaction."""
+        bucket = txid_bucket(txid, self.bucket_bits)
+        offset, end = self.bucket_offsets[bucket], self.bucket_offsets[bucket + 1]
+        mm = self.reader.mm
+        while offset < end:
+            group_txid = mm[offset:offset + 32]
+            if group_txid > txid:
+                break
+            coins, next_offset = self._read_group(offset)
+            if group_txid == txid:
+                return coins
+            offset = next_offset
+        return []
+
+    def get(self, txid, vout):
+        """Return the coin for an outpoint, or None if it is not in the snapshot."""
+        for coin in self.coins_by_txid(txid):
+            if coin[1] == vout:
+                return coin
+        return None
+
+    def coins_by_script(self, scriptpubkey):
+        """Return all coins with the scriptPubKey (requires an index built with --spk)."""
+        if self.spk_entries is None:
+            raise ValueError("index was built without the scriptPubKey table, rebuild it with --spk")
+        offsets = set()
+        for key in script_keys(scriptpubkey):
+            offsets.update(self._find_spk_offsets(key))
+        compressed_pubkey = compress_p2pk(scriptpubkey)
+        result = []
+        for offset in sorted(offsets):
+            coins, _ = self._read_group(offset, p2pk_filter=compressed_pubkey)
+            result += [coin for coin in coins if coin[5] == scriptpubkey]
+        return result
+
+    def _find_spk_offsets(self, key):
+        entries = self.spk_entries
+        lo, hi = 0, len(entries) // SPK_ENTRY_SIZE
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if entries[mid * SPK_ENTRY_SIZE:mid * SPK_ENTRY_SIZE + 8] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        pos = lo * SPK_ENTRY_SIZE
+        while entries[pos:pos + 8] == key:
+            yield int.from_bytes(entries[pos + 8:pos + SPK_ENTRY_SIZE], 'big')
+            pos += SPK_ENTRY_SIZE
+
+    def close(self):
+        self.reader.close()
+        self.f.close()
+
+
+def coin_to_json(coin):
+    prevout_hash, prevout_index, amount, is_coinbase, height, scriptpubkey = coin
+    return json.dumps({"txid": prevout_hash[::-1].hex(), "vout": prevout_index, "value": amount,
+                       "coinbase": is_coinbase, "height": height, "scriptpubkey": scriptpubkey.hex()})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help='build the index for a snapshot')
+    build_parser.add_argument('infile', help='filename of compact-serialized UTXO set')
+    build_parser.add_argument('--index', help='filename of the index (default: <infile>.idx)')
+    build_parser.add_argument('--bucket-bits', type=int, default=16, choices=range(8, 25), metavar='[8-24]', help='number of txid prefix bits per bucket (default: 16)')
+    build_parser.add_argument('--spk', action='store_true', help='also index the scriptPubKeys, for lookups with --spk')
+    lookup_parser = subparsers.add_parser('lookup', help='look up coins in a snapshot')
+    lookup_parser.add_argument('infile', help='filename of compact-serialized UTXO set')
+    lookup_parser.add_argument('--index', help='filename of the index (default: <infile>.idx)')
+    query = lookup_parser.add_mutually_exclusive_group(required=True)
+    query.add_argument('--outpoint', help='look up the coin <txid>:<vout>')
+    query.add_argument('--txid', help='look up all coins of a transaction')
+    query.add_argument('--spk', help='look up all coins with the scriptPubKey (hex)')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.infile):
+        print(f"Error: provided input file '{args.infile}' doesn't exist.")
+        sys.exit(1)
+    index_path = args.index or args.infile + ".idx"
+
+    if args.command == 'build':
+        try:
+            num_utxos = build_index(args.infile, index_path, bucket_bits=args.bucket_bits, spk_index=args.spk)
+        except ValueError as e:
+            print(f"Error: cannot index '{args.infile}': {e}")
+            sys.exit(1)
+        print(f"TOTAL: {num_utxos} coins indexed in {index_path}.")
+        return
+
+    if not os.path.exists(index_path):
+        print(f"Error: index file '{index_path}' doesn't exist, create it with the build command.")
+        sys.exit(1)
+    try:
+        index = SnapshotIndex(args.infile, index_path)
+        if args.outpoint is not None:
+            txid, vout = args.outpoint.split(':')
+            coin = index.get(bytes.fromhex(txid)[::-1], int(vout))
+            coins = [coin] if coin is not None else []
+        elif args.txid is not None:
+            coins = index.coins_by_txid(bytes.fromhex(args.txid)[::-1])
+        else:
+            coins = index.coins_by_script(bytes.fromhex(args.spk))
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    index.close()
+    for coin in coins:
+        print(coin_to_json(coin))
+    if not coins:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
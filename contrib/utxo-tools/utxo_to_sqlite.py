@@ -12,10 +12,26 @@ The created database contains a table `utxos` with the following schema:
 
 If --txid=raw or --txid=rawle is specified, txid will be BLOB instead;
 if --spk=raw, then scriptpubkey will be BLOB instead.
+With --index, indexes on (txid, vout) and scriptpubkey are created after loading.
+
+With --format=columnar, the output is a directory with one file per column instead,
+for analytics tools that can memory-map fixed-width binary columns:
+  txid                 32 bytes per coin, byte order as selected with --txid (hex is stored as rawle)
+  vout                 uint32, little endian
+  value                int64, little endian
+  coinbase             uint8
+  height               uint32, little endian
+  scriptpubkey         raw scriptPubKeys, concatenated
+  scriptpubkey_offset  uint64, little endian, start offset of each scriptPubKey plus the total size
+  metadata.json        snapshot metadata and the column layout
 """
 import argparse
+import json
+import mmap
 import os
 import sqlite3
+import stat
+import struct
 import sys
 import time
 
@@ -31,30 +47,6 @@ NET_MAGIC_BYTES = {
 }
 
 
-def read_varint(f):
-    """Equivalent of `ReadVarInt()` (see serialization module)."""
-    n = 0
-    while True:
-        dat = f.read(1)[0]
-        n = (n << 7) | (dat & 0x7f)
-        if (dat & 0x80) > 0:
-            n += 1
-        else:
-            return n
-
-
-def read_compactsize(f):
-    """Equivalent of `ReadCompactSize()` (see serialization module)."""
-    n = f.read(1)[0]
-    if n == 253:
-        n = int.from_bytes(f.read(2), "little")
-    elif n == 254:
-        n = int.from_bytes(f.read(4), "little")
-    elif n == 255:
-        n = int.from_bytes(f.read(8), "little")
-    return n
-
-
 def decompress_amount(x):
     """Equivalent of `DecompressAmount()` (see compressor module)."""
     if x == 0:
@@ -75,24 +67,6 @@ def decompress_amount(x):
     return n
 
 
-def decompress_script(f):
-    """Equivalent of `DecompressScript()` (see compressor module)."""
-    size = read_varint(f)  # sizes 0-5 encode compressed script types
-    if size == 0:  # P2PKH
-        return bytes([0x76, 0xa9, 20]) + f.read(20) + bytes([0x88, 0xac])
-    elif size == 1:  # P2SH
-        return bytes([0xa9, 20]) + f.read(20) + bytes([0x87])
-    elif size in (2, 3):  # P2PK (compressed)
-        return bytes([33, size]) + f.read(32) + bytes([0xac])
-    elif size in (4, 5):  # P2PK (uncompressed)
-        compressed_pubkey = bytes([size - 2]) + f.read(32)
-        return bytes([65]) + decompress_pubkey(compressed_pubkey) + bytes([0xac])
-    else:  # others (bare multisig, segwit etc.)
-        size -= 6
-        assert size <= 10000, f"too long script with size {size}"
-        return f.read(size)
-
-
 def decompress_pubkey(compressed_pubkey):
     """Decompress pubkey by calculating y = sqrt(x^3 + 7) % p
        (see functions `secp256k1_eckey_pubkey_parse` and `secp256k1_ge_set_xo_var`).
@@ -110,13 +84,271 @@ def decompress_pubkey(compressed_pubkey):
     return bytes([4]) + x.to_bytes(32, 'big') + y.to_bytes(32, 'big')
 
 
+class SnapshotReader:
+    """Buffered decoder for the coins in a UTXO snapshot.
+
+    Regular files are memory-mapped. Other inputs, like a named pipe that
+    `dumptxoutset` writes into, are read in large chunks. Coins are decoded from
+    the buffer in batches instead of with one file read per field."""
+    CHUNK_SIZE = 1 << 22
+    # Upper bound for the serialized size of a single coin, including a new prevout hash
+    MAX_COIN_SIZE = 32 + 9 + 9 + 10 + 10 + 10 + 10000
+
+    def __init__(self, f):
+        self.f = f
+        self.mm = None
+        try:
+            if stat.S_ISREG(os.fstat(f.fileno()).st_mode) and os.fstat(f.fileno()).st_size > 0:
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            pass
+        self.buf = self.mm if self.mm is not None else b""
+        self.pos = f.tell() if self.mm is not None else 0
+        self.eof = self.mm is not None
+        # decoding state carried over between batches
+        self.prevout_hash = None
+        self.coins_per_hash_left = 0
+
+    def _fill(self, n):
+        """Buffer at least n bytes after the current position, unless the input ends before."""
+        if self.eof:
+            return
+        chunks = [self.buf[self.pos:]]
+        buffered = len(chunks[0])
+        while buffered < n:
+            chunk = self.f.read(max(self.CHUNK_SIZE, n - buffered))
+            if not chunk:
+                self.eof = True
+                break
+            chunks.append(chunk)
+            buffered += len(chunk)
+        self.buf = b"".join(chunks)
+        self.pos = 0
+
+    def read(self, n):
+        if self.pos + n > len(self.buf):
+            self._fill(n)
+        data = self.buf[self.pos:self.pos + n]
+        self.pos += len(data)
+        return data
+
+    def decode_coins(self, count):
+        """Decode the next count coins.
+
+        Returns a list of (prevout_hash, prevout_index, amount, is_coinbase, height,
+        scriptpubkey) tuples and a list of (position, compressed_pubkey) pairs for
+        the P2PK outputs with uncompressed pubkeys, whose scriptpubkey is left as
+        None to be filled in by decompress_p2pk_scripts."""
+        coins = []
+        uncompressed_p2pk = []
+        buf, pos = self.buf, self.pos
+        prevout_hash, coins_per_hash_left = self.prevout_hash, self.coins_per_hash_left
+        for _ in range(count):
+            if len(buf) - pos < self.MAX_COIN_SIZE and not self.eof:
+                self.pos = pos
+                self._fill(self.MAX_COIN_SIZE)
+                buf, pos = self.buf, self.pos
+            # read key (COutPoint). Single-byte integers are by far the most
+            # common, so they are decoded inline.
+            if coins_per_hash_left == 0:  # read next prevout hash
+                prevout_hash = buf[pos:pos + 32]
+                coins_per_hash_left = buf[pos + 32]
+                if coins_per_hash_left < 253:
+                    pos += 33
+                else:
+                    coins_per_hash_left, pos = decode_compactsize(buf, pos + 32)
+            prevout_index = buf[pos]
+            if prevout_index < 253:
+                pos += 1
+            else:
+                prevout_index, pos = decode_compactsize(buf, pos)
+            # read value (Coin)
+            code = 0
+            while True:
+                dat = buf[pos]
+                pos += 1
+                if dat < 0x80:
+                    code = (code << 7) | dat
+                    break
+                code = ((code << 7) | (dat & 0x7f)) + 1
+            amount = 0
+            while True:
+                dat = buf[pos]
+                pos += 1
+                if dat < 0x80:
+                    amount = (amount << 7) | dat
+                    break
+                amount = ((amount << 7) | (dat & 0x7f)) + 1
+            size = buf[pos]  # sizes 0-5 encode compressed script types
+            if size < 0x80:
+                pos += 1
+            else:
+                size, pos = decode_varint(buf, pos)
+            if size == 0:  # P2PKH
+                scriptpubkey = b"\x76\xa9\x14" + buf[pos:pos + 20] + b"\x88\xac"
+                pos += 20
+            elif size == 1:  # P2SH
+                scriptpubkey = b"\xa9\x14" + buf[pos:pos + 20] + b"\x87"
+                pos += 20
+            elif size in (2, 3):  # P2PK (compressed)
+                scriptpubkey = bytes([33, size]) + buf[pos:pos + 32] + b"\xac"
+                pos += 32
+            elif size in (4, 5):  # P2PK (uncompressed)
+                uncompressed_p2pk.append((len(coins), bytes([size - 2]) + buf[pos:pos + 32]))
+                scriptpubkey = None
+                pos += 32
+            else:  # others (bare multisig, segwit etc.)
+                size -= 6
+                assert size <= 10000, f"too long script with size {size}"
+                scriptpubkey = buf[pos:pos + size]
+                pos += size
+            if pos > len(buf):
+                raise EOFError("unexpected end of UTXO snapshot")
+            coins.append((prevout_hash, prevout_index, decompress_amount(amount), code & 1, code >> 1, scriptpubkey))
+            coins_per_hash_left -= 1
+        self.pos = pos
+        self.prevout_hash, self.coins_per_hash_left = prevout_hash, coins_per_hash_left
+        return coins, uncompressed_p2pk
+
+    def seek(self, pos):
+        """Continue decoding at the prevout hash at pos (memory-mapped files only)."""
+        assert self.mm is not None
+        self.pos = pos
+        self.prevout_hash = None
+        self.coins_per_hash_left = 0
+
+    def at_eof(self):
+        return self.read(1) == b""
+
+    def close(self):
+        if self.mm is not None:
+            self.buf = b""
+            self.mm.close()
+
+
+def decode_varint(buf, pos):
+    """Equivalent of `ReadVarInt()` (see serialization module), returns the value and the new position."""
+    n = 0
+    while True:
+        dat = buf[pos]
+        pos += 1
+        n = (n << 7) | (dat & 0x7f)
+        if (dat & 0x80) > 0:
+            n += 1
+        else:
+            return n, pos
+
+
+def decode_compactsize(buf, pos):
+    """Equivalent of `ReadCompactSize()` (see serialization module), returns the value and the new position."""
+    n = buf[pos]
+    if n < 253:
+        return n, pos + 1
+    size = {253: 2, 254: 4, 255: 8}[n]
+    return int.from_bytes(buf[pos + 1:pos + 1 + size], "little"), pos + 1 + size
+
+
+def p2pk_script(compressed_pubkey):
+    return bytes([65]) + decompress_pubkey(compressed_pubkey) + bytes([0xac])
+
+
+def decompress_p2pk_scripts(coins, uncompressed_p2pk):
+    """Fill in the scriptPubKeys of the P2PK outputs with uncompressed pubkeys."""
+    for i, pubkey in uncompressed_p2pk:
+        coins[i] = coins[i][:5] + (p2pk_script(pubkey),)
+
+
+class SqliteWriter:
+    """Bulk-load coins into the `utxos` table of a new SQLite3 database."""
+    def __init__(self, filename, txid_hex, txid_reverse, spk_hex):
+        self.txid_hex = txid_hex
+        self.txid_reverse = txid_reverse
+        self.spk_hex = spk_hex
+        txid_fmt = "TEXT" if txid_hex else "BLOB"
+        spk_fmt = "TEXT" if spk_hex else "BLOB"
+        self.con = sqlite3.connect(filename)
+        # The database is created from scratch, so there is nothing to protect with a
+        # journal or fsyncs while loading. Everything is committed in one transaction.
+        self.con.execute("PRAGMA journal_mode = OFF")
+        self.con.execute("PRAGMA synchronous = OFF")
+        self.con.execute("PRAGMA locking_mode = EXCLUSIVE")
+        self.con.execute("PRAGMA temp_store = MEMORY")
+        self.con.execute("PRAGMA cache_size = -262144")  # 256 MiB
+        self.con.execute(f"CREATE TABLE utxos(txid {txid_fmt}, vout INT, value INT, coinbase INT, height INT, scriptpubkey {spk_fmt})")
+
+    def write(self, coins):
+        rows = []
+        for (prevout_hash, prevout_index, amount, is_coinbase, height, scriptpubkey) in coins:
+            txid_write = prevout_hash[::-1] if self.txid_reverse else prevout_hash
+            txid_write = txid_write.hex() if self.txid_hex else txid_write
+            scriptpubkey_write = scriptpubkey.hex() if self.spk_hex else scriptpubkey
+            rows.append((txid_write, prevout_index, amount, is_coinbase, height, scriptpubkey_write))
+        self.con.executemany("INSERT INTO utxos VALUES(?, ?, ?, ?, ?, ?)", rows)
+
+    def close(self, create_indexes):
+        self.con.commit()
+        if create_indexes:
+            print("Creating indexes...")
+            self.con.execute("CREATE INDEX utxos_txid_vout ON utxos(txid, vout)")
+            self.con.execute("CREATE INDEX utxos_scriptpubkey ON utxos(scriptpubkey)")
+            self.con.commit()
+        self.con.close()
+
+
+class ColumnarWriter:
+    """Write coins as fixed-width binary columns into a new directory (see module docstring)."""
+    COLUMNS = {
+        "txid": "32s",
+        "vout": "<u4",
+        "value": "<i8",
+        "coinbase": "u1",
+        "height": "<u4",
+        "scriptpubkey_offset": "<u8",
+        "scriptpubkey": "bytes",
+    }
+
+    def __init__(self, dirname, txid_reverse, metadata):
+        os.mkdir(dirname)
+        self.dirname = dirname
+        self.txid_reverse = txid_reverse
+        self.metadata = metadata
+        self.files = {name: open(os.path.join(dirname, name), "wb") for name in self.COLUMNS}
+        self.spk_offset = 0
+
+    def write(self, coins):
+        n = len(coins)
+        txids, vouts, values, coinbases, heights, scriptpubkeys = zip(*coins)
+        if self.txid_reverse:
+            txids = [txid[::-1] for txid in txids]
+        offsets = []
+        for scriptpubkey in scriptpubkeys:
+            offsets.append(self.spk_offset)
+            self.spk_offset += len(scriptpubkey)
+        self.files["txid"].write(b"".join(txids))
+        self.files["vout"].write(struct.pack(f"<{n}I", *vouts))
+        self.files["value"].write(struct.pack(f"<{n}q", *values))
+        self.files["coinbase"].write(bytes(coinbases))
+        self.files["height"].write(struct.pack(f"<{n}I", *heights))
+        self.files["scriptpubkey_offset"].write(struct.pack(f"<{n}Q", *offsets))
+        self.files["scriptpubkey"].write(b"".join(scriptpubkeys))
+
+    def close(self, create_indexes):
+        self.files["scriptpubkey_offset"].write(struct.pack("<Q", self.spk_offset))
+        for f in self.files.values():
+            f.close()
+        with open(os.path.join(self.dirname, "metadata.json"), "w") as f:
+            json.dump(dict(self.metadata, columns=self.COLUMNS), f, indent=2)
+
+
 def main():
     parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('infile', help='filename of compact-serialized UTXO set (input)')
-    parser.add_argument('outfile', help='filename of created SQLite3 database (output)')
+    parser.add_argument('outfile', help='filename of created SQLite3 database, or directory for --format=columnar (output)')
     parser.add_argument('--verbose', action='store_true', help='show details about each UTXO')
     parser.add_argument('--spk', choices=['hex', 'raw'], default='hex', help='encode scriptPubKey as hex or raw bytes')
     parser.add_argument('--txid', choices=['hex', 'raw', 'rawle'], default='hex', help='encode txid as hex, raw bytes (sha256 byteorder), or reversed raw bytes (little endian)')
+    parser.add_argument('--format', choices=['sqlite', 'columnar'], default='sqlite', help='output a SQLite3 database or a directory of binary columns')
+    parser.add_argument('--index', action='store_true', help='create indexes on (txid, vout) and scriptpubkey after loading (sqlite only)')
     args = parser.parse_args()
 
     if not os.path.exists(args.infile):
@@ -131,12 +363,6 @@ def main():
     txid_hex = (args.txid == 'hex')
     txid_reverse = (args.txid != 'raw')
 
-    # create database table
-    txid_fmt = "TEXT" if txid_hex else "BLOB"
-    spk_fmt = "TEXT" if spk_hex else "BLOB"
-    con = sqlite3.connect(args.outfile)
-    con.execute(f"CREATE TABLE utxos(txid {txid_fmt}, vout INT, value INT, coinbase INT, height INT, scriptpubkey {spk_fmt})")
-
     # read metadata (magic bytes, version, network magic, block hash, UTXO count)
     f = open(args.infile, 'rb')
     magic_bytes = f.read(5)
@@ -155,53 +381,42 @@ def main():
     print(f"UTXO Snapshot for {network_string} at block hash "
           f"{block_hash[::-1].hex()[:32]}..., contains {num_utxos} coins")
 
+    if args.format == 'columnar':
+        metadata = {"network": network_string, "block_hash": block_hash[::-1].hex(), "num_coins": num_utxos}
+        writer = ColumnarWriter(args.outfile, txid_reverse, metadata)
+    else:
+        writer = SqliteWriter(args.outfile, txid_hex, txid_reverse, spk_hex)
+
+    reader = SnapshotReader(f)
     start_time = time.time()
-    write_batch = []
-    coins_per_hash_left = 0
-    prevout_hash = None
     max_height = 0
-
-    for coin_idx in range(1, num_utxos+1):
-        # read key (COutPoint)
-        if coins_per_hash_left == 0:  # read next prevout hash
-            prevout_hash = f.read(32)
-            coins_per_hash_left = read_compactsize(f)
-        prevout_index = read_compactsize(f)
-        # read value (Coin)
-        code = read_varint(f)
-        height = code >> 1
-        is_coinbase = code & 1
-        amount = decompress_amount(read_varint(f))
-        scriptpubkey = decompress_script(f)
-
-        scriptpubkey_write = scriptpubkey.hex() if spk_hex else scriptpubkey
-        txid_write = prevout_hash[::-1] if txid_reverse else prevout_hash
-        txid_write = txid_write.hex() if txid_hex else txid_write
-        write_batch.append((txid_write, prevout_index, amount, is_coinbase, height, scriptpubkey_write))
-        if height > max_height:
-            max_height = height
-        coins_per_hash_left -= 1
-
-        if args.verbose:
-            print(f"Coin {coin_idx}/{num_utxos}:")
-            print(f"    prevout = {prevout_hash[::-1].hex()}:{prevout_index}")
-            print(f"    amount = {amount}, height = {height}, coinbase = {is_coinbase}")
-            print(f"    scriptPubKey = {scriptpubkey.hex()}\n")
-
-        if coin_idx % (16*1024) == 0 or coin_idx == num_utxos:
-            # write utxo batch to database
-            con.executemany("INSERT INTO utxos VALUES(?, ?, ?, ?, ?, ?)", write_batch)
-            con.commit()
-            write_batch.clear()
-
-        if coin_idx % (1024*1024) == 0:
-            elapsed = time.time() - start_time
-            print(f"{coin_idx} coins converted [{coin_idx/num_utxos*100:.2f}%], " +
-                  f"{elapsed:.3f}s passed since start")
-    con.close()
+    coin_idx = 0
+    batch_size = 16*1024
+    coins_decoded = 0
+    while coins_decoded < num_utxos:
+        coins, uncompressed_p2pk = reader.decode_coins(min(batch_size, num_utxos - coins_decoded))
+        coins_decoded += len(coins)
+        decompress_p2pk_scripts(coins, uncompressed_p2pk)
+        writer.write(coins)
+        for (prevout_hash, prevout_index, amount, is_coinbase, height, scriptpubkey) in coins:
+            coin_idx += 1
+            if height > max_height:
+                max_height = height
+            if args.verbose:
+                print(f"Coin {coin_idx}/{num_utxos}:")
+                print(f"    prevout = {prevout_hash[::-1].hex()}:{prevout_index}")
+                print(f"    amount = {amount}, height = {height}, coinbase = {is_coinbase}")
+                print(f"    scriptPubKey = {scriptpubkey.hex()}\n")
+            if coin_idx % (1024*1024) == 0:
+                elapsed = time.time() - start_time
+                print(f"{coin_idx} coins converted [{coin_idx/num_utxos*100:.2f}%], " +
+                      f"{elapsed:.3f}s passed since start")
+    writer.close(args.index)
 
     print(f"TOTAL: {num_utxos} coins written to {args.outfile}, snapshot height is {max_height}.")
-    if f.read(1) != b'':  # EOF should be reached by now
+    at_eof = reader.at_eof()  # EOF should be reached by now
+    reader.close()
+    if not at_eof:
         print(f"WARNING: input file {args.infile} has not reached EOF yet!")
         sys.exit(1)
 
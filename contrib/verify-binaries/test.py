@@ -1,13 +1,33 @@
 #!/usr/bin/env python3
 
 import json
+import os
 import sys
 import subprocess
+import tempfile
+import threading
+from functools import partial
+from hashlib import sha256
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 
+# A release matrix like the one of 28.0
+RELEASE_PLATFORMS = [
+    'aarch64-linux-gnu.tar.gz', 'aarch64-linux-gnu-debug.tar.gz', 'arm-linux-gnueabihf.tar.gz',
+    'arm64-apple-darwin.zip', 'arm64-apple-darwin-unsigned.tar.gz', 'arm64-apple-darwin.tar.gz',
+    'powerpc64-linux-gnu.tar.gz', 'powerpc64le-linux-gnu.tar.gz', 'riscv64-linux-gnu.tar.gz',
+    'x86_64-apple-darwin.zip', 'x86_64-apple-darwin.tar.gz', 'x86_64-linux-gnu.tar.gz',
+    'x86_64-linux-gnu-debug.tar.gz', 'win64-setup.exe', 'win64.zip', 'win64-debug.zip',
+    'codesignatures-99.0.tar.gz', 'tar.gz',
+]
+
 
 def main():
     """Tests ordered roughly from faster to slower."""
+    test_local_release()
+    if '--offline' in sys.argv[1:]:
+        return
+
     expect_code(run_verify("", "pub", '0.32'), 4, "Nonexistent version should fail")
     expect_code(run_verify("", "pub", '0.32.awefa.12f9h'), 11, "Malformed version should fail")
     expect_code(run_verify('--min-good-sigs 20', "pub", "22.0"), 9, "--min-good-sigs 20 should fail")
@@ -44,7 +64,81 @@ def main():
     assert v['bitcoin-22.0-x86_64-linux-gnu.tar.gz'] == '59ebd25dd82a51638b7a6bb914586201e67db67b919b2a1ff08925a7936d1b16'
 
 
-def run_verify(global_args: str, command: str, command_args: str) -> subprocess.CompletedProcess:
+class ReleaseServer(ThreadingHTTPServer):
+    """Stand-in for a release host, serving the files of a local directory."""
+    def __init__(self, directory: Path):
+        self.requests: list[str] = []
+
+        class Handler(SimpleHTTPRequestHandler):
+            def log_message(handler, format, *args):
+                self.requests.append(handler.path)
+
+        super().__init__(('127.0.0.1', 0), partial(Handler, directory=str(directory)))
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+def test_local_release():
+    print("- testing verification against local hosts", flush=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_path = Path(tmp)
+        env = dict(os.environ, GNUPGHOME=str(tmp_path / 'gnupg'), TMPDIR=str(tmp_path), BINVERIFY_CACHE_DIR=str(tmp_path / 'cache'))
+        (tmp_path / 'gnupg').mkdir(mode=0o700)
+        subprocess.run(
+            ['gpg', '--batch', '--passphrase', '', '--quick-gen-key', 'Test Builder <builder@example.com>', 'ed25519', 'sign', 'never'],
+            env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        hosts = [tmp_path / 'host1', tmp_path / 'host2']
+        release_dirs = [host / 'bin' / 'bitcoin-core-99.0' for host in hosts]
+        for release_dir in release_dirs:
+            release_dir.mkdir(parents=True)
+        sums = ""
+        expected = {}
+        for i, platform in enumerate(RELEASE_PLATFORMS):
+            filename = f"bitcoin-99.0-{platform}" if not platform.startswith('codesignatures') else f"bitcoin-{platform}"
+            data = os.urandom(1 << 20) + bytes([i])
+            sums += f"{sha256(data).hexdigest()}  {filename}\n"
+            if not any(f in filename for f in ['-unsigned', '-debug', '-codesignatures']):
+                (release_dirs[0] / filename).write_bytes(data)
+                expected[filename] = sha256(data).hexdigest()
+        for release_dir in release_dirs:
+            (release_dir / 'SHA256SUMS').write_text(sums)
+            subprocess.run(
+                ['gpg', '--batch', '--detach-sign', '--armor', '--output', release_dir / 'SHA256SUMS.asc', release_dir / 'SHA256SUMS'],
+                env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        servers = [ReleaseServer(host) for host in hosts]
+        args = f"--hosts {servers[0].url},{servers[1].url} 99.0"
+        try:
+            result = run_verify('--json --min-good-sigs 1', 'pub', args, env)
+            expect_code(result, 0, "Local release should succeed")
+            assert json.loads(result.stdout.decode())['verified_binaries'] == expected
+            assert len(os.listdir(tmp_path / 'cache')) == len(expected)
+
+            # Replacing a binary on the host does not affect cached binaries,
+            # which are only downloaded once.
+            (release_dirs[0] / 'bitcoin-99.0-win64.zip').write_bytes(b'evil')
+            servers[0].requests.clear()
+            result = run_verify('--json --min-good-sigs 1', 'pub', args, env)
+            expect_code(result, 0, "Local release should succeed from the cache")
+            assert json.loads(result.stdout.decode())['verified_binaries'] == expected
+            assert sorted(servers[0].requests) == ['/bin/bitcoin-core-99.0/SHA256SUMS', '/bin/bitcoin-core-99.0/SHA256SUMS.asc']
+
+            expect_code(run_verify('--min-good-sigs 1', 'pub', f"--no-cache {args}", env), 1, "Modified binary should fail")
+            expect_code(run_verify('--min-good-sigs 2', 'pub', args, env), 9, "--min-good-sigs 2 should fail")
+
+            (release_dirs[1] / 'SHA256SUMS').write_text(sums.replace('win64', 'win32'))
+            expect_code(run_verify('--min-good-sigs 1', 'pub', args, env), 6, "Different sums files should fail")
+        finally:
+            for server in servers:
+                server.shutdown()
+                server.server_close()
+
+
+def run_verify(global_args: str, command: str, command_args: str, env=None) -> subprocess.CompletedProcess:
     maybe_here = Path.cwd() / 'verify.py'
     path = maybe_here if maybe_here.exists() else Path.cwd() / 'contrib' / 'verify-binaries' / 'verify.py'
 
@@ -53,7 +147,7 @@ def run_verify(global_args: str, command: str, command_args: str) -> subprocess.
 
     return subprocess.run(
         f"{path} {global_args} {command} {command_args}",
-        stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, env=env)
 
 
 def expect_code(completed: subprocess.CompletedProcess, expected_code: int, msg: str):
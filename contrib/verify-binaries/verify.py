@@ -19,7 +19,9 @@ The builder keys are available in the guix.sigs repo:
 
 If a minimum good, trusted signature threshold is met on the sum file, we then
 download the files specified in SHA256SUMS, and check if the hashes of these
-files match those that are specified. The script returns 0 if everything passes
+files match those that are specified. Files are downloaded concurrently and
+hashed while they are written. Verified files are kept in a local cache named
+by their hash, so that they are not downloaded again. The script returns 0 if everything passes
 the checks. It returns 1 if either the signature check or the hash check
 doesn't pass. If an error occurs the return value is >= 2.
 
@@ -29,6 +31,7 @@ JSON output can by obtained by setting env BINVERIFY_JSON=1.
 """
 import argparse
 import difflib
+import http.client
 import json
 import logging
 import os
@@ -40,6 +43,8 @@ import shutil
 import tempfile
 import textwrap
 import enum
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import sha256
 from pathlib import PurePath, Path
 
@@ -49,6 +54,9 @@ HOST2 = "https://bitcoin.org"
 VERSIONPREFIX = "bitcoin-core-"
 SUMS_FILENAME = 'SHA256SUMS'
 SIGNATUREFILENAME = f"{SUMS_FILENAME}.asc"
+DOWNLOAD_TIMEOUT = 60
+CHUNK_SIZE = 1 << 20
+DEFAULT_CACHE_DIR = Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'bitcoin-verify-binaries'
 
 
 class ReturnCode(enum.IntEnum):
@@ -108,10 +116,68 @@ def parse_version_string(version_str):
     return version_base, rc, platform
 
 
-def download_with_wget(remote_file, local_file):
-    result = subprocess.run(['wget', '-O', local_file, remote_file],
-                            stderr=subprocess.STDOUT, stdout=subprocess.PIPE)
-    return result.returncode == 0, result.stdout.decode().rstrip()
+def download_file(remote_file, local_file) -> tuple[bool, str, str]:
+    """Download a file, computing its SHA256 hash while it is written.
+
+    Returns whether the download succeeded, the error, and the hex digest.
+    """
+    hasher = sha256()
+    try:
+        with urllib.request.urlopen(remote_file, timeout=DOWNLOAD_TIMEOUT) as response, \
+                open(local_file, 'wb') as f:
+            while chunk := response.read(CHUNK_SIZE):
+                hasher.update(chunk)
+                f.write(chunk)
+    except (OSError, http.client.HTTPException) as e:
+        Path(local_file).unlink(missing_ok=True)
+        return False, f"{remote_file}: {e}", ""
+    return True, "", hasher.hexdigest()
+
+
+def hash_file(filename) -> str:
+    hasher = sha256()
+    with open(filename, 'rb') as f:
+        while chunk := f.read(CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def link_or_copy(source, destination):
+    Path(destination).unlink(missing_ok=True)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+class BinaryCache:
+    """Content-addressed store of verified files, named by their SHA256 hash.
+
+    Cached files are hashed again before they are used.
+    """
+    def __init__(self, cache_dir):
+        self.dir = Path(cache_dir)
+
+    def get(self, file_hash: str, filename: str) -> bool:
+        cached = self.dir / file_hash
+        if not cached.is_file():
+            return False
+        if hash_file(cached) != file_hash:
+            log.warning(f"removing corrupted cache entry {cached}")
+            cached.unlink(missing_ok=True)
+            return False
+        link_or_copy(cached, filename)
+        return True
+
+    def put(self, file_hash: str, filename: str):
+        try:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.dir, prefix=f"{file_hash}.", suffix=".tmp")
+            os.close(fd)
+            link_or_copy(filename, tmp)
+            os.replace(tmp, self.dir / file_hash)
+        except OSError as e:
+            log.warning(f"could not add {filename} to the cache {self.dir}: {e}")
 
 
 def verify_with_gpg(
@@ -249,7 +315,6 @@ def get_files_from_hosts_and_compare(
     Args:
         filename: for writing the file locally.
     """
-    assert len(hosts) > 1
     primary_host = hosts[0]
     other_hosts = hosts[1:]
     got_files = []
@@ -257,29 +322,31 @@ def get_files_from_hosts_and_compare(
     def join_url(host: str) -> str:
         return host.rstrip('/') + '/' + path.lstrip('/')
 
+    fnames = [filename] + [filename + f'.{i + 2}' for i in range(len(other_hosts))]
+    with ThreadPoolExecutor(max_workers=len(hosts)) as pool:
+        results = list(pool.map(download_file, map(join_url, hosts), fnames))
+
     url = join_url(primary_host)
-    success, output = download_with_wget(url, filename)
+    success, output, file_hash = results[0]
     if not success:
         log.error(
             f"couldn't fetch file ({url}). "
             "Have you specified the version number in the following format?\n"
             f"{VERSION_FORMAT} "
             f"(example: {VERSION_EXAMPLE})\n"
-            f"wget output:\n{indent(output)}")
+            f"error:\n{indent(output)}")
         return ReturnCode.FILE_GET_FAILED
     else:
         log.info(f"got file {url} as {filename}")
-        got_files.append(filename)
+        got_files.append((filename, file_hash))
 
-    for i, host in enumerate(other_hosts):
+    for host, fname, (success, output, file_hash) in zip(other_hosts, fnames[1:], results[1:]):
         url = join_url(host)
-        fname = filename + f'.{i + 2}'
-        success, output = download_with_wget(url, fname)
 
         if require_all and not success:
             log.error(
                 f"{host} failed to provide file ({url}), but {primary_host} did?\n"
-                f"wget output:\n{indent(output)}")
+                f"error:\n{indent(output)}")
             return ReturnCode.FILE_MISSING_FROM_ONE_HOST
         elif not success:
             log.warning(
@@ -287,14 +354,13 @@ def get_files_from_hosts_and_compare(
                 f"Continuing based solely upon {primary_host}.")
         else:
             log.info(f"got file {url} as {fname}")
-            got_files.append(fname)
-
-    for i, got_file in enumerate(got_files):
-        if got_file == got_files[-1]:
-            break  # break on last file, nothing after it to compare to
+            got_files.append((fname, file_hash))
 
-        compare_to = got_files[i + 1]
-        if not files_are_equal(got_file, compare_to):
+    # The hashes were computed while downloading, only read the files again to
+    # show the differences.
+    for (got_file, got_hash), (compare_to, compare_hash) in zip(got_files, got_files[1:]):
+        if got_hash != compare_hash:
+            files_are_equal(got_file, compare_to)
             log.error(f"files not equal: {got_file} and {compare_to}")
             return ReturnCode.FILES_NOT_EQUAL
 
@@ -411,13 +477,13 @@ def parse_sums_file(sums_file_path: str, filename_filter: list[str]) -> list[lis
         return [line.split()[:2] for line in hash_file if len(filename_filter) == 0 or any(f in line for f in filename_filter)]
 
 
-def verify_binary_hashes(hashes_to_verify: list[list[str]]) -> tuple[ReturnCode, dict[str, str]]:
+def check_binary_hashes(
+    hashes_to_verify: list[list[str]], hashes_calculated: list[str]
+) -> tuple[ReturnCode, dict[str, str]]:
     offending_files = []
     files_to_hashes = {}
 
-    for hash_expected, binary_filename in hashes_to_verify:
-        with open(binary_filename, 'rb') as binary_file:
-            hash_calculated = sha256(binary_file.read()).hexdigest()
+    for (hash_expected, binary_filename), hash_calculated in zip(hashes_to_verify, hashes_calculated):
         if hash_calculated != hash_expected:
             offending_files.append(binary_filename)
         else:
@@ -433,6 +499,41 @@ def verify_binary_hashes(hashes_to_verify: list[list[str]]) -> tuple[ReturnCode,
     return (ReturnCode.SUCCESS, files_to_hashes)
 
 
+def verify_binary_hashes(hashes_to_verify: list[list[str]], jobs: int) -> tuple[ReturnCode, dict[str, str]]:
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        hashes_calculated = list(pool.map(hash_file, [f for _, f in hashes_to_verify]))
+    return check_binary_hashes(hashes_to_verify, hashes_calculated)
+
+
+def download_binaries(
+    url_prefix: str, hashes_to_verify: list[list[str]], cache: t.Optional[BinaryCache], jobs: int
+) -> tuple[ReturnCode, list[str]]:
+    """Download the binaries concurrently, or take them from the cache.
+
+    Returns the hashes of the files, computed while downloading.
+    """
+    def fetch(hash_expected: str, binary_filename: str) -> tuple[bool, str, str]:
+        if cache and cache.get(hash_expected, binary_filename):
+            log.info(f"using cached {binary_filename}")
+            return True, "", hash_expected
+        log.info(f"downloading {binary_filename} to {Path.cwd()}")
+        success, output, hash_calculated = download_file(url_prefix + binary_filename, binary_filename)
+        if cache and success and hash_calculated == hash_expected:
+            cache.put(hash_expected, binary_filename)
+        return success, output, hash_calculated
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        results = [f.result() for f in [pool.submit(fetch, *i) for i in hashes_to_verify]]
+
+    for (_, binary_filename), (success, output, _) in zip(hashes_to_verify, results):
+        if not success:
+            log.error(
+                f"failed to download {binary_filename}\n"
+                f"error:\n{indent(output)}")
+            return ReturnCode.BINARY_DOWNLOAD_FAILED, []
+    return ReturnCode.SUCCESS, [file_hash for _, _, file_hash in results]
+
+
 def verify_published_handler(args: argparse.Namespace) -> ReturnCode:
     WORKINGDIR = Path(tempfile.gettempdir()) / f"bitcoin_verify_binaries.{args.version}"
 
@@ -461,10 +562,14 @@ def verify_published_handler(args: argparse.Namespace) -> ReturnCode:
     os.makedirs(WORKINGDIR, exist_ok=True)
     os.chdir(WORKINGDIR)
 
-    hosts = [HOST1, HOST2]
+    hosts = args.hosts.split(',')
 
-    got_sig_status = get_files_from_hosts_and_compare(
-        hosts, remote_sigs_path, SIGNATUREFILENAME, args.require_all_hosts)
+    # Fetch the signature and sums files from all hosts at once
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        got_sig_future, got_sums_future = [
+            pool.submit(get_files_from_hosts_and_compare, hosts, remote_path, filename, args.require_all_hosts)
+            for remote_path, filename in [(remote_sigs_path, SIGNATUREFILENAME), (remote_sums_path, SUMS_FILENAME)]]
+    got_sig_status = got_sig_future.result()
     if got_sig_status != ReturnCode.SUCCESS:
         return got_sig_status
 
@@ -474,8 +579,7 @@ def verify_published_handler(args: argparse.Namespace) -> ReturnCode:
                   "version of this script from the repo.")
         return ReturnCode.BAD_VERSION
 
-    got_sums_status = get_files_from_hosts_and_compare(
-        hosts, remote_sums_path, SUMS_FILENAME, args.require_all_hosts)
+    got_sums_status = got_sums_future.result()
     if got_sums_status != ReturnCode.SUCCESS:
         return got_sums_status
 
@@ -495,6 +599,7 @@ def verify_published_handler(args: argparse.Namespace) -> ReturnCode:
         return ReturnCode.NO_BINARIES_MATCH
 
     # remove binaries that are known not to be hosted by bitcoincore.org
+    primary_host = hosts[0].rstrip('/')
     fragments_to_remove = ['-unsigned', '-debug', '-codesignatures']
     for fragment in fragments_to_remove:
         nobinaries = [i for i in hashes_to_verify if fragment in i[1]]
@@ -502,27 +607,20 @@ def verify_published_handler(args: argparse.Namespace) -> ReturnCode:
             remove_str = ', '.join(i[1] for i in nobinaries)
             log.info(
                 f"removing *{fragment} binaries ({remove_str}) from verification "
-                f"since {HOST1} does not host *{fragment} binaries")
+                f"since {primary_host} does not host *{fragment} binaries")
             hashes_to_verify = [i for i in hashes_to_verify if fragment not in i[1]]
 
-    # download binaries
-    for _, binary_filename in hashes_to_verify:
-        log.info(f"downloading {binary_filename} to {WORKINGDIR}")
-        success, output = download_with_wget(
-            HOST1 + remote_dir + binary_filename, binary_filename)
+    # download binaries and verify the hashes computed while downloading
+    cache = None if args.no_cache else BinaryCache(args.cache_dir)
+    download_status, hashes_calculated = download_binaries(
+        primary_host + remote_dir, hashes_to_verify, cache, args.jobs)
+    if download_status != ReturnCode.SUCCESS:
+        return download_status
 
-        if not success:
-            log.error(
-                f"failed to download {binary_filename}\n"
-                f"wget output:\n{indent(output)}")
-            return ReturnCode.BINARY_DOWNLOAD_FAILED
-
-    # verify hashes
-    hashes_status, files_to_hashes = verify_binary_hashes(hashes_to_verify)
+    hashes_status, files_to_hashes = check_binary_hashes(hashes_to_verify, hashes_calculated)
     if hashes_status != ReturnCode.SUCCESS:
         return hashes_status
 
-
     if args.cleanup:
         cleanup()
     else:
@@ -588,7 +686,7 @@ def verify_binaries_handler(args: argparse.Namespace) -> ReturnCode:
                 missing_files.append(file)
 
     # verify hashes
-    hashes_status, files_to_hashes = verify_binary_hashes(files_to_hash)
+    hashes_status, files_to_hashes = verify_binary_hashes(files_to_hash, args.jobs)
     if hashes_status != ReturnCode.SUCCESS:
         return hashes_status
 
@@ -647,6 +745,11 @@ def main():
         default=bool_from_env('BINVERIFY_JSON'),
         help='If set, output the result as JSON',
     )
+    parser.add_argument(
+        '--jobs', '-j', type=int,
+        default=int(os.environ.get('BINVERIFY_JOBS', 8)),
+        help='The number of files to download or hash concurrently.',
+    )
 
     subparsers = parser.add_subparsers(title="Commands", required=True, dest="command")
 
@@ -669,6 +772,24 @@ def main():
             f'If set, require all hosts ({HOST1}, {HOST2}) to provide signatures. '
             '(Sometimes bitcoin.org lags behind bitcoincore.org.)')
     )
+    pub_parser.add_argument(
+        '--hosts',
+        default=os.environ.get('BINVERIFY_HOSTS', f'{HOST1},{HOST2}'),
+        help=(
+            'The hosts to download the release from, separated by commas. The sums and '
+            'signature files are compared across hosts, the binaries are downloaded from '
+            'the first host. (default: %(default)s)')
+    )
+    pub_parser.add_argument(
+        '--cache-dir',
+        default=os.environ.get('BINVERIFY_CACHE_DIR', DEFAULT_CACHE_DIR),
+        help='The directory to keep verified binaries in, named by their hash. (default: %(default)s)'
+    )
+    pub_parser.add_argument(
+        '--no-cache', action='store_true',
+        default=bool_from_env('BINVERIFY_NO_CACHE'),
+        help='If set, always download the binaries and do not cache them'
+    )
 
     bin_parser = subparsers.add_parser("bin", help="Verify local binaries.")
     bin_parser.set_defaults(func=verify_binaries_handler)
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# Copyright (c) 2025-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""Test zmq_consumer.py against a local stand-in for the bitcoind publisher and RPC server."""
+
+import asyncio
+import hashlib
+import struct
+
+import zmq
+import zmq.asyncio
+
+from zmq_consumer import Gap, MempoolSnapshot, Notification, ZMQConsumer, block_header_hash
+
+
+def make_header(prev_hash: str, nonce: int) -> bytes:
+    return struct.pack("<i", 4) + bytes.fromhex(prev_hash)[::-1] + hashlib.sha256(b"%d" % nonce).digest() + struct.pack("<III", 0, 0x207fffff, nonce)
+
+
+class FakeNode:
+    """Publishes notifications like bitcoind, and answers the RPCs used to recover lost ones."""
+
+    def __init__(self, context: zmq.asyncio.Context):
+        self.socket = context.socket(zmq.XPUB)
+        self.socket.setsockopt(zmq.SNDHWM, 0)
+        port = self.socket.bind_to_random_port("tcp://127.0.0.1")
+        self.address = f"tcp://127.0.0.1:{port}"
+        self.sequence: dict[str, int] = {}
+        # Headers of all blocks by hash, and the hashes of the active chain
+        self.headers = {"00" * 32: None}
+        self.chain = ["00" * 32]
+        self.mempool: list[str] = []
+        self.mempool_sequence = 0
+        self.rpc_calls: list[str] = []
+
+    async def wait_for_subscribers(self, count: int) -> None:
+        for _ in range(count):
+            assert (await self.socket.recv())[0] == 1
+
+    async def publish(self, topic: str, body: bytes, drop: bool = False) -> None:
+        sequence = self.sequence.get(topic, 0)
+        self.sequence[topic] = (sequence + 1) % 2**32
+        if not drop:
+            await self.socket.send_multipart([topic.encode(), body, struct.pack("<I", sequence)])
+
+    def mine(self, parent: str) -> tuple[str, bytes]:
+        header = make_header(parent, len(self.headers))
+        block_hash = block_header_hash(header)
+        self.headers[block_hash] = header
+        while self.chain[-1] != parent:
+            self.chain.pop()
+        self.chain.append(block_hash)
+        return block_hash, header + b"\x00"
+
+    async def call(self, method: str, *params):
+        self.rpc_calls.append(method)
+        if method == "getbestblockhash":
+            return self.chain[-1]
+        if method == "getblockheader":
+            header = self.headers[params[0]]
+            height = 0
+            prev = params[0]
+            while self.headers[prev] is not None:
+                prev = self.headers[prev][4:36][::-1].hex()
+                height += 1
+            result = {"hash": params[0], "height": height}
+            if header is not None:
+                result["previousblockhash"] = header[4:36][::-1].hex()
+            return result
+        if method == "getblock":
+            assert params[1] == 0
+            return (self.headers[params[0]] + b"\x00").hex()
+        if method == "getrawmempool":
+            assert params == (False, True)
+            return {"txids": list(self.mempool), "mempool_sequence": self.mempool_sequence}
+        raise AssertionError(f"unexpected RPC {method}")
+
+
+async def receive(consumer: ZMQConsumer, count: int) -> list:
+    items = []
+    while len(items) < count:
+        items += await asyncio.wait_for(consumer.get_batch(count - len(items)), timeout=10)
+    return items
+
+
+def assert_empty(consumer: ZMQConsumer) -> None:
+    assert consumer.queue.empty(), consumer.queue.get_nowait()
+
+
+async def test_batching(context: zmq.asyncio.Context) -> None:
+    print("- testing batched, zero-copy receive")
+    node = FakeNode(context)
+    async with ZMQConsumer(node.address, ["hashtx"], rpc=node, context=context) as consumer:
+        await node.wait_for_subscribers(1)
+        txids = [hashlib.sha256(b"%d" % i).digest() for i in range(500)]
+        for txid in txids:
+            await node.publish("hashtx", txid)
+        items = await receive(consumer, len(txids))
+        assert [bytes(n.body) for n in items] == txids
+        assert [n.sequence for n in items] == list(range(len(txids)))
+        assert all(isinstance(n.body, memoryview) for n in items)
+        assert consumer.stats.messages == len(txids)
+        assert consumer.stats.batches < len(txids)
+        assert consumer.stats.largest_batch <= consumer.batch_size
+        assert consumer.stats.gaps == 0
+        assert not node.rpc_calls
+
+
+async def test_backpressure(context: zmq.asyncio.Context) -> None:
+    print("- testing bounded queue")
+    node = FakeNode(context)
+    async with ZMQConsumer(node.address, ["rawtx"], rpc=node, queue_size=10, context=context) as consumer:
+        await node.wait_for_subscribers(1)
+        for i in range(100):
+            await node.publish("rawtx", b"tx%d" % i)
+        await asyncio.sleep(0.5)
+        assert consumer.queue.qsize() == 10
+        assert consumer.stats.queue_full == 1
+        items = await receive(consumer, 100)
+        assert [bytes(n.body) for n in items] == [b"tx%d" % i for i in range(100)]
+        assert consumer.stats.max_queue_depth == 10
+        assert consumer.stats.queue_full > 1
+        assert consumer.stats.queue_full_seconds > 0
+
+
+async def test_block_gap(context: zmq.asyncio.Context) -> None:
+    print("- testing recovery of lost block notifications")
+    node = FakeNode(context)
+    async with ZMQConsumer(node.address, ["hashblock", "rawblock"], rpc=node, context=context) as consumer:
+        await node.wait_for_subscribers(2)
+        tip = node.chain[-1]
+        blocks = []
+        for i in range(5):
+            tip, block = node.mine(tip)
+            blocks.append((tip, block))
+            drop = i in (1, 2)
+            await node.publish("hashblock", bytes.fromhex(tip), drop=drop)
+            await node.publish("rawblock", block, drop=drop)
+        items = await receive(consumer, 2 * 5 + 2)
+        assert_empty(consumer)
+        notifications = [i for i in items if isinstance(i, Notification)]
+        hashblock = [n for n in notifications if n.topic == "hashblock"]
+        rawblock = [n for n in notifications if n.topic == "rawblock"]
+        assert [n.hash for n in hashblock] == [h for h, _ in blocks]
+        assert [n.hash for n in rawblock] == [h for h, _ in blocks]
+        assert [bytes(n.body) for n in rawblock] == [b for _, b in blocks]
+        assert [n.recovered for n in rawblock] == [False, True, True, False, False]
+        gaps = [i for i in items if isinstance(i, Gap)]
+        assert sorted((g.topic, g.missed) for g in gaps) == [("hashblock", 2), ("rawblock", 2)]
+        assert consumer.stats.recovered_blocks == 4
+        assert not any(isinstance(i, MempoolSnapshot) for i in items)
+
+        # A reorg notifies the new tip only, and is recovered without a gap
+        print("- testing recovery of blocks connected in a reorg")
+        fork, _ = node.mine(blocks[2][0])
+        tip, block = node.mine(fork)
+        await node.publish("rawblock", block)
+        items = await receive(consumer, 2)
+        assert [(n.hash, n.recovered) for n in items] == [(fork, True), (tip, False)]
+        assert consumer.stats.gaps == 2
+
+
+async def test_sequence_gap(context: zmq.asyncio.Context) -> None:
+    print("- testing recovery of lost sequence notifications")
+    node = FakeNode(context)
+    async with ZMQConsumer(node.address, ["sequence"], rpc=node, context=context) as consumer:
+        await node.wait_for_subscribers(1)
+
+        async def publish_tx(label: str, txid: bytes, drop: bool = False):
+            node.mempool_sequence += 1
+            if label == "A":
+                node.mempool.append(txid.hex())
+            else:
+                node.mempool.remove(txid.hex())
+            await node.publish("sequence", txid + label.encode() + struct.pack("<Q", node.mempool_sequence), drop=drop)
+
+        txids = [hashlib.sha256(b"%d" % i).digest() for i in range(4)]
+        old_tip, _ = node.mine(node.chain[-1])
+        await node.publish("sequence", bytes.fromhex(old_tip) + b"C")
+        await publish_tx("A", txids[0])
+        # Lose a reorg and mempool events
+        new_tip, _ = node.mine(node.chain[-2])
+        await node.publish("sequence", bytes.fromhex(old_tip) + b"D", drop=True)
+        await node.publish("sequence", bytes.fromhex(new_tip) + b"C", drop=True)
+        await publish_tx("A", txids[1], drop=True)
+        await publish_tx("R", txids[0], drop=True)
+        await publish_tx("A", txids[2])
+        newer_tip, _ = node.mine(new_tip)
+        await node.publish("sequence", bytes.fromhex(newer_tip) + b"C")
+        await publish_tx("A", txids[3])
+        items = await receive(consumer, 7)
+        assert_empty(consumer)
+
+        assert [(n.hash, n.label) for n in items[:2]] == [(old_tip, "C"), (txids[0].hex(), "A")]
+        assert items[2] == Gap("sequence", 2, 6)
+        # Everything was published by the time the gap was processed, the
+        # newer tip and the last transactions are recovered and their
+        # notifications dropped.
+        assert [(n.hash, n.label, n.recovered) for n in items[3:6]] == [(old_tip, "D", True), (new_tip, "C", True), (newer_tip, "C", True)]
+        snapshot = items[6]
+        assert isinstance(snapshot, MempoolSnapshot)
+        assert snapshot.txids == [t.hex() for t in txids[1:]]
+        assert snapshot.mempool_sequence == node.mempool_sequence
+
+        # Later notifications are queued again
+        await publish_tx("R", txids[3])
+        (item,) = await receive(consumer, 1)
+        assert isinstance(item, Notification) and item.label == "R" and item.mempool_sequence == node.mempool_sequence
+        assert consumer.stats.dropped == 3
+
+
+async def test_no_rpc(context: zmq.asyncio.Context) -> None:
+    print("- testing gap detection without RPC")
+    node = FakeNode(context)
+    async with ZMQConsumer(node.address, ["hashtx"], context=context) as consumer:
+        await node.wait_for_subscribers(1)
+        node.sequence["hashtx"] = SEQUENCE_MAX = 2**32 - 1
+        await node.publish("hashtx", b"\x01" * 32)
+        # The sequence number wraps around
+        await node.publish("hashtx", b"\x02" * 32)
+        await node.publish("hashtx", b"\x03" * 32, drop=True)
+        await node.publish("hashtx", b"\x04" * 32)
+        items = await receive(consumer, 4)
+        assert [getattr(i, "sequence", None) for i in items] == [SEQUENCE_MAX, 0, None, 2]
+        assert items[2] == Gap("hashtx", 1, 2)
+
+
+async def main():
+    context = zmq.asyncio.Context()
+    try:
+        for test in (test_batching, test_backpressure, test_block_gap, test_sequence_gap, test_no_rpc):
+            await test(context)
+    finally:
+        context.destroy(linger=0)
+    print("✓ all tests passed")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,409 @@
+# Copyright (c) 2025-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""
+Reusable asyncio consumer for the ZMQ notifications of bitcoind.
+
+Unlike zmq_sub.py, which prints every message, this module is meant to be
+imported by long running subscribers such as indexers:
+
+    async with ZMQConsumer("tcp://127.0.0.1:28332", rpc=RPCClient(...)) as consumer:
+        async for item in consumer:
+            ...
+
+The consumer receives messages in batches, queues them in a bounded queue and
+yields Notification, Gap and MempoolSnapshot items in the order they were
+received. The frames are received without copying: Notification.body is a
+memoryview of the ZMQ message.
+
+When the queue is full, the receiver stops reading from the socket until the
+application catches up, and bitcoind drops the messages which do not fit into
+the socket buffers (limited by -zmqpubhwm and the RCVHWM of the subscriber).
+Lost messages are detected from the ZMQ sequence numbers, which are counted
+per topic. For every gap a Gap item is queued and, if an RPC client is given,
+the lost state is recovered:
+
+- rawblock, hashblock: the blocks between the last notified block and the
+  current one are queued as notifications (fetched with getblock).
+- sequence: the blocks disconnected and connected since the last notified
+  block are queued as `D` and `C` notifications, followed by a MempoolSnapshot
+  (getrawmempool with mempool_sequence). Mempool events which are already part
+  of the snapshot are dropped.
+- rawtx, hashtx: a MempoolSnapshot is queued.
+
+Notifications recreated over RPC have no sequence number. Block recovery
+starts from the first block notification received on a topic, and is skipped
+if more than max_recovery_blocks blocks are missing.
+"""
+
+import asyncio
+import base64
+import collections
+import hashlib
+import json
+import logging
+import struct
+import time
+from dataclasses import dataclass
+from http.client import HTTPConnection, HTTPException
+from typing import Optional, Union
+
+import zmq
+import zmq.asyncio
+
+TOPICS = ("hashblock", "hashtx", "rawblock", "rawtx", "sequence")
+BLOCK_TOPICS = ("hashblock", "rawblock", "sequence")
+MEMPOOL_TOPICS = ("hashtx", "rawtx", "sequence")
+SEQUENCE_MODULUS = 1 << 32
+# Number of recovered blocks per topic remembered to drop their late
+# notifications
+RECOVERED_BLOCKS_KEPT = 1000
+
+logger = logging.getLogger("zmq_consumer")
+
+
+def block_header_hash(header) -> str:
+    return hashlib.sha256(hashlib.sha256(header[:80]).digest()).digest()[::-1].hex()
+
+
+@dataclass
+class Notification:
+    topic: str
+    # A view of the message body, valid as long as the notification is
+    # referenced. Use bytes(body) to keep a copy.
+    body: memoryview
+    # The ZMQ sequence number, or None if the notification was recreated over
+    # RPC after a gap.
+    sequence: Optional[int]
+
+    @property
+    def recovered(self) -> bool:
+        return self.sequence is None
+
+    @property
+    def hash(self) -> str:
+        """The block or transaction hash in RPC byte order."""
+        if self.topic == "rawblock":
+            return block_header_hash(self.body)
+        if self.topic == "rawtx":
+            raise ValueError("rawtx notifications do not include the txid, deserialize the transaction")
+        return self.body[:32].hex()
+
+    @property
+    def label(self) -> Optional[str]:
+        """The event type of a sequence notification: C, D, A or R."""
+        return chr(self.body[32]) if self.topic == "sequence" else None
+
+    @property
+    def mempool_sequence(self) -> Optional[int]:
+        if self.topic != "sequence" or len(self.body) != 32 + 1 + 8:
+            return None
+        return struct.unpack("<Q", self.body[33:])[0]
+
+
+@dataclass
+class Gap:
+    topic: str
+    expected: int
+    received: int
+
+    @property
+    def missed(self) -> int:
+        return (self.received - self.expected) % SEQUENCE_MODULUS
+
+
+@dataclass
+class MempoolSnapshot:
+    txids: list[str]
+    # Mempool events up to and including this sequence number are reflected in
+    # txids.
+    mempool_sequence: int
+
+
+Item = Union[Notification, Gap, MempoolSnapshot]
+
+
+@dataclass
+class ConsumerStats:
+    messages: int = 0
+    batches: int = 0
+    largest_batch: int = 0
+    gaps: int = 0
+    missed: int = 0
+    recovered_blocks: int = 0
+    mempool_snapshots: int = 0
+    recovery_failures: int = 0
+    # Notifications dropped because they were already covered by a recovery
+    dropped: int = 0
+    # Backpressure: number of times the queue was full, time the receiver
+    # waited for the application, and the largest queue depth seen
+    queue_full: int = 0
+    queue_full_seconds: float = 0.0
+    max_queue_depth: int = 0
+
+
+class RPCError(Exception):
+    pass
+
+
+class RPCClient:
+    """Minimal JSON-RPC client, calls are run in a thread one at a time."""
+
+    def __init__(self, host: str, port: int, username: str, password: str, timeout: float = 30):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.authhdr = b"Basic " + base64.b64encode(f"{username}:{password}".encode())
+        self.conn: Optional[HTTPConnection] = None
+        self.lock = asyncio.Lock()
+        self.next_id = 0
+
+    @classmethod
+    def from_cookie_file(cls, host: str, port: int, cookie_file: str, **kwargs) -> "RPCClient":
+        with open(cookie_file, encoding="utf8") as f:
+            username, password = f.readline().strip().split(":", 1)
+        return cls(host, port, username, password, **kwargs)
+
+    def _call(self, method: str, params: list):
+        self.next_id += 1
+        request = json.dumps({"jsonrpc": "2.0", "id": self.next_id, "method": method, "params": params})
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request("POST", "/", request, {"Authorization": self.authhdr, "Content-type": "application/json"})
+                http_response = self.conn.getresponse()
+                body = http_response.read()
+                break
+            except (OSError, HTTPException) as e:
+                # Reconnect once, the server may have closed the connection
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise OSError(f"{method}: no response from {self.host}:{self.port}") from e
+        if http_response.status == 401:
+            raise RPCError(f"{method}: authorization failed")
+        try:
+            response = json.loads(body)
+        except ValueError:
+            raise RPCError(f"{method}: invalid response (HTTP status {http_response.status})")
+        if response.get("error") is not None:
+            raise RPCError(f"{method}: {response['error']}")
+        return response["result"]
+
+    async def call(self, method: str, *params):
+        async with self.lock:
+            return await asyncio.to_thread(self._call, method, list(params))
+
+
+class ZMQConsumer:
+    def __init__(self, address: str, topics=TOPICS, *, rpc=None, queue_size: int = 10000,
+                 batch_size: int = 100, rcvhwm: int = 10000, max_recovery_blocks: int = 100,
+                 context: Optional[zmq.asyncio.Context] = None):
+        """Subscribe to the given topics of the publisher at address.
+
+        rpc is an RPCClient, or any object with an async call(method, *params)
+        method. queue_size bounds the number of items waiting for the
+        application, and batch_size the number of messages read from the
+        socket at once.
+        """
+        self.address = address
+        self.topics = tuple(topics)
+        self.rpc = rpc
+        self.batch_size = batch_size
+        self.max_recovery_blocks = max_recovery_blocks
+        self.queue: asyncio.Queue[Item] = asyncio.Queue(maxsize=queue_size)
+        self.stats = ConsumerStats()
+        self.context = context or zmq.asyncio.Context.instance()
+        self.socket = self.context.socket(zmq.SUB)
+        self.socket.setsockopt(zmq.RCVHWM, rcvhwm)
+        for topic in self.topics:
+            self.socket.setsockopt_string(zmq.SUBSCRIBE, topic)
+        self.task: Optional[asyncio.Task] = None
+        # Next expected sequence number per topic
+        self.next_sequence: dict[str, int] = {}
+        # Last block notified per topic, with the label (C or D) of the event
+        self.tips: dict[str, tuple[str, str]] = {}
+        # Block events already queued by a recovery, per topic
+        self.recovered: dict[str, collections.OrderedDict] = collections.defaultdict(collections.OrderedDict)
+        # Mempool events up to this sequence number are part of the last snapshot
+        self.mempool_sequence = -1
+
+    async def start(self) -> None:
+        self.socket.connect(self.address)
+        self.task = asyncio.create_task(self._receive())
+
+    async def close(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.socket.close(linger=0)
+
+    async def __aenter__(self) -> "ZMQConsumer":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Item:
+        return await self.get()
+
+    async def get(self) -> Item:
+        """Return the next item, or raise the error which stopped the receiver."""
+        if not self.queue.empty():
+            return self.queue.get_nowait()
+        assert self.task is not None, "consumer not started"
+        getter = asyncio.ensure_future(self.queue.get())
+        await asyncio.wait({getter, self.task}, return_when=asyncio.FIRST_COMPLETED)
+        if getter.done():
+            return getter.result()
+        getter.cancel()
+        self.task.result()
+        raise ConnectionError("ZMQ receiver stopped")
+
+    async def get_batch(self, max_items: int) -> list[Item]:
+        """Wait for at least one item and return up to max_items."""
+        items = [await self.get()]
+        while len(items) < max_items and not self.queue.empty():
+            items.append(self.queue.get_nowait())
+        return items
+
+    async def _receive(self) -> None:
+        while True:
+            batch = [await self.socket.recv_multipart(copy=False)]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(await self.socket.recv_multipart(zmq.NOBLOCK, copy=False))
+                except zmq.Again:
+                    break
+            self.stats.batches += 1
+            self.stats.messages += len(batch)
+            self.stats.largest_batch = max(self.stats.largest_batch, len(batch))
+            for frames in batch:
+                await self._process(frames)
+
+    async def _put(self, item: Item) -> None:
+        if self.queue.full():
+            self.stats.queue_full += 1
+            start = time.monotonic()
+            await self.queue.put(item)
+            self.stats.queue_full_seconds += time.monotonic() - start
+        else:
+            self.queue.put_nowait(item)
+        self.stats.max_queue_depth = max(self.stats.max_queue_depth, self.queue.qsize())
+
+    async def _process(self, frames: list[zmq.Frame]) -> None:
+        topic = bytes(frames[0].buffer).decode()
+        sequence = None
+        if len(frames) > 2 and len(frames[2]) == 4:
+            sequence = struct.unpack("<I", frames[2].buffer)[0]
+        notification = Notification(topic, frames[1].buffer, sequence)
+
+        needs_recovery = False
+        if sequence is not None:
+            expected = self.next_sequence.get(topic)
+            self.next_sequence[topic] = (sequence + 1) % SEQUENCE_MODULUS
+            if expected is not None and sequence != expected:
+                gap = Gap(topic, expected, sequence)
+                self.stats.gaps += 1
+                self.stats.missed += gap.missed
+                await self._put(gap)
+                needs_recovery = True
+        if topic == "rawblock" and self._is_disconnected_from_tip(notification):
+            # After a reorg, or when several blocks were connected at once,
+            # only the new tip is notified. No message was lost, but blocks
+            # are missing.
+            needs_recovery = True
+        if needs_recovery and self.rpc is not None:
+            await self._recover(notification)
+
+        if topic in BLOCK_TOPICS and notification.label in (None, "C", "D"):
+            event = (notification.label or "C", notification.hash)
+            if self.recovered[topic].pop(event, False):
+                self.stats.dropped += 1
+                return
+            self.tips[topic] = event
+        elif notification.mempool_sequence is not None and notification.mempool_sequence <= self.mempool_sequence:
+            self.stats.dropped += 1
+            return
+        await self._put(notification)
+
+    def _is_disconnected_from_tip(self, notification: Notification) -> bool:
+        tip = self.tips.get(notification.topic)
+        if tip is None:
+            return False
+        parent = bytes(notification.body[4:36])[::-1].hex()
+        return parent != tip[1] and ("C", notification.hash) not in self.recovered["rawblock"]
+
+    async def _recover(self, notification: Notification) -> None:
+        topic = notification.topic
+        try:
+            if topic in BLOCK_TOPICS and topic in self.tips:
+                if topic == "sequence":
+                    new_tip = await self.rpc.call("getbestblockhash")
+                else:
+                    new_tip = notification.hash
+                await self._recover_blocks(topic, new_tip, include_new_tip=topic == "sequence")
+            if topic in MEMPOOL_TOPICS:
+                result = await self.rpc.call("getrawmempool", False, True)
+                snapshot = MempoolSnapshot(result["txids"], result["mempool_sequence"])
+                self.mempool_sequence = snapshot.mempool_sequence
+                self.stats.mempool_snapshots += 1
+                await self._put(snapshot)
+        except (RPCError, OSError) as e:
+            self.stats.recovery_failures += 1
+            logger.warning("Could not recover the lost %s notifications: %s", topic, e)
+
+    async def _recover_blocks(self, topic: str, new_tip: str, include_new_tip: bool) -> None:
+        label, old_tip = self.tips[topic]
+        old = await self.rpc.call("getblockheader", old_tip)
+        if label == "D":
+            old = await self.rpc.call("getblockheader", old["previousblockhash"])
+        new = await self.rpc.call("getblockheader", new_tip)
+        if new["height"] - old["height"] > self.max_recovery_blocks:
+            logger.warning("Not recovering %d missing blocks of %s", new["height"] - old["height"], topic)
+            self.stats.recovery_failures += 1
+            return
+
+        disconnected, connected = [], []
+        while new["height"] > old["height"]:
+            connected.append(new["hash"])
+            new = await self.rpc.call("getblockheader", new["previousblockhash"])
+        while old["height"] > new["height"]:
+            disconnected.append(old["hash"])
+            old = await self.rpc.call("getblockheader", old["previousblockhash"])
+        while old["hash"] != new["hash"]:
+            disconnected.append(old["hash"])
+            connected.append(new["hash"])
+            old = await self.rpc.call("getblockheader", old["previousblockhash"])
+            new = await self.rpc.call("getblockheader", new["previousblockhash"])
+        connected.reverse()
+        if not include_new_tip and connected and connected[-1] == new_tip:
+            connected.pop()
+
+        # The hashblock and rawblock topics only announce new tips, disconnected
+        # blocks are implied.
+        events = [("C", h) for h in connected]
+        if topic == "sequence":
+            events = [("D", h) for h in disconnected] + events
+        for label, block_hash in events:
+            if topic == "rawblock":
+                body = bytes.fromhex(await self.rpc.call("getblock", block_hash, 0))
+            elif topic == "hashblock":
+                body = bytes.fromhex(block_hash)
+            else:
+                body = bytes.fromhex(block_hash) + label.encode()
+            await self._put(Notification(topic, memoryview(body), None))
+            self.tips[topic] = (label, block_hash)
+            self.recovered[topic][(label, block_hash)] = True
+            self.stats.recovered_blocks += 1
+        while len(self.recovered[topic]) > RECOVERED_BLOCKS_KEPT:
+            self.recovered[topic].popitem(last=False)
@@ -4,12 +4,15 @@
 # Distributed under the MIT software license, see the accompanying
 # file COPYING or https://opensource.org/license/mit/.
 
+import hashlib
 import sys
 import time
 import urllib.request
 
 
-def download_from_url(url, archive):
+def download_from_url(url, archive, progress=True):
+    """Download url to the file archive and return the SHA256 hex digest of
+    its contents, computed while downloading."""
     print(f"Fetching: {url}")
     last_print_time = time.time()
 
@@ -33,6 +36,7 @@ def download_from_url(url, archive):
 
         total_size = int(response.getheader("Content-Length"))
         progress_bytes = 0
+        hasher = hashlib.sha256()
 
         with open(archive, 'wb') as file:
             while True:
@@ -40,13 +44,17 @@ def download_from_url(url, archive):
                 if not chunk:
                     break
                 file.write(chunk)
+                hasher.update(chunk)
                 progress_bytes += len(chunk)
-                progress_hook(progress_bytes, total_size)
+                if progress:
+                    progress_hook(progress_bytes, total_size)
 
         if progress_bytes < total_size:
             raise RuntimeError(f"Download incomplete: expected {total_size} bytes, got {progress_bytes} bytes")
 
-    print('\n', flush=True, end="") # Flush to avoid error output on the same line.
+    if progress:
+        print('\n', flush=True, end="") # Flush to avoid error output on the same line.
+    return hasher.hexdigest()
 
 
 def download_script_assets(script_assets_dir):
@@ -17,19 +17,24 @@ from test_framework.test_framework import TEST_EXIT_PASSED, TEST_EXIT_FAILED
 TEST_FRAMEWORK_MODULES = [
     "address",
     "crypto.bip324_cipher",
+    "blockfilter",
     "blocktools",
     "compressor",
     "crypto.chacha20",
     "crypto.ellswift",
     "key",
+    "message_capture",
     "messages",
     "crypto.muhash",
+    "p2p",
     "crypto.poly1305",
     "crypto.ripemd160",
     "crypto.secp256k1",
+    "crypto.siphash",
     "script",
     "script_util",
     "segwit_addr",
+    "util",
     "wallet_util",
 ]
 
@@ -8,6 +8,12 @@ Tests that a node configured with -blockfilterindex and -peerblockfilters signal
 NODE_COMPACT_FILTERS and can serve cfilters, cfheaders and cfcheckpts.
 """
 
+from test_framework.blockfilter import (
+    FilterHeaderChain,
+    GCSFilter,
+    bip158_relevant_scriptpubkeys,
+    compute_filter_header,
+)
 from test_framework.messages import (
     FILTER_TYPE_BASIC,
     NODE_COMPACT_FILTERS,
@@ -158,6 +164,13 @@ class CompactFiltersTest(BitcoinTestFramework):
             int(stale_cfcheckpt, 16),
         )
 
+        self.log.info("Check that the filter headers match the ones computed from the filters.")
+        header_chain = FilterHeaderChain(self.nodes[0])
+        assert_equal(header_chain.header_hex(main_block_hash), main_cfcheckpt)
+        # Only the filter of the stale block is fetched, the headers of its ancestors are cached
+        assert_equal(header_chain.header_hex(stale_block_hash), stale_cfcheckpt)
+        assert_equal(len(header_chain.filters), 1002)
+
         self.log.info("Check that peers can fetch cfilters.")
         stop_hash = self.nodes[0].getblockhash(10)
         request = msg_getcfilters(
@@ -176,6 +189,8 @@ class CompactFiltersTest(BitcoinTestFramework):
             assert_equal(cfilter.block_hash, int(block_hash, 16))
             computed_cfhash = uint256_from_str(hash256(cfilter.filter_data))
             assert_equal(computed_cfhash, cfhash)
+            expected_filter = GCSFilter.build(block_hash, bip158_relevant_scriptpubkeys(self.nodes[0], block_hash))
+            assert_equal(cfilter.filter_data, expected_filter.encoded)
 
         self.log.info("Check that peers can fetch cfilters for stale blocks.")
         request = msg_getcfilters(
@@ -278,7 +293,7 @@ def compute_last_header(prev_header, hashes):
     """Compute the last filter header from a starting header and a sequence of filter hashes."""
     header = ser_uint256(prev_header)
     for filter_hash in hashes:
-        header = hash256(ser_uint256(filter_hash) + header)
+        header = compute_filter_header(ser_uint256(filter_hash), header)
     return uint256_from_str(header)
 
 
@@ -11,6 +11,7 @@ import glob
 from io import BytesIO
 import os
 
+from test_framework.message_capture import CaptureReplayer, read_capture_file
 from test_framework.p2p import P2PDataStore, MESSAGEMAP
 from test_framework.test_framework import BitcoinTestFramework
 from test_framework.util import assert_equal
@@ -67,6 +68,12 @@ class MessageCaptureTest(BitcoinTestFramework):
         sent_file = glob.glob(os.path.join(capturedir, "*/msgs_sent.dat"))[0]
         mini_parser(sent_file)
 
+        self.log.info("Replay the received messages to the node")
+        peer = self.nodes[0].add_p2p_connection(P2PDataStore())
+        stats = CaptureReplayer(read_capture_file(recv_file), speed=None).replay(peer)
+        assert stats.messages > 0
+        assert peer.is_connected
+
 
 if __name__ == '__main__':
     MessageCaptureTest(__file__).main()
@@ -4,6 +4,11 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 """Test the getblockfilter RPC."""
 
+from test_framework.blockfilter import (
+    FilterHeaderChain,
+    GCSFilter,
+    bip158_relevant_scriptpubkeys,
+)
 from test_framework.test_framework import BitcoinTestFramework
 from test_framework.util import (
     assert_equal, assert_is_hex_string, assert_raises_rpc_error,
@@ -46,6 +51,16 @@ class GetBlockFilterTest(BitcoinTestFramework):
                 result = self.nodes[0].getblockfilter(block_hash, filter_type)
                 assert_is_hex_string(result['filter'])
 
+        # Test the basic filters and filter headers of both chains match the ones computed locally
+        header_chain = FilterHeaderChain(self.nodes[0])
+        for block_hash in chain0_hashes + chain1_hashes:
+            result = self.nodes[0].getblockfilter(block_hash, 'basic')
+            expected_filter = GCSFilter.build(block_hash, bip158_relevant_scriptpubkeys(self.nodes[0], block_hash))
+            assert_equal(result['filter'], expected_filter.encoded.hex())
+            assert_equal(result['header'], header_chain.header_hex(block_hash))
+            coinbase_spk = bytes.fromhex(self.nodes[0].getblock(block_hash, 2)['tx'][0]['vout'][0]['scriptPubKey']['hex'])
+            assert header_chain.filter(block_hash).match(coinbase_spk)
+
         # Test getblockfilter with unknown block
         bad_block_hash = "0123456789abcdef" * 4
         assert_raises_rpc_error(-5, "Block not found", self.nodes[0].getblockfilter, bad_block_hash, "basic")
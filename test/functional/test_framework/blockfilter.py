@@ -3,8 +3,38 @@
 # Distributed under the MIT software license, see the accompanying
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 """Helper routines relevant for compact block filters (BIP158).
+
+GCSFilter builds, encodes, decodes and queries Golomb-coded sets, and
+FilterHeaderChain computes and caches the filter headers of a node's blocks.
 """
-from .crypto.siphash import siphash
+from io import BytesIO
+import unittest
+
+from .crypto.siphash import siphash_batch
+from .messages import (
+    CBlock,
+    deser_compact_size,
+    from_hex,
+    hash256,
+    ser_compact_size,
+)
+from .script import OP_RETURN
+
+# Parameters of the basic filter type
+BASIC_FILTER_P = 19
+BASIC_FILTER_M = 784931
+
+
+def bip158_siphash_key(block_hash):
+    """Returns the SipHash key (k0, k1) of the filter of the block with the given hash.
+
+    'The parameter k MUST be set to the first 16 bytes of the hash (in standard
+    little-endian representation) of the block for which the filter is constructed.'
+    """
+    block_hash_bytes = bytes.fromhex(block_hash)[::-1]
+    k0 = int.from_bytes(block_hash_bytes[0:8], 'little')
+    k1 = int.from_bytes(block_hash_bytes[8:16], 'little')
+    return k0, k1
 
 
 def bip158_basic_element_hash(script_pub_key, N, block_hash):
@@ -21,11 +51,28 @@ def bip158_basic_element_hash(script_pub_key, N, block_hash):
     little-endian representation) of the block for which the filter is constructed. This
     ensures the key is deterministic while still varying from block to block.'
     """
-    M = 784931
-    block_hash_bytes = bytes.fromhex(block_hash)[::-1]
-    k0 = int.from_bytes(block_hash_bytes[0:8], 'little')
-    k1 = int.from_bytes(block_hash_bytes[8:16], 'little')
-    return (siphash(k0, k1, script_pub_key) * (N * M)) >> 64
+    return bip158_basic_element_hashes([script_pub_key], N, block_hash)[0]
+
+
+def bip158_basic_element_hashes(script_pub_keys, N, block_hash, M=BASIC_FILTER_M):
+    """Calculates the ranged hashes of several filter elements, see bip158_basic_element_hash.
+
+    The key and the range are only derived once for all elements."""
+    k0, k1 = bip158_siphash_key(block_hash)
+    F = N * M
+    return [(h * F) >> 64 for h in siphash_batch(k0, k1, [bytes(spk) for spk in script_pub_keys])]
+
+
+def bip158_basic_elements(block, prev_scripts):
+    """Returns the set of elements of the basic filter of a block (a CBlock), given the
+    scripts of the outputs spent by it. Like Bitcoin Core, empty scripts are not included."""
+    elements = {bytes(script) for script in prev_scripts if len(script) > 0}
+    for tx in block.vtx:
+        for txout in tx.vout:
+            script = bytes(txout.scriptPubKey)
+            if len(script) > 0 and script[0] != OP_RETURN:
+                elements.add(script)
+    return elements
 
 
 def bip158_relevant_scriptpubkeys(node, block_hash):
@@ -42,8 +89,227 @@ def bip158_relevant_scriptpubkeys(node, block_hash):
         for i in tx['vin']:
             if 'prevout' in i:
                 spks.add(bytes.fromhex(i['prevout']['scriptPubKey']['hex']))
-        # gather output scripts
+        # gather output scripts, excluding all OP_RETURN scripts, as Bitcoin Core does
         for o in tx['vout']:
-            if o['scriptPubKey']['type'] != 'nulldata':
-                spks.add(bytes.fromhex(o['scriptPubKey']['hex']))
+            spk = bytes.fromhex(o['scriptPubKey']['hex'])
+            if spk[:1] != bytes([OP_RETURN]):
+                spks.add(spk)
+    # like Bitcoin Core, empty scripts are not included
+    spks.discard(b'')
     return spks
+
+
+def golomb_rice_encode(values, P):
+    """Golomb-Rice encode the differences between the given sorted values, most
+    significant bit first. The last byte is padded with zero bits."""
+    out = bytearray()
+    acc = 0
+    acc_bits = 0
+    last = 0
+    remainder_mask = (1 << P) - 1
+    for value in values:
+        delta = value - last
+        last = value
+        q = delta >> P
+        # q one bits and a zero bit, followed by the P low bits of the delta
+        acc = (acc << (q + 1 + P)) | (((1 << q) - 1) << (1 + P)) | (delta & remainder_mask)
+        acc_bits += q + 1 + P
+        while acc_bits >= 8:
+            acc_bits -= 8
+            out.append((acc >> acc_bits) & 0xff)
+        acc &= (1 << acc_bits) - 1
+    if acc_bits:
+        out.append((acc << (8 - acc_bits)) & 0xff)
+    return bytes(out)
+
+
+def golomb_rice_decode(data, N, P):
+    """Decode N values encoded with golomb_rice_encode, returning them sorted."""
+    # Operating on a string of the bits allows to find the end of the unary
+    # encoded quotients with str.find, without a Python loop per bit.
+    bits = format(int.from_bytes(data, 'big'), f'0{len(data) * 8}b') if data else ''
+    values = []
+    pos = 0
+    last = 0
+    for _ in range(N):
+        end = bits.find('0', pos)
+        if end < 0 or end + 1 + P > len(bits):
+            raise ValueError("truncated filter")
+        q = end - pos
+        pos = end + 1 + P
+        last += (q << P) | (int(bits[end + 1:pos], 2) if P else 0)
+        values.append(last)
+    return values
+
+
+class GCSFilter:
+    """A Golomb-coded set, as used by compact block filters (BIP158).
+
+    Filters are either built from their elements, or decoded from their
+    serialization (the filter data of getblockfilter or cfilter messages). The
+    sorted hashed values are only decoded on the first query."""
+
+    def __init__(self, block_hash, encoded, P=BASIC_FILTER_P, M=BASIC_FILTER_M):
+        self.block_hash = block_hash
+        self.encoded = bytes(encoded)
+        self.P = P
+        self.M = M
+        f = BytesIO(self.encoded)
+        self.N = deser_compact_size(f)
+        self._data_offset = f.tell()
+        self._values = None
+
+    @classmethod
+    def build(cls, block_hash, elements, P=BASIC_FILTER_P, M=BASIC_FILTER_M):
+        """Build the filter of the block with the given hash from a collection of elements."""
+        elements = set(bytes(e) for e in elements)
+        values = sorted(bip158_basic_element_hashes(elements, len(elements), block_hash, M))
+        gcs_filter = cls(block_hash, ser_compact_size(len(values)) + golomb_rice_encode(values, P), P, M)
+        gcs_filter._values = values
+        return gcs_filter
+
+    @classmethod
+    def from_block(cls, block, prev_scripts):
+        """Build the basic filter of a block (a CBlock), given the scripts of the outputs spent by it."""
+        return cls.build(block.hash_hex, bip158_basic_elements(block, prev_scripts))
+
+    @classmethod
+    def from_rpc(cls, node, block_hash):
+        """Decode the basic filter of a block returned by the getblockfilter RPC."""
+        return cls(block_hash, bytes.fromhex(node.getblockfilter(block_hash, 'basic')['filter']))
+
+    @property
+    def values(self):
+        """The sorted hashed values of the elements of the filter."""
+        if self._values is None:
+            self._values = golomb_rice_decode(self.encoded[self._data_offset:], self.N, self.P)
+        return self._values
+
+    def hash_elements(self, elements):
+        """Returns the sorted hashed values of a query set of elements."""
+        return sorted(set(bip158_basic_element_hashes(elements, self.N, self.block_hash, self.M)))
+
+    def match(self, element):
+        """Whether the element is (probably) in the filter."""
+        return self.match_any([element])
+
+    def match_any(self, elements):
+        """Whether any of the elements is (probably) in the filter.
+
+        Walks the sorted hashed values of the filter and of the query set in
+        parallel, as described in BIP158."""
+        if self.N == 0:
+            return False
+        values = self.values
+        queries = self.hash_elements(elements)
+        i = j = 0
+        while i < len(values) and j < len(queries):
+            if values[i] == queries[j]:
+                return True
+            if values[i] < queries[j]:
+                i += 1
+            else:
+                j += 1
+        return False
+
+    def filter_hash(self):
+        """The double-SHA256 hash of the serialized filter."""
+        return hash256(self.encoded)
+
+    def header(self, prev_header):
+        """The filter header, committing to this filter and the previous filter header (both in
+        internal byte order)."""
+        return compute_filter_header(self.filter_hash(), prev_header)
+
+
+def compute_filter_header(filter_hash, prev_header):
+    """Compute a filter header from the hash of a filter and the previous filter header."""
+    return hash256(filter_hash + prev_header)
+
+
+class FilterHeaderChain:
+    """Computes the basic filter headers of the blocks of a node from the filters it serves,
+    independently of the headers it serves.
+
+    Headers are cached by block hash, so that after the first query only the
+    filters of new blocks are requested from the node. Headers are returned in
+    internal byte order, like the hashes of the cfheaders message."""
+
+    def __init__(self, node):
+        self.node = node
+        self.filters = {}
+        self.headers = {}
+
+    def filter(self, block_hash):
+        """The basic filter of the block with the given hash, as served by the node."""
+        if block_hash not in self.filters:
+            self.filters[block_hash] = GCSFilter.from_rpc(self.node, block_hash)
+        return self.filters[block_hash]
+
+    def header(self, block_hash):
+        """The filter header of the block with the given hash."""
+        # Walk back to the genesis block or the last block with a known header
+        missing = []
+        prev_hash = block_hash
+        while prev_hash is not None and prev_hash not in self.headers:
+            missing.append(prev_hash)
+            prev_hash = self.node.getblockheader(prev_hash).get('previousblockhash')
+        prev_header = bytes(32) if prev_hash is None else self.headers[prev_hash]
+        for missing_hash in reversed(missing):
+            prev_header = self.filter(missing_hash).header(prev_header)
+            self.headers[missing_hash] = prev_header
+        return self.headers[block_hash]
+
+    def header_hex(self, block_hash):
+        """The filter header of the block with the given hash, as returned by getblockfilter."""
+        return self.header(block_hash)[::-1].hex()
+
+
+class TestFrameworkBlockFilter(unittest.TestCase):
+    # Test vectors from src/test/data/blockfilters.json:
+    # [height, block hash, block, previous output scripts, previous filter header, filter, filter header]
+    VECTORS = [
+        [0, "000000000933ea01ad0ee984209779baaec3ced90fa3f408719526f8d77f4943", "0100000000000000000000000000000000000000000000000000000000000000000000003ba3edfd7a7b12b27ac72c3e67768f617fc81bc3888a51323a9fb8aa4b1e5e4adae5494dffff001d1aa4ae180101000000010000000000000000000000000000000000000000000000000000000000000000ffffffff4d04ffff001d0104455468652054696d65732030332f4a616e2f32303039204368616e63656c6c6f72206f6e206272696e6b206f66207365636f6e64206261696c6f757420666f722062616e6b73ffffffff0100f2052a01000000434104678afdb0fe5548271967f1a67130b7105cd6a828e03909a67962e0ea1f61deb649f6bc3f4cef38c4f35504e51ec112de5c384df7ba0b8d578a4c702b6bf11d5fac00000000", [], "0000000000000000000000000000000000000000000000000000000000000000", "019dfca8", "21584579b7eb08997773e5aeff3a7f932700042d0ed2a6129012b7d7ae81b750"],
+        [15007, "0000000038c44c703bae0f98cdd6bf30922326340a5996cc692aaae8bacf47ad", "0100000002394092aa378fe35d7e9ac79c869b975c4de4374cd75eb5484b0e1e00000000eb9b8670abd44ad6c55cee18e3020fb0c6519e7004b01a16e9164867531b67afc33bc94fffff001d123f10050101000000010000000000000000000000000000000000000000000000000000000000000000ffffffff0e04c33bc94f0115062f503253482fffffffff0100f2052a01000000232103f268e9ae07e0f8cb2f6e901d87c510d650b97230c0365b021df8f467363cafb1ac00000000", [], "18b5c2b0146d2d09d24fb00ff5b52bd0742f36c9e65527abdb9de30c027a4748", "013c3710", "07384b01311867949e0c046607c66b7a766d338474bb67f66c8ae9dbd454b20e"],
+        [1263442, "000000006f27ddfe1dd680044a34548f41bed47eba9e6f0b310da21423bc5f33", "000000201c8d1a529c39a396db2db234d5ec152fa651a2872966daccbde028b400000000083f14492679151dbfaa1a825ef4c18518e780c1f91044180280a7d33f4a98ff5f45765aaddc001d38333b9a02010000000001010000000000000000000000000000000000000000000000000000000000000000ffffffff230352471300fe5f45765afe94690a000963676d696e6572343208000000000000000000ffffffff024423a804000000001976a914f2c25ac3d59f3d674b1d1d0a25c27339aaac0ba688ac0000000000000000266a24aa21a9edcb26cb3052426b9ebb4d19c819ef87c19677bbf3a7c46ef0855bd1b2abe83491012000000000000000000000000000000000000000000000000000000000000000000000000002000000000101d20978463906ba4ff5e7192494b88dd5eb0de85d900ab253af909106faa22cc5010000000004000000014777ff000000000016001446c29eabe8208a33aa1023c741fa79aa92e881ff0347304402207d7ca96134f2bcfdd6b536536fdd39ad17793632016936f777ebb32c22943fda02206014d2fb8a6aa58279797f861042ba604ebd2f8f61e5bddbd9d3be5a245047b201004b632103eeaeba7ce5dc2470221e9517fb498e8d6bd4e73b85b8be655196972eb9ccd5566754b2752103a40b74d43df244799d041f32ce1ad515a6cd99501701540e38750d883ae21d3a68ac00000000", ["002027a5000c7917f785d8fc6e5a55adfca8717ecb973ebb7743849ff956d896a7ed"], "31d66d516a9eda7de865df29f6ef6cb8e4bf9309e5dac899968a9a62a5df61e3", "0385acb4f0fe889ef0", "4e6d564c2a2452065c205dd7eb2791124e0c4e0dbb064c410c24968572589dec"],
+        [1414221, "0000000000000027b2b3b3381f114f674f481544ff2be37ae3788d7e078383b1", "000000204ea88307a7959d8207968f152bedca5a93aefab253f1fb2cfb032a400000000070cebb14ec6dbc27a9dfd066d9849a4d3bac5f674665f73a5fe1de01a022a0c851fda85bf05f4c19a779d1450102000000010000000000000000000000000000000000000000000000000000000000000000ffffffff18034d94154d696e6572476174653030310d000000f238f401ffffffff01c817a804000000000000000000", [], "5e5e12d90693c8e936f01847859404c67482439681928353ca1296982042864e", "00", "021e8882ef5a0ed932edeebbecfeda1d7ce528ec7b3daa27641acf1189d7b5dc"],
+    ]
+
+    def test_vectors(self):
+        for height, block_hash, block_hex, prev_scripts, prev_header, filter_hex, header in self.VECTORS:
+            with self.subTest(height=height):
+                block = from_hex(CBlock(), block_hex)
+                self.assertEqual(block.hash_hex, block_hash)
+                prev_scripts = [bytes.fromhex(s) for s in prev_scripts]
+                built = GCSFilter.from_block(block, prev_scripts)
+                self.assertEqual(built.encoded.hex(), filter_hex)
+                self.assertEqual(built.header(bytes.fromhex(prev_header)[::-1])[::-1].hex(), header)
+
+                decoded = GCSFilter(block_hash, bytes.fromhex(filter_hex))
+                self.assertEqual(decoded.values, built.values)
+                elements = bip158_basic_elements(block, prev_scripts)
+                self.assertEqual(decoded.N, len(elements))
+                for element in elements:
+                    self.assertTrue(decoded.match(element))
+                self.assertEqual(decoded.match_any(elements), len(elements) > 0)
+
+    def test_match_any(self):
+        block_hash = "00" * 32
+        elements = [i.to_bytes(4, 'little') for i in range(1000)]
+        gcs_filter = GCSFilter.build(block_hash, elements)
+        self.assertEqual(GCSFilter(block_hash, gcs_filter.encoded).values, gcs_filter.values)
+        queries = [i.to_bytes(4, 'little') for i in range(1000, 1100)]
+        # The expected false positive rate is 1/M per element
+        self.assertFalse(gcs_filter.match_any(queries))
+        self.assertTrue(gcs_filter.match_any(queries + [elements[500]]))
+        self.assertFalse(gcs_filter.match_any([]))
+        self.assertFalse(GCSFilter.build(block_hash, []).match_any(elements))
+
+    def test_golomb_rice(self):
+        for P in (0, 1, 19):
+            values = sorted([0, 0, 1, 5, 1 << P, (5 << P) + 3, (100 << P) + 7])
+            encoded = golomb_rice_encode(values, P)
+            self.assertEqual(golomb_rice_decode(encoded, len(values), P), values)
+            self.assertRaises(ValueError, golomb_rice_decode, encoded[:-1], len(values), P)
+        self.assertEqual(golomb_rice_encode([], 19), b'')
+        self.assertEqual(golomb_rice_decode(b'', 0, 19), [])
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Read and replay message capture files written by bitcoind's -capturemessages.
+
+Each record in a capture file consists of a timestamp in microseconds (8 bytes,
+little endian), the message type (12 bytes, zero padded), the payload length
+(4 bytes, little endian) and the payload itself.
+
+CapturedMessage: a raw message read from a capture file
+read_capture_file: iterate over the messages of a capture file
+merge_capture_files: iterate over the messages of several capture files, ordered by time
+CaptureReplayer: send captured messages to a node over a P2PInterface, with the
+                 original timing, scaled timing or as fast as possible"""
+
+from collections import namedtuple
+import heapq
+import os
+import tempfile
+import time
+import unittest
+
+TIME_SIZE = 8
+LENGTH_SIZE = 4
+MSGTYPE_SIZE = 12
+HEADER_SIZE = TIME_SIZE + MSGTYPE_SIZE + LENGTH_SIZE
+
+# Messages that are part of the version handshake. The P2PInterface performs its own
+# handshake, so these are not replayed by default.
+HANDSHAKE_MSGTYPES = frozenset([
+    b"version",
+    b"verack",
+    b"wtxidrelay",
+    b"sendaddrv2",
+    b"sendtxrcncl",
+    b"feature",
+])
+
+
+class CapturedMessage:
+    """A message read from a capture file.
+
+    The payload is kept serialized, so it can be sent with
+    P2PConnection.send_without_ping() without deserializing it first."""
+    __slots__ = ("time", "msgtype", "payload")
+
+    def __init__(self, time, msgtype, payload):
+        self.time = time
+        self.msgtype = msgtype
+        self.payload = payload
+
+    def serialize(self):
+        return self.payload
+
+    def __lt__(self, other):
+        return self.time < other.time
+
+    def __repr__(self):
+        return "CapturedMessage(time=%d msgtype=%s size=%d)" % (self.time, self.msgtype.decode(errors="replace"), len(self.payload))
+
+
+def read_capture_file(path):
+    """Iterate over the messages in a capture file.
+
+    A truncated record at the end of the file (e.g. from a capture that is still
+    being written) is ignored."""
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(HEADER_SIZE)
+            if len(header) < HEADER_SIZE:
+                return
+            msg_time = int.from_bytes(header[:TIME_SIZE], "little")
+            msgtype = header[TIME_SIZE:TIME_SIZE + MSGTYPE_SIZE].split(b'\x00', 1)[0]
+            length = int.from_bytes(header[TIME_SIZE + MSGTYPE_SIZE:], "little")
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            yield CapturedMessage(msg_time, msgtype, payload)
+
+
+def merge_capture_files(paths):
+    """Iterate over the messages of several capture files, ordered by time."""
+    return heapq.merge(*(read_capture_file(path) for path in paths))
+
+
+ReplayStats = namedtuple("ReplayStats", ["messages", "bytes", "elapsed", "max_lag"])
+
+
+class CaptureReplayer:
+    """Send captured messages to a node over a connected P2PInterface.
+
+    speed scales the original timing: 1.0 replays with the original gaps between
+    messages, 2.0 twice as fast, and None sends every message as soon as possible.
+    Messages whose type is in skip_msgtypes are not sent."""
+
+    def __init__(self, messages, *, speed=1.0, skip_msgtypes=HANDSHAKE_MSGTYPES):
+        assert speed is None or speed > 0
+        self.messages = messages
+        self.speed = speed
+        self.skip_msgtypes = skip_msgtypes
+
+    def replay(self, peer, *, sync=True, timeout=60):
+        """Replay the messages to the node through peer and return a ReplayStats.
+
+        If sync is set, wait until the node has processed all messages, so that
+        elapsed reflects the node's message handling throughput. max_lag is the
+        largest delay, in seconds, between a message's scheduled and actual send time."""
+        num_messages = 0
+        num_bytes = 0
+        max_lag = 0.0
+        first_time = None
+        start = time.perf_counter()
+        for msg in self.messages:
+            if msg.msgtype in self.skip_msgtypes:
+                continue
+            if self.speed is not None:
+                if first_time is None:
+                    first_time = msg.time
+                scheduled = start + (msg.time - first_time) / 1e6 / self.speed
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    max_lag = max(max_lag, -delay)
+            peer.send_without_ping(msg)
+            num_messages += 1
+            num_bytes += len(msg.payload)
+        if sync:
+            peer.sync_with_ping(timeout=timeout)
+        return ReplayStats(num_messages, num_bytes, time.perf_counter() - start, max_lag)
+
+
+class TestFrameworkMessageCapture(unittest.TestCase):
+    def write_capture(self, path, records):
+        with open(path, 'wb') as f:
+            for msg_time, msgtype, payload in records:
+                f.write(msg_time.to_bytes(TIME_SIZE, "little"))
+                f.write(msgtype.ljust(MSGTYPE_SIZE, b'\x00'))
+                f.write(len(payload).to_bytes(LENGTH_SIZE, "little"))
+                f.write(payload)
+
+    def test_read_and_replay(self):
+        class FakePeer:
+            def __init__(self):
+                self.sent = []
+                self.synced = False
+
+            def send_without_ping(self, msg):
+                self.sent.append((time.perf_counter(), msg))
+
+            def sync_with_ping(self, *, timeout):
+                self.synced = True
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            recv_path = os.path.join(tmpdir, "msgs_recv.dat")
+            sent_path = os.path.join(tmpdir, "msgs_sent.dat")
+            self.write_capture(recv_path, [(10, b"version", b"v"), (20, b"inv", b"\x00"), (100020, b"tx", b"ab")])
+            self.write_capture(sent_path, [(15, b"verack", b""), (50000, b"ping", b"12345678")])
+            # Append a truncated record, which must be ignored
+            with open(sent_path, 'ab') as f:
+                f.write(b"\x00" * (HEADER_SIZE - 1))
+
+            msgs = list(read_capture_file(recv_path))
+            self.assertEqual([(m.time, m.msgtype, m.payload) for m in msgs], [(10, b"version", b"v"), (20, b"inv", b"\x00"), (100020, b"tx", b"ab")])
+            merged = list(merge_capture_files([recv_path, sent_path]))
+            self.assertEqual([m.time for m in merged], [10, 15, 20, 50000, 100020])
+
+            peer = FakePeer()
+            stats = CaptureReplayer(merged, speed=None).replay(peer)
+            self.assertTrue(peer.synced)
+            self.assertEqual([m.msgtype for _, m in peer.sent], [b"inv", b"ping", b"tx"])
+            self.assertEqual((stats.messages, stats.bytes), (3, 11))
+
+            # The 0.1s gap between the inv and the tx is scaled down to 0.05s
+            peer = FakePeer()
+            CaptureReplayer(msgs, speed=2.0).replay(peer, sync=False)
+            self.assertFalse(peer.synced)
+            self.assertGreaterEqual(peer.sent[1][0] - peer.sent[0][0], 0.05)
@@ -28,7 +28,7 @@ import socket
 import time
 import unittest
 
-from test_framework.crypto.siphash import siphash256
+from test_framework.crypto.siphash import siphash256, siphash256_batch
 from test_framework.util import (
     assert_equal,
     assert_not_equal,
@@ -955,6 +955,11 @@ def calculate_shortid(k0, k1, tx_hash):
     return expected_shortid
 
 
+# Calculate the shortids for a sequence of transaction hashes with the same keys
+def calculate_shortids(k0, k1, tx_hashes):
+    return [h & 0x0000ffffffffffff for h in siphash256_batch(k0, k1, tx_hashes)]
+
+
 # This version gets rid of the array lengths, and reinterprets the differential
 # encoding into indices that can be used for lookup.
 class HeaderAndShortIDs:
@@ -1008,15 +1013,11 @@ class HeaderAndShortIDs:
         self.header = CBlockHeader(block)
         self.nonce = nonce
         self.prefilled_txn = [ PrefilledTransaction(i, block.vtx[i]) for i in prefill_list ]
-        self.shortids = []
         self.use_witness = use_witness
         [k0, k1] = self.get_siphash_keys()
-        for i in range(len(block.vtx)):
-            if i not in prefill_list:
-                tx_hash = block.vtx[i].txid_int
-                if use_witness:
-                    tx_hash = block.vtx[i].wtxid_int
-                self.shortids.append(calculate_shortid(k0, k1, tx_hash))
+        prefilled = set(prefill_list)
+        tx_hashes = [tx.wtxid_int if use_witness else tx.txid_int for i, tx in enumerate(block.vtx) if i not in prefilled]
+        self.shortids = calculate_shortids(k0, k1, tx_hashes)
 
     def __repr__(self):
         return "HeaderAndShortIDs(header=%s, nonce=%d, shortids=%s, prefilledtxn=%s" % (repr(self.header), self.nonce, repr(self.shortids), repr(self.prefilled_txn))
@@ -22,17 +22,25 @@ P2PTxInvStore: A p2p interface class that inherits from P2PDataStore, and keeps
 
 import asyncio
 from collections import defaultdict
+import contextlib
 import ipaddress
 from io import BytesIO
 import logging
+from pathlib import Path
 import platform
+import queue
 import socket
 import struct
 import sys
+import tempfile
 import threading
+import unittest
 
 from test_framework.messages import (
+    CBlock,
     CBlockHeader,
+    CBlockLocator,
+    CInv,
     MAX_HEADERS_RESULTS,
     msg_addr,
     msg_addrv2,
@@ -84,6 +92,7 @@ from test_framework.netutil import (
 )
 from test_framework.util import (
     assert_not_equal,
+    JSONRPCException,
     MAX_NODES,
     p2p_port,
     wait_until_helper_internal,
@@ -116,6 +125,9 @@ TXID_RELAY_DELAY = 2
 OVERLOADED_PEER_TX_DELAY = 2
 # How long to wait before downloading a transaction from an additional peer
 GETDATA_TX_INTERVAL = 60
+# Ping nonces at or above this value are used by P2PDataStore.send_blocks_pipelined()
+# to find out which messages the node has processed
+PIPELINE_PING_NONCE_OFFSET = 1 << 62
 
 MESSAGEMAP = {
     b"addr": msg_addr,
@@ -823,62 +835,176 @@ class NetworkThread(threading.Thread):
         callback(addr, port)
 
 
-class P2PDataStore(P2PInterface):
-    """A P2P data store class.
+class DataStore:
+    """A block and transaction store that can be shared between P2PDataStore connections.
 
-    Keeps a block and transaction store and responds correctly to getdata and getheaders requests."""
+    Besides the hash-keyed block and transaction stores, keeps a height-indexed
+    copy of the header chain ending in the most recently added block, so that
+    getheaders locators can be resolved with hash lookups instead of walking the
+    block store back from the tip for every request."""
 
     def __init__(self):
-        super().__init__()
         # store of blocks. key is block hash, value is a CBlock object
         self.block_store = {}
-        self.last_block_hash = ''
         # store of txs. key is txid, value is a CTransaction object
         self.tx_store = {}
+        self.last_block_hash = ''
+        # hashes of the chain ending in last_block_hash, indexed by position
+        self._chain = []
+        # map from block hash to its position in self._chain
+        self._chain_index = {}
+
+    def add_block(self, block):
+        """Add a block to the store and make it the tip."""
+        self.block_store[block.hash_int] = block
+        self.last_block_hash = block.hash_int
+
+    def add_tx(self, tx):
+        self.tx_store[tx.txid_int] = tx
+
+    def reset_chain(self):
+        """Drop the header chain index. Must be called if blocks are removed from block_store."""
+        self._chain = []
+        self._chain_index = {}
+
+    def _update_chain(self):
+        """Bring the header chain index in line with last_block_hash.
+
+        Only the blocks between the new tip and the fork point with the previously
+        indexed chain are visited, so extending the tip is cheap."""
+        tip = self.last_block_hash
+        if self._chain and self._chain[-1] == tip:
+            return
+        branch = []
+        block_hash = tip
+        fork_pos = -1
+        while block_hash in self.block_store:
+            pos = self._chain_index.get(block_hash)
+            if pos is not None:
+                fork_pos = pos
+                break
+            branch.append(block_hash)
+            block_hash = self.block_store[block_hash].hashPrevBlock
+        for stale_hash in self._chain[fork_pos + 1:]:
+            del self._chain_index[stale_hash]
+        del self._chain[fork_pos + 1:]
+        for block_hash in reversed(branch):
+            self._chain_index[block_hash] = len(self._chain)
+            self._chain.append(block_hash)
+
+    def get_headers(self, locator, hash_stop):
+        """Return the headers to send in response to a getheaders message.
+
+        Starting from the tip, the chain is searched backwards for the first block
+        that is either in the locator or equal to hash_stop (the tip itself is
+        never treated as hash_stop). That block and all its descendants up to the
+        tip are returned, capped at MAX_HEADERS_RESULTS. If none is found, the
+        headers from the earliest block known to the store are returned."""
+        self._update_chain()
+        if not self._chain:
+            return []
+        tip_pos = len(self._chain) - 1
+        start = 0
+        for block_hash in locator.vHave:
+            pos = self._chain_index.get(block_hash)
+            if pos is not None and pos > start:
+                start = pos
+        pos = self._chain_index.get(hash_stop)
+        if pos is not None and start < pos < tip_pos:
+            start = pos
+        if start == 0 and self._chain[0] not in locator.vHave:
+            logger.debug('block hash {} not found in block store'.format(hex(self.block_store[self._chain[0]].hashPrevBlock)))
+        end = min(start + MAX_HEADERS_RESULTS, tip_pos + 1)
+        return [CBlockHeader(self.block_store[block_hash]) for block_hash in self._chain[start:end]]
+
+
+class P2PDataStore(P2PInterface):
+    """A P2P data store class.
+
+    Keeps a block and transaction store and responds correctly to getdata and getheaders requests.
+    A DataStore can be passed in to share the same blocks and transactions between several connections."""
+
+    def __init__(self, data_store=None):
+        super().__init__()
+        self.data_store = data_store if data_store is not None else DataStore()
         self.getdata_requests = []
+        # State of an ongoing send_blocks_pipelined() call:
+        # map from block hash to its position in the blocks being sent
+        self._pipeline_index = {}
+        # every ping sent follows a headers or blocks message. For each ping, in order:
+        # whether it followed headers, and the positions of the blocks announced or served
+        self._pipeline_sent = []
+        # number of pings sent before the call, and number of pings answered during it
+        self._pipeline_ping_base = 0
+        self._pipeline_confirmed = 0
+        # positions of the served blocks that the node has processed
+        self._pipeline_processed = set()
+
+    @property
+    def block_store(self):
+        return self.data_store.block_store
+
+    @block_store.setter
+    def block_store(self, block_store):
+        self.data_store.block_store = block_store
+        self.data_store.reset_chain()
+
+    @property
+    def tx_store(self):
+        return self.data_store.tx_store
+
+    @tx_store.setter
+    def tx_store(self, tx_store):
+        self.data_store.tx_store = tx_store
+
+    @property
+    def last_block_hash(self):
+        return self.data_store.last_block_hash
+
+    @last_block_hash.setter
+    def last_block_hash(self, last_block_hash):
+        self.data_store.last_block_hash = last_block_hash
 
     def on_getdata(self, message):
         """Check for the tx/block in our stores and if found, reply with MSG_TX or MSG_BLOCK."""
+        block_store = self.data_store.block_store
+        tx_store = self.data_store.tx_store
+        served = []
         for inv in message.inv:
             self.getdata_requests.append(inv.hash)
             invtype = inv.type & MSG_TYPE_MASK
-            if (invtype == MSG_TX or invtype == MSG_WTX) and inv.hash in self.tx_store.keys():
-                self.send_without_ping(msg_tx(self.tx_store[inv.hash]))
-            elif invtype == MSG_BLOCK and inv.hash in self.block_store.keys():
-                self.send_without_ping(msg_block(self.block_store[inv.hash]))
+            if (invtype == MSG_TX or invtype == MSG_WTX) and inv.hash in tx_store:
+                self.send_without_ping(msg_tx(tx_store[inv.hash]))
+            elif invtype == MSG_BLOCK and inv.hash in block_store:
+                self.send_without_ping(msg_block(block_store[inv.hash]))
+                pos = self._pipeline_index.get(inv.hash)
+                if pos is not None:
+                    served.append(pos)
             else:
                 logger.debug('getdata message type {} received.'.format(hex(inv.type)))
+        if served:
+            # The pong confirms that the node has processed these blocks
+            self._send_pipeline_ping(False, served)
+
+    def _send_pipeline_ping(self, headers, positions):
+        """Send a ping after a headers message or blocks, whose pong confirms that the node
+        has processed them. Must be called with p2p_lock held."""
+        self._pipeline_sent.append((headers, positions))
+        self.send_without_ping(msg_ping(nonce=PIPELINE_PING_NONCE_OFFSET + self._pipeline_ping_base + len(self._pipeline_sent)))
+
+    def on_pong(self, message):
+        confirmed = message.nonce - PIPELINE_PING_NONCE_OFFSET - self._pipeline_ping_base
+        if 0 < confirmed <= len(self._pipeline_sent):
+            for headers, positions in self._pipeline_sent[self._pipeline_confirmed:confirmed]:
+                if not headers:
+                    self._pipeline_processed.update(positions)
+            self._pipeline_confirmed = max(self._pipeline_confirmed, confirmed)
 
     def on_getheaders(self, message):
-        """Search back through our block store for the locator, and reply with a headers message if found."""
-
-        locator, hash_stop = message.locator, message.hashstop
-
-        # Assume that the most recent block added is the tip
-        if not self.block_store:
-            return
-
-        headers_list = [self.block_store[self.last_block_hash]]
-        while headers_list[-1].hash_int not in locator.vHave:
-            # Walk back through the block store, adding headers to headers_list
-            # as we go.
-            prev_block_hash = headers_list[-1].hashPrevBlock
-            if prev_block_hash in self.block_store:
-                prev_block_header = CBlockHeader(self.block_store[prev_block_hash])
-                headers_list.append(prev_block_header)
-                if prev_block_header.hash_int == hash_stop:
-                    # if this is the hashstop header, stop here
-                    break
-            else:
-                logger.debug('block hash {} not found in block store'.format(hex(prev_block_hash)))
-                break
-
-        # Truncate the list if there are too many headers
-        headers_list = headers_list[:-MAX_HEADERS_RESULTS - 1:-1]
-        response = msg_headers(headers_list)
-
-        if response is not None:
-            self.send_without_ping(response)
+        """Look up the locator in our header chain, and reply with a headers message if found."""
+        headers_list = self.data_store.get_headers(message.locator, message.hashstop)
+        if headers_list:
+            self.send_without_ping(msg_headers(headers_list))
 
     def send_blocks_and_test(self, blocks, node, *, success=True, force_send=False, reject_reason=None, expect_disconnect=False, timeout=60, is_decoy=False):
         """Send blocks to test node and test whether the tip advances.
@@ -894,8 +1020,7 @@ class P2PDataStore(P2PInterface):
 
         with p2p_lock:
             for block in blocks:
-                self.block_store[block.hash_int] = block
-                self.last_block_hash = block.hash_int
+                self.data_store.add_block(block)
 
         reject_reason = [reject_reason] if reject_reason else []
         with node.assert_debug_log(expected_msgs=reject_reason):
@@ -922,6 +1047,117 @@ class P2PDataStore(P2PInterface):
             else:
                 assert_not_equal(node.getbestblockhash(), blocks[-1].hash_hex)
 
+    def send_blocks_pipelined(self, blocks, node, *, success=True, reject_reason=None, expect_disconnect=False, window=64, timeout=60):
+        """Send a chain of blocks to test node, with up to `window` unprocessed blocks in flight.
+
+        Meant for long chains, where calling send_blocks_and_test for every block
+        pays a full round trip and tip polling per block.
+
+         - blocks must form a chain extending the node's tip, so that the tip is the last
+           connected block of blocks at the end
+         - add all blocks to our block_store
+         - send headers messages in batches, as long as fewer than `window` announced blocks
+           have not been processed by the node, each followed by a ping
+         - the on_getdata handler serves the requested blocks and follows them with a ping.
+           The pongs tell which messages the node has processed.
+         - stop once the node has processed everything and will not request more blocks, or
+           has disconnected. The first block after the node's tip is then the rejected one, if any:
+           - if it was processed, or the node disconnected while processing it, it was rejected
+           - otherwise it was never requested, and the first announced block whose header the
+             node does not know was rejected at the header stage
+         - if success is True: assert that all blocks are connected
+         - if success is False: assert that the last block is rejected and all other blocks are connected
+         - if reject_reason is set: assert that the correct reject message is logged
+
+        If another block than expected is rejected, the assertion error names that block,
+        whether it was rejected at the header stage, and the debug log lines mentioning it."""
+        assert window > 0
+        batch_size = min(max(window // 2, 1), MAX_HEADERS_RESULTS)
+        block_positions = {block.hash_hex: pos for pos, block in enumerate(blocks)}
+
+        with p2p_lock:
+            for block in blocks:
+                self.data_store.add_block(block)
+            self._pipeline_index = {block.hash_int: pos for pos, block in enumerate(blocks)}
+            self._pipeline_ping_base += len(self._pipeline_sent)
+            self._pipeline_sent = []
+            self._pipeline_confirmed = 0
+            self._pipeline_processed = set()
+
+        log_start = node.debug_log_size(encoding="utf-8")
+        reject_reason = [reject_reason] if reject_reason else []
+        with node.assert_debug_log(expected_msgs=reject_reason):
+            announced = 0
+
+            def idle():
+                return self._pipeline_confirmed == len(self._pipeline_sent)
+
+            def next_batch_size():
+                remaining = len(blocks) - announced
+                room = window - (announced - len(self._pipeline_processed))
+                size = min(batch_size, room, remaining)
+                # Wait for room for a full batch, unless the node has nothing else to do
+                return size if size > 0 and (size == min(batch_size, remaining) or idle()) else 0
+
+            try:
+                while True:
+                    self.wait_until(lambda: not self.is_connected or next_batch_size() or idle(), timeout=timeout, check_connected=False)
+                    with p2p_lock:
+                        connected = self.is_connected
+                        if not connected:
+                            break
+                        size = next_batch_size()
+                        if size:
+                            self.send_without_ping(msg_headers([CBlockHeader(block) for block in blocks[announced:announced + size]]))
+                            self._send_pipeline_ping(True, list(range(announced, announced + size)))
+                            announced += size
+                        elif idle():
+                            # The node processed everything and will not request any more blocks
+                            break
+                with p2p_lock:
+                    processed = set(self._pipeline_processed)
+                    # The message the node was processing when it disconnected us, if any
+                    unconfirmed = None if idle() else self._pipeline_sent[self._pipeline_confirmed]
+            finally:
+                with p2p_lock:
+                    self._pipeline_index = {}
+
+            def header_known(pos):
+                try:
+                    node.getblockheader(blocks[pos].hash_hex)
+                    return True
+                except JSONRPCException:
+                    return False
+
+            rejected = block_positions.get(node.getbestblockhash(), -1) + 1
+            stage = ""
+            if rejected == len(blocks):
+                rejected = None
+            elif rejected not in processed and (unconfirmed is None or unconfirmed[0]):
+                # The block was never requested, so a header was rejected: the first one the
+                # node does not know, if the headers of all earlier blocks were accepted.
+                stage = ", it was never requested"
+                for pos in range(rejected, announced):
+                    if not header_known(pos):
+                        rejected = pos
+                        stage = " at the header stage" + stage
+                        break
+
+            expected_rejected = None if success else len(blocks) - 1
+            if rejected != expected_rejected:
+                if rejected is None:
+                    raise AssertionError(f"Block {expected_rejected} ({blocks[expected_rejected].hash_hex}) was not rejected")
+                rejected_hash = blocks[rejected].hash_hex
+                with open(node.debug_log_path, encoding="utf-8", errors="replace") as dl:
+                    dl.seek(log_start)
+                    log_lines = [line for line in dl.read().splitlines() if rejected_hash in line]
+                raise AssertionError("Block {} ({}) was rejected{}:\n{}".format(rejected, rejected_hash, stage, "\n".join(log_lines)))
+
+            if expect_disconnect:
+                self.wait_for_disconnect(timeout=timeout)
+            elif not connected:
+                raise AssertionError("Peer disconnected while sending blocks")
+
     def send_txs_and_test(self, txs, node, *, success=True, reject_reason=None):
         """Send txs to test node and test whether they're accepted to the mempool.
 
@@ -932,7 +1168,7 @@ class P2PDataStore(P2PInterface):
 
         with p2p_lock:
             for tx in txs:
-                self.tx_store[tx.txid_int] = tx
+                self.data_store.add_tx(tx)
 
         reject_reason = [reject_reason] if reject_reason else []
         with node.assert_debug_log(expected_msgs=reject_reason):
@@ -1001,3 +1237,231 @@ def start_p2p_listener(network_thread, listener):
     wait_until_helper_internal(lambda: listen_port != 0)
 
     return listen_addr, listen_port
+
+
+class _PipelineTestNode:
+    """Just enough of a TestNode to unit test P2PDataStore.send_blocks_pipelined.
+
+    Handles the messages of one peer on its own thread, like the node would: headers
+    are accepted up to the first invalid or unconnecting one, the blocks of accepted
+    headers are requested with at most MAX_BLOCKS_IN_TRANSIT in flight, and blocks
+    are connected in order up to the first invalid one."""
+
+    MAX_BLOCKS_IN_TRANSIT = 16
+
+    def __init__(self, log_dir, tip, *, invalid_headers=(), invalid_blocks=(), disconnect=False):
+        self.debug_log_path = Path(log_dir) / "debug.log"
+        self.debug_log_path.write_text("")
+        self.tip = tip
+        self.invalid_headers = set(invalid_headers)
+        self.invalid_blocks = set(invalid_blocks)
+        # whether to disconnect the peer for an invalid header or block
+        self.disconnect = disconnect
+        self.connected = True
+        self.peer = None
+        self.invalid = set()
+        # accepted headers, in order, and how many of them were requested
+        self.headers = []
+        self.known_headers = {tip}
+        self.num_requested = 0
+        self.in_transit = 0
+        # number of headers and blocks received, and the most blocks ever announced but not received
+        self.num_headers = 0
+        self.num_blocks = 0
+        self.max_unprocessed = 0
+        self.inbox = queue.Queue()
+        self.thread = threading.Thread(target=self._run)
+
+    def getbestblockhash(self):
+        return "{:064x}".format(self.tip)
+
+    def getblockheader(self, blockhash):
+        if int(blockhash, 16) not in self.known_headers:
+            raise JSONRPCException({"code": -5, "message": "Block not found"})
+
+    def debug_log_size(self, **kwargs):
+        return self.debug_log_path.stat().st_size
+
+    @contextlib.contextmanager
+    def assert_debug_log(self, expected_msgs):
+        prev_size = self.debug_log_size()
+        yield
+        log = self.debug_log_path.read_text()[prev_size:]
+        for expected_msg in expected_msgs:
+            assert expected_msg in log, f"Expected message {expected_msg!r} not found in log"
+
+    def _log(self, line):
+        with open(self.debug_log_path, "a") as dl:
+            dl.write(line + "\n")
+
+    def _reject(self, block_hash, line):
+        self.invalid.add(block_hash)
+        self._log(line)
+        if self.disconnect:
+            self.connected = False
+
+    def _run(self):
+        while (message := self.inbox.get()) is not None:
+            if not self.connected:
+                continue
+            if message.msgtype == b"headers":
+                self._on_headers(message)
+            elif message.msgtype == b"block":
+                self._on_block(message)
+            elif message.msgtype == b"ping":
+                self.peer.on_message(msg_pong(message.nonce))
+            if self.connected:
+                self._request_blocks()
+
+    def _on_headers(self, message):
+        self.num_headers += len(message.headers)
+        self.max_unprocessed = max(self.max_unprocessed, self.num_headers - self.num_blocks)
+        for header in message.headers:
+            if header.hash_int in self.invalid_headers or header.hashPrevBlock in self.invalid:
+                self._reject(header.hash_int, f"ERROR: header {header.hash_hex} rejected: bad-header")
+                break
+            if header.hashPrevBlock not in self.known_headers:
+                break
+            if header.hash_int not in self.known_headers:
+                self.known_headers.add(header.hash_int)
+                self.headers.append(header)
+
+    def _on_block(self, message):
+        block = message.block
+        self.num_blocks += 1
+        self.in_transit -= 1
+        if block.hash_int in self.invalid_blocks:
+            self._reject(block.hash_int, f"ERROR: ConnectBlock {block.hash_hex} failed: bad-block")
+        elif block.hashPrevBlock == self.tip:
+            self.tip = block.hash_int
+
+    def _request_blocks(self):
+        getdata = msg_getdata()
+        while self.in_transit < self.MAX_BLOCKS_IN_TRANSIT and self.num_requested < len(self.headers):
+            header = self.headers[self.num_requested]
+            self.num_requested += 1
+            if header.hashPrevBlock in self.invalid:
+                self.invalid.add(header.hash_int)
+                continue
+            getdata.inv.append(CInv(MSG_BLOCK, header.hash_int))
+            self.in_transit += 1
+        if getdata.inv:
+            self.peer.on_message(getdata)
+
+
+class _PipelineTestPeer(P2PDataStore):
+    """A P2PDataStore connected to a _PipelineTestNode instead of a socket."""
+
+    def __init__(self, node):
+        super().__init__()
+        self.node = node
+        node.peer = self
+        self.timeout_factor = 1
+
+    @property
+    def is_connected(self):
+        return self.node.connected
+
+    def send_without_ping(self, message, is_decoy=False):
+        self.node.inbox.put(message)
+
+
+class TestFrameworkP2P(unittest.TestCase):
+    def test_data_store_get_headers(self):
+        def make_chain(prev_hash, length, ntime):
+            chain = []
+            for _ in range(length):
+                block = CBlock()
+                block.hashPrevBlock = prev_hash
+                block.nTime = ntime
+                prev_hash = block.hash_int
+                chain.append(block)
+            return chain
+
+        def locator(*blocks):
+            loc = CBlockLocator()
+            loc.vHave = [b.hash_int for b in blocks]
+            return loc
+
+        def hashes(headers):
+            return [h.hash_int for h in headers]
+
+        store = DataStore()
+        self.assertEqual(store.get_headers(locator(), 0), [])
+        main = make_chain(1, MAX_HEADERS_RESULTS + 10, 1)
+        for block in main:
+            store.add_block(block)
+        # Unknown locator: headers from the earliest known block
+        self.assertEqual(hashes(store.get_headers(locator(), 0)), hashes(main[:MAX_HEADERS_RESULTS]))
+        # The most recent locator entry on the chain wins, and is included
+        self.assertEqual(hashes(store.get_headers(locator(main[-3], main[5]), 0)), hashes(main[-3:]))
+        self.assertEqual(hashes(store.get_headers(locator(main[-1]), 0)), hashes(main[-1:]))
+        # hash_stop below the tip ends the backwards search
+        self.assertEqual(hashes(store.get_headers(locator(main[5]), main[-4].hash_int)), hashes(main[-4:]))
+        self.assertEqual(hashes(store.get_headers(locator(main[-2]), main[-1].hash_int)), hashes(main[-2:]))
+
+        # Reorg to a fork, then back to an extension of the main chain
+        fork = make_chain(main[100].hash_int, 3, 2)
+        for block in fork:
+            store.add_block(block)
+        self.assertEqual(hashes(store.get_headers(locator(main[-1], main[99]), 0)), hashes([main[99], main[100]] + fork))
+        self.assertEqual(hashes(store.get_headers(locator(fork[0]), 0)), hashes(fork))
+        extension = make_chain(main[-1].hash_int, 2, 3)
+        for block in extension:
+            store.add_block(block)
+        self.assertEqual(hashes(store.get_headers(locator(fork[-1], main[-2]), 0)), hashes(main[-2:] + extension))
+
+        # Connections sharing a store see the same blocks
+        peer_a = P2PDataStore(store)
+        peer_b = P2PDataStore(store)
+        self.assertIs(peer_a.block_store, peer_b.block_store)
+        self.assertEqual(peer_b.last_block_hash, extension[-1].hash_int)
+
+    def test_send_blocks_pipelined(self):
+        genesis = 1
+        chain = []
+        for _ in range(200):
+            block = CBlock()
+            block.hashPrevBlock = chain[-1].hash_int if chain else genesis
+            chain.append(block)
+
+        @contextlib.contextmanager
+        def pipeline(**kwargs):
+            with tempfile.TemporaryDirectory() as log_dir:
+                node = _PipelineTestNode(log_dir, genesis, **kwargs)
+                node.thread.start()
+                try:
+                    yield node, _PipelineTestPeer(node)
+                finally:
+                    node.inbox.put(None)
+                    node.thread.join()
+
+        # All blocks are connected, with at most `window` blocks announced but not processed
+        for window, blocks in ((1, chain[:10]), (20, chain), (64, chain)):
+            with pipeline() as (node, peer):
+                peer.send_blocks_pipelined(blocks, node, window=window)
+                self.assertEqual(node.tip, blocks[-1].hash_int)
+                self.assertEqual(node.num_blocks, len(blocks))
+                self.assertLessEqual(node.max_unprocessed, window)
+
+        # The last block is rejected, as expected
+        with pipeline(invalid_blocks=[chain[-1].hash_int], disconnect=True) as (node, peer):
+            peer.send_blocks_pipelined(chain, node, success=False, reject_reason="bad-block", expect_disconnect=True)
+            self.assertEqual(node.tip, chain[-2].hash_int)
+        with pipeline(invalid_headers=[chain[-1].hash_int]) as (node, peer):
+            peer.send_blocks_pipelined(chain, node, success=False, reject_reason="bad-header")
+
+        # The first rejected block is reported, along with its log lines and the stage it was rejected
+        # at. When disconnecting, the node drops the blocks still in flight before the rejected one.
+        for disconnect in (False, True):
+            with pipeline(invalid_blocks=[chain[120].hash_int], disconnect=disconnect) as (node, peer):
+                with self.assertRaisesRegex(AssertionError, f"Block 120 \\({chain[120].hash_hex}\\) was rejected:\n.*ConnectBlock .* failed: bad-block$"):
+                    peer.send_blocks_pipelined(chain, node, window=32)
+            with pipeline(invalid_headers=[chain[120].hash_int], disconnect=disconnect) as (node, peer):
+                with self.assertRaisesRegex(AssertionError, f"Block 120 \\({chain[120].hash_hex}\\) was rejected at the header stage, it was never requested:\n.*bad-header$"):
+                    peer.send_blocks_pipelined(chain, node, window=32)
+                if not disconnect:
+                    self.assertEqual(node.tip, chain[119].hash_int)
+        with pipeline() as (node, peer):
+            with self.assertRaisesRegex(AssertionError, f"Block 199 \\({chain[-1].hash_hex}\\) was not rejected"):
+                peer.send_blocks_pipelined(chain, node, success=False)
@@ -7,7 +7,8 @@
 This file is modified from python-bitcoinlib.
 """
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+import threading
 import unittest
 
 from .key import TaggedHash, tweak_add_pubkey, compute_xonly_pubkey
@@ -425,6 +426,91 @@ class CScriptNum:
         return result
 
 
+_PUSHDATA_LENGTH_SIZES = {OP_PUSHDATA1: 1, OP_PUSHDATA2: 2, OP_PUSHDATA4: 4}
+
+
+def _pushdata_type(opcode):
+    if opcode < OP_PUSHDATA1:
+        return 'PUSHDATA(%d)' % opcode
+    return 'PUSHDATA%d' % _PUSHDATA_LENGTH_SIZES[opcode]
+
+
+def _parse_script(script):
+    """Tokenize a script in a single pass.
+
+    Returns a tuple of (opcode, data, sop_idx) tuples, with data a memoryview of
+    the script for pushes and None otherwise, as well as the type and arguments
+    of the CScriptInvalidError at the end of the script, if any.
+    """
+    ops = []
+    view = memoryview(script)
+    size = len(script)
+    i = 0
+    while i < size:
+        sop_idx = i
+        opcode = _opcode_instances[script[i]]
+        i += 1
+        if opcode > OP_PUSHDATA4:
+            ops.append((opcode, None, sop_idx))
+            continue
+
+        if opcode < OP_PUSHDATA1:
+            datasize = opcode
+        else:
+            length_size = _PUSHDATA_LENGTH_SIZES[opcode]
+            if i + length_size > size:
+                return tuple(ops), (CScriptInvalidError, ('%s: missing data length' % _pushdata_type(opcode),))
+            datasize = int.from_bytes(view[i:i + length_size], 'little')
+            i += length_size
+
+        # Check for truncation
+        if i + datasize > size:
+            return tuple(ops), (CScriptTruncatedPushDataError, ('%s: truncated data' % _pushdata_type(opcode), bytes(view[i:])))
+
+        ops.append((opcode, view[i:i + datasize], sop_idx))
+        i += datasize
+    return tuple(ops), None
+
+
+# Scripts longer than this (the maximum standard scriptSig size) are tokenized
+# on every use instead of being cached
+TOKEN_CACHE_MAX_SCRIPT_SIZE = 1650
+# The least recently used scripts are evicted from the cache once the cached
+# scripts hold more tokens than this in total
+TOKEN_CACHE_MAX_TOKENS = 1 << 16
+
+_token_cache: OrderedDict = OrderedDict()
+_token_cache_size = 0
+_token_cache_lock = threading.Lock()
+
+
+def _tokenize_script(script):
+    """Tokenize a script with _parse_script(), caching the result of short scripts.
+
+    Scripts are immutable, so the result is cached by script content. This also
+    covers copies, like CScript(tx.vin[0].scriptSig). The cache is bounded by
+    the total number of tokens held, as each token keeps a tuple and possibly a
+    memoryview alive.
+    """
+    global _token_cache_size
+    if len(script) > TOKEN_CACHE_MAX_SCRIPT_SIZE:
+        return _parse_script(script)
+    with _token_cache_lock:
+        result = _token_cache.get(script)
+        if result is not None:
+            _token_cache.move_to_end(script)
+            return result
+    result = _parse_script(script)
+    with _token_cache_lock:
+        if script not in _token_cache:
+            _token_cache[script] = result
+            _token_cache_size += len(result[0])
+            while _token_cache_size > TOKEN_CACHE_MAX_TOKENS:
+                _, (evicted_ops, _) = _token_cache.popitem(last=False)
+                _token_cache_size -= len(evicted_ops)
+    return result
+
+
 class CScript(bytes):
     """Serialized script
 
@@ -477,6 +563,19 @@ class CScript(bytes):
             # returns a bytes instance even when subclassed.
             return super().__new__(cls, b''.join(coerce_iterable(value)))
 
+    def tokens(self):
+        """Tokenized script
+
+        Returns a tuple of (opcode, data, sop_idx) tuples like raw_iter(),
+        except that data is a memoryview of the script instead of a copy. The
+        script is only tokenized once, see _tokenize_script(). Raises
+        CScriptInvalidError if the script is invalid.
+        """
+        ops, error = _tokenize_script(self)
+        if error is not None:
+            raise error[0](*error[1])
+        return ops
+
     def raw_iter(self):
         """Raw iteration
 
@@ -484,54 +583,11 @@ class CScript(bytes):
         PUSHDATA encodings can be accurately distinguished, as well as
         determining the exact opcode byte indexes. (sop_idx)
         """
-        i = 0
-        while i < len(self):
-            sop_idx = i
-            opcode = CScriptOp(self[i])
-            i += 1
-
-            if opcode > OP_PUSHDATA4:
-                yield (opcode, None, sop_idx)
-            else:
-                datasize = None
-                pushdata_type = None
-                if opcode < OP_PUSHDATA1:
-                    pushdata_type = 'PUSHDATA(%d)' % opcode
-                    datasize = opcode
-
-                elif opcode == OP_PUSHDATA1:
-                    pushdata_type = 'PUSHDATA1'
-                    if i >= len(self):
-                        raise CScriptInvalidError('PUSHDATA1: missing data length')
-                    datasize = self[i]
-                    i += 1
-
-                elif opcode == OP_PUSHDATA2:
-                    pushdata_type = 'PUSHDATA2'
-                    if i + 1 >= len(self):
-                        raise CScriptInvalidError('PUSHDATA2: missing data length')
-                    datasize = self[i] + (self[i + 1] << 8)
-                    i += 2
-
-                elif opcode == OP_PUSHDATA4:
-                    pushdata_type = 'PUSHDATA4'
-                    if i + 3 >= len(self):
-                        raise CScriptInvalidError('PUSHDATA4: missing data length')
-                    datasize = self[i] + (self[i + 1] << 8) + (self[i + 2] << 16) + (self[i + 3] << 24)
-                    i += 4
-
-                else:
-                    assert False  # shouldn't happen
-
-                data = bytes(self[i:i + datasize])
-
-                # Check for truncation
-                if len(data) < datasize:
-                    raise CScriptTruncatedPushDataError('%s: truncated data' % pushdata_type, data)
-
-                i += datasize
-
-                yield (opcode, data, sop_idx)
+        ops, error = _tokenize_script(self)
+        for (opcode, data, sop_idx) in ops:
+            yield (opcode, None if data is None else bytes(data), sop_idx)
+        if error is not None:
+            raise error[0](*error[1])
 
     def __iter__(self):
         """'Cooked' iteration
@@ -545,13 +601,10 @@ class CScript(bytes):
         for (opcode, data, sop_idx) in self.raw_iter():
             if data is not None:
                 yield data
+            elif opcode.is_small_int():
+                yield opcode.decode_op_n()
             else:
-                opcode = CScriptOp(opcode)
-
-                if opcode.is_small_int():
-                    yield opcode.decode_op_n()
-                else:
-                    yield CScriptOp(opcode)
+                yield opcode
 
     def __repr__(self):
         def _repr(o):
@@ -589,7 +642,7 @@ class CScript(bytes):
         """
         n = 0
         lastOpcode = OP_INVALIDOPCODE
-        for (opcode, data, sop_idx) in self.raw_iter():
+        for (opcode, data, sop_idx) in self.tokens():
             if opcode in (OP_CHECKSIG, OP_CHECKSIGVERIFY):
                 n += 1
             elif opcode in (OP_CHECKMULTISIG, OP_CHECKMULTISIGVERIFY):
@@ -616,20 +669,17 @@ SIGHASH_ANYONECANPAY = 0x80
 
 def FindAndDelete(script, sig):
     """Consensus critical, see FindAndDelete() in Satoshi codebase"""
-    r = b''
+    r = []
     last_sop_idx = sop_idx = 0
     skip = True
-    for (opcode, data, sop_idx) in script.raw_iter():
+    for (opcode, data, sop_idx) in script.tokens():
         if not skip:
-            r += script[last_sop_idx:sop_idx]
+            r.append(script[last_sop_idx:sop_idx])
         last_sop_idx = sop_idx
-        if script[sop_idx:sop_idx + len(sig)] == sig:
-            skip = True
-        else:
-            skip = False
+        skip = script.startswith(sig, sop_idx)
     if not skip:
-        r += script[last_sop_idx:]
-    return CScript(r)
+        r.append(script[last_sop_idx:])
+    return CScript(b''.join(r))
 
 def LegacySignatureMsg(script, txTo, inIdx, hashtype):
     """Preimage of the signature hash, if it exists.
@@ -799,6 +849,46 @@ class TestFrameworkScript(unittest.TestCase):
                 self.assertEqual(multisig_script.GetSigOpCount(fAccurate=False), 20)
                 self.assertEqual(multisig_script.GetSigOpCount(fAccurate=True), n)
 
+    def test_tokens(self):
+        data = bytes(range(100))
+        script = CScript(bytes(CScript([OP_DUP, data[:20], data, OP_CHECKSIG])) + bytes([OP_PUSHDATA2, 3, 0]) + data[:3])
+        tokens = script.tokens()
+        self.assertEqual([(op, None if d is None else bytes(d), idx) for op, d, idx in tokens],
+                         [(OP_DUP, None, 0), (20, data[:20], 1), (OP_PUSHDATA1, data, 22), (OP_CHECKSIG, None, 124), (OP_PUSHDATA2, data[:3], 125)])
+        self.assertTrue(all(d is None or isinstance(d, memoryview) for _, d, _ in tokens))
+        self.assertEqual(list(script.raw_iter()), [(op, None if d is None else bytes(d), idx) for op, d, idx in tokens])
+        # Copies share the cached tokens
+        self.assertIs(CScript(bytes(script)).tokens(), tokens)
+        # Long scripts are not cached
+        long_script = CScript([OP_CHECKSIG] * (TOKEN_CACHE_MAX_SCRIPT_SIZE + 1))
+        self.assertIsNot(long_script.tokens(), long_script.tokens())
+        self.assertEqual(long_script.GetSigOpCount(fAccurate=True), TOKEN_CACHE_MAX_SCRIPT_SIZE + 1)
+        # The cache is bounded by the number of tokens held
+        for n in range(TOKEN_CACHE_MAX_TOKENS // TOKEN_CACHE_MAX_SCRIPT_SIZE + 2):
+            CScript([OP_CHECKSIG] * (TOKEN_CACHE_MAX_SCRIPT_SIZE - 2) + [n]).tokens()
+        self.assertGreater(_token_cache_size, TOKEN_CACHE_MAX_TOKENS - TOKEN_CACHE_MAX_SCRIPT_SIZE)
+        self.assertLessEqual(_token_cache_size, TOKEN_CACHE_MAX_TOKENS)
+        self.assertEqual(_token_cache_size, sum(len(ops) for ops, _ in _token_cache.values()))
+
+        # Invalid scripts are iterated up to the error
+        truncated = CScript(bytes([OP_DUP, 5, 1, 2]))
+        self.assertRaises(CScriptTruncatedPushDataError, truncated.tokens)
+        ops = []
+        with self.assertRaises(CScriptTruncatedPushDataError) as cm:
+            for op in truncated.raw_iter():
+                ops.append(op)
+        self.assertEqual(ops, [(OP_DUP, None, 0)])
+        self.assertEqual(cm.exception.data, bytes([1, 2]))
+        self.assertEqual(repr(truncated), "CScript([OP_DUP, x('0102')...<ERROR: PUSHDATA(5): truncated data>])")
+        self.assertEqual(repr(CScript(bytes([OP_PUSHDATA4, 1, 0]))), "CScript([<ERROR: PUSHDATA4: missing data length>])")
+
+    def test_find_and_delete(self):
+        sep = CScript([OP_CODESEPARATOR])
+        self.assertEqual(FindAndDelete(CScript([OP_CODESEPARATOR, OP_1, OP_CODESEPARATOR, OP_CODESEPARATOR]), sep), CScript([OP_1]))
+        # Only matches at opcode boundaries are deleted
+        self.assertEqual(FindAndDelete(CScript([bytes([OP_CODESEPARATOR]), OP_CODESEPARATOR]), sep), CScript([bytes([OP_CODESEPARATOR])]))
+        self.assertEqual(FindAndDelete(CScript(), sep), CScript())
+
 def BIP341_sha_prevouts(txTo):
     return sha256(b"".join(i.prevout.serialize() for i in txTo.vin))
 
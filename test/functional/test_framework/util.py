@@ -20,6 +20,7 @@ import re
 import shlex
 import time
 import types
+import unittest
 
 from .descriptors import descsum_create
 from collections.abc import Callable
@@ -468,10 +469,16 @@ def sha256sum_file(filename):
 
 
 def util_xor(data, key, *, offset):
-    data = bytearray(data)
-    for i in range(len(data)):
-        data[i] ^= key[(i + offset) % len(key)]
-    return bytes(data)
+    """XOR data with the repeated key, as if data started at position offset of the key stream.
+
+    This is how block and undo files are obfuscated with the blocksdir XOR key.
+    The whole buffer is processed at once, with a single big integer XOR."""
+    size = len(data)
+    if size == 0 or not any(key):
+        return bytes(data)
+    shift = offset % len(key)
+    key_stream = ((key[shift:] + key[:shift]) * (size // len(key) + 1))[:size]
+    return (int.from_bytes(data, "little") ^ int.from_bytes(key_stream, "little")).to_bytes(size, "little")
 
 
 # RPC/P2P connection constants and functions
@@ -731,3 +738,17 @@ def is_dir_writable(dir_path: pathlib.Path) -> bool:
         return True
     except OSError:
         return False
+
+
+class TestFrameworkUtil(unittest.TestCase):
+    def test_util_xor(self):
+        def slow_xor(data, key, offset):
+            return bytes(b ^ key[(i + offset) % len(key)] for i, b in enumerate(data))
+
+        key = bytes.fromhex("0123456789abcdef")
+        data = random.randbytes(1000)
+        for offset in [0, 1, 7, 8, 13, 1 << 33]:
+            for size in [0, 1, 7, 8, 9, 1000]:
+                self.assertEqual(util_xor(data[:size], key, offset=offset), slow_xor(data[:size], key, offset))
+        self.assertEqual(util_xor(bytearray(data), bytes(8), offset=3), data)
+        self.assertEqual(util_xor(memoryview(data)[5:], key, offset=5), slow_xor(data, key, 0)[5:])
@@ -65,19 +65,22 @@ class SignetMinerTest(BitcoinTestFramework):
         # Nodes with different signet networks are not connected
 
     # generate block with signet miner tool
-    def mine_block(self, node):
+    def mine_block(self, node, *, builtin_grinder=False, rpc_url=False):
         n_blocks = node.getblockcount()
         base_dir = self.config["environment"]["SRCDIR"]
         signet_miner_path = os.path.join(base_dir, "contrib", "signet", "miner")
         rpc_argv = node.binaries.rpc_argv() + [f"-datadir={node.datadir_path}"]
         util_argv = node.binaries.util_argv() + ["grind"]
+        miner_args = [f'--rpc-url={node.url}'] if rpc_url else []
+        grind_args = ['--grind-jobs=2'] if builtin_grinder else [f'--grind-cmd={shlex.join(util_argv)}']
         subprocess.run([
                 sys.executable,
                 signet_miner_path,
                 f'--cli={shlex.join(rpc_argv)}',
+            ] + miner_args + [
                 'generate',
                 f'--address={node.getnewaddress()}',
-                f'--grind-cmd={shlex.join(util_argv)}',
+            ] + grind_args + [
                 f'--nbits={DIFF_1_N_BITS:08x}',
                 f'--set-block-time={int(time.time())}',
                 '--poolnum=99',
@@ -129,6 +132,10 @@ class SignetMinerTest(BitcoinTestFramework):
         self.mine_block_manual(node, sign=True)
         assert get_signet_commitment(get_segwit_commitment(node))
 
+        self.log.info("Mine with the built-in grinder, signing over a persistent RPC connection")
+        self.mine_block(node, builtin_grinder=True, rpc_url=True)
+        assert get_signet_commitment(get_segwit_commitment(node))
+
         node = self.nodes[1]
         self.log.info("Signet node with trivial challenge (OP_TRUE)")
         self.mine_block(node)
@@ -141,6 +148,10 @@ class SignetMinerTest(BitcoinTestFramework):
         self.mine_block(node)
         assert get_signet_commitment(get_segwit_commitment(node)) is None
 
+        self.log.info("Mine with the built-in grinder, over a persistent RPC connection")
+        self.mine_block(node, builtin_grinder=True, rpc_url=True)
+        assert get_signet_commitment(get_segwit_commitment(node)) is None
+
         node = self.nodes[3]
         self.log.info("Signet node with trivial challenge (push sha256 hash)")
         self.mine_block(node)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# Copyright (c) 2026-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Test the utxo_index.py snapshot lookup tool"""
+import json
+import os
+import subprocess
+import sys
+
+from test_framework.key import ECKey
+from test_framework.messages import COIN
+from test_framework.script_util import (
+    key_to_p2pk_script,
+    key_to_p2pkh_script,
+    key_to_p2wpkh_script,
+    script_to_p2sh_script,
+)
+from test_framework.test_framework import BitcoinTestFramework
+from test_framework.util import (
+    assert_equal,
+)
+from test_framework.wallet import MiniWallet
+
+
+class UtxoIndexTest(BitcoinTestFramework):
+    def set_test_params(self):
+        self.num_nodes = 1
+        self.setup_clean_chain = True
+
+    def utxo_index(self, *args, check=True):
+        base_dir = self.config["environment"]["SRCDIR"]
+        utxo_index_path = os.path.join(base_dir, "contrib", "utxo-tools", "utxo_index.py")
+        return subprocess.run([sys.executable, utxo_index_path] + list(args), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, check=check)
+
+    def lookup(self, *args):
+        result = self.utxo_index("lookup", self.snapshot, *args, check=False)
+        return [json.loads(line) for line in result.stdout.splitlines()]
+
+    def run_test(self):
+        node = self.nodes[0]
+        wallet = MiniWallet(node)
+        self.generate(wallet, 110)
+        key = ECKey()
+
+        self.log.info('Create UTXOs with various output script types')
+        key.generate(compressed=False)
+        uncompressed_pubkey = key.get_pubkey().get_bytes()
+        key.generate(compressed=True)
+        pubkey = key.get_pubkey().get_bytes()
+        output_scripts = (
+            key_to_p2pkh_script(pubkey),
+            script_to_p2sh_script(key_to_p2pkh_script(pubkey)),
+            key_to_p2pk_script(pubkey),
+            key_to_p2pk_script(uncompressed_pubkey),
+            key_to_p2wpkh_script(pubkey),
+        )
+        sent = []
+        spent_outpoints = []
+        for output_script in output_scripts:
+            for amount in (1, 2):
+                tx = wallet.send_to(from_node=node, scriptPubKey=output_script, amount=amount * COIN)
+                sent.append((tx["txid"], tx["sent_vout"], output_script))
+                spent_outpoints.append(tx["tx"].vin[0].prevout)
+        self.generate(wallet, 1)
+
+        self.log.info('Dump UTXO set and build the index')
+        self.snapshot = os.path.join(self.options.tmpdir, "utxos.dat")
+        node.dumptxoutset(self.snapshot, "latest")
+        self.utxo_index("build", self.snapshot, "--spk")
+
+        self.log.info('Look up coins by outpoint and by txid')
+        for txid, vout, output_script in sent:
+            txout = node.gettxout(txid, vout)
+            coins = self.lookup("--outpoint", f"{txid}:{vout}")
+            assert_equal(len(coins), 1)
+            assert_equal(coins[0]["value"], int(txout["value"] * COIN))
+            assert_equal(coins[0]["scriptpubkey"], output_script.hex())
+            assert_equal(coins[0]["height"], node.getblockcount())
+            assert_equal(coins[0]["coinbase"], 0)
+            unspent_vouts = [n for n in (0, 1) if node.gettxout(txid, n) is not None]
+            assert_equal(sorted(coin["vout"] for coin in self.lookup("--txid", txid)), unspent_vouts)
+        for outpoint in spent_outpoints:
+            assert_equal(self.lookup("--outpoint", f"{outpoint.hash:064x}:{outpoint.n}"), [])
+
+        self.log.info('Look up coins by scriptPubKey')
+        for output_script in output_scripts:
+            coins = self.lookup("--spk", output_script.hex())
+            assert_equal(sorted((coin["txid"], coin["vout"]) for coin in coins),
+                         sorted((txid, vout) for txid, vout, script in sent if script == output_script))
+
+        self.log.info('Check that a stale index is rejected')
+        self.generate(wallet, 1)
+        os.remove(self.snapshot)
+        node.dumptxoutset(self.snapshot, "latest")
+        result = self.utxo_index("lookup", self.snapshot, "--txid", sent[0][0], check=False)
+        assert_equal(result.returncode, 1)
+        assert "index was built for a different snapshot" in result.stdout
+
+
+if __name__ == "__main__":
+    UtxoIndexTest(__file__).main()
@@ -4,6 +4,7 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 """Test utxo-to-sqlite conversion tool"""
 from itertools import product
+import json
 import os
 import platform
 try:
@@ -73,6 +74,33 @@ def calculate_muhash_from_sqlite_utxos(filename, txid_format, spk_format):
     return muhash.digest()[::-1].hex()
 
 
+def calculate_muhash_from_columnar_utxos(dirname):
+    muhash = MuHash3072()
+    with open(os.path.join(dirname, "metadata.json"), "r") as f:
+        num_coins = json.load(f)["num_coins"]
+    columns = {}
+    for name in ("txid", "vout", "value", "coinbase", "height", "scriptpubkey_offset", "scriptpubkey"):
+        with open(os.path.join(dirname, name), "rb") as f:
+            columns[name] = f.read()
+    assert_equal(len(columns["txid"]), 32 * num_coins)
+    assert_equal(len(columns["scriptpubkey_offset"]), 8 * (num_coins + 1))
+    for i in range(num_coins):
+        txid_bytes = columns["txid"][32*i:32*(i+1)][::-1]  # stored as rawle by default
+        vout = int.from_bytes(columns["vout"][4*i:4*(i+1)], 'little')
+        value = int.from_bytes(columns["value"][8*i:8*(i+1)], 'little', signed=True)
+        coinbase = columns["coinbase"][i]
+        height = int.from_bytes(columns["height"][4*i:4*(i+1)], 'little')
+        spk_start = int.from_bytes(columns["scriptpubkey_offset"][8*i:8*(i+1)], 'little')
+        spk_end = int.from_bytes(columns["scriptpubkey_offset"][8*(i+1):8*(i+2)], 'little')
+        spk_bytes = columns["scriptpubkey"][spk_start:spk_end]
+
+        utxo_ser = COutPoint(uint256_from_str(txid_bytes), vout).serialize()
+        utxo_ser += (height * 2 + coinbase).to_bytes(4, 'little')
+        utxo_ser += CTxOut(value, spk_bytes).serialize()
+        muhash.insert(utxo_ser)
+    return muhash.digest()[::-1].hex()
+
+
 class UtxoToSqliteTest(BitcoinTestFramework):
     def set_test_params(self):
         self.num_nodes = 1
@@ -136,6 +164,20 @@ class UtxoToSqliteTest(BitcoinTestFramework):
             assert_equal(muhash_sqlite, muhash_compact_serialized)
             self.log.info('')
 
+        self.log.info('Test utxo-to-sqlite script with indexes created after loading')
+        output_filename = os.path.join(self.options.tmpdir, "utxos_indexed.sqlite")
+        subprocess.run([sys.executable, utxo_to_sqlite_path, input_filename, output_filename, '--index'], check=True, stderr=subprocess.STDOUT)
+        assert_equal(calculate_muhash_from_sqlite_utxos(output_filename, "hex", "hex"), muhash_compact_serialized)
+        con = sqlite3.connect(output_filename)
+        indexes = {name for (name,) in con.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        con.close()
+        assert_equal(indexes, {"utxos_txid_vout", "utxos_scriptpubkey"})
+
+        self.log.info('Test utxo-to-sqlite script with columnar output')
+        output_dirname = os.path.join(self.options.tmpdir, "utxos_columnar")
+        subprocess.run([sys.executable, utxo_to_sqlite_path, input_filename, output_dirname, '--format=columnar'], check=True, stderr=subprocess.STDOUT)
+        assert_equal(calculate_muhash_from_columnar_utxos(output_dirname), muhash_compact_serialized)
+
         if platform.system() != "Windows":  # FIFOs are not available on Windows
             self.log.info('Convert UTXO set directly (without intermediate dump) via named pipe')
             fifo_filename = os.path.join(self.options.tmpdir, "utxos.fifo")
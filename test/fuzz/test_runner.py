@@ -6,14 +6,30 @@
 """
 
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 from pathlib import Path
 import argparse
 import configparser
+import hashlib
+import json
 import logging
+import math
 import os
 import random
+import re
 import subprocess
 import sys
+import tempfile
+import time
+
+# Upper bound for the number of inputs passed to a single libFuzzer process on
+# the command line with --input_timing, to stay clear of ARG_MAX.
+MAX_INPUTS_PER_COMMAND = 2000
+# Number of slowest inputs to list with --input_timing.
+SLOWEST_INPUTS = 20
+# Directory in the corpus_dir holding, per target, the hashes of all inputs
+# already merged into (or rejected from) the target's corpus.
+MERGE_CACHE_DIR = ".merge_cache"
 
 
 def get_fuzz_env(*, target, source_dir):
@@ -64,6 +80,29 @@ def main():
         default=4,
         help='How many targets to merge or execute in parallel.',
     )
+    parser.add_argument(
+        '--timing_file',
+        help='File to keep the runtime history of the targets in, used to schedule the longest'
+             ' running targets first and to shard them. Defaults to fuzz_timings.json in the build directory.',
+    )
+    parser.add_argument(
+        '--shard_time',
+        type=float,
+        default=60,
+        help='Split the corpus of a target into shards that run as separate jobs, if running it is expected'
+             ' to take longer than this many seconds according to the runtime history. 0 disables sharding.',
+    )
+    parser.add_argument(
+        '--input_timing',
+        action='store_true',
+        help='Time each input separately and report the slowest ones (requires libFuzzer).',
+    )
+    parser.add_argument(
+        '--slow_input_ms',
+        type=int,
+        default=1000,
+        help='With --input_timing, flag inputs that take at least this many milliseconds.',
+    )
     parser.add_argument(
         'corpus_dir',
         help='The corpus to run on (must contain subfolders for each fuzz target).',
@@ -78,6 +117,11 @@ def main():
         action="append",
         help="Merge inputs from these directories into the corpus_dir.",
     )
+    parser.add_argument(
+        '--no_merge_cache',
+        action='store_true',
+        help="With --m_dir, ignore the cache of inputs that were already merged and consider all inputs again.",
+    )
     parser.add_argument(
         '-g',
         '--generate',
@@ -164,7 +208,7 @@ def main():
     ).stderr
     using_libfuzzer = "libFuzzer" in help_output
     print(using_libfuzzer)
-    if (args.generate or args.m_dir) and not using_libfuzzer:
+    if (args.generate or args.m_dir or args.input_timing) and not using_libfuzzer:
         logging.error("Must be built with libFuzzer")
         sys.exit(1)
 
@@ -186,6 +230,7 @@ def main():
                 src_dir=config['environment']['SRCDIR'],
                 fuzz_bin=fuzz_bin,
                 merge_dirs=[Path(m_dir) for m_dir in args.m_dir],
+                use_cache=not args.no_merge_cache,
             )
             return
 
@@ -198,6 +243,10 @@ def main():
             using_libfuzzer=using_libfuzzer,
             use_valgrind=args.valgrind,
             empty_min_time=args.empty_min_time,
+            timing_file=Path(args.timing_file or os.path.join(config["environment"]["BUILDDIR"], "fuzz_timings.json")),
+            shard_time=args.shard_time,
+            input_timing=args.input_timing,
+            slow_input_ms=args.slow_input_ms,
         )
 
 
@@ -285,33 +334,78 @@ def generate_corpus(*, fuzz_pool, src_dir, fuzz_bin, corpus_dir, targets):
         future.result()
 
 
-def merge_inputs(*, fuzz_pool, corpus, test_list, src_dir, fuzz_bin, merge_dirs):
+def hash_inputs(path):
+    """Return a dict mapping the content hash of each input in path to its file."""
+    inputs = {}
+    for p in sorted(path.rglob("*")):
+        if p.is_file():
+            inputs[hashlib.sha256(p.read_bytes()).hexdigest()] = p
+    return inputs
+
+
+def load_merge_cache(cache_file):
+    try:
+        return set(cache_file.read_text(encoding="utf8").split())
+    except FileNotFoundError:
+        return set()
+
+
+def save_merge_cache(cache_file, hashes):
+    cache_file.parent.mkdir(exist_ok=True)
+    tmp_file = cache_file.with_name(cache_file.name + ".tmp")
+    tmp_file.write_text("".join(f"{h}\n" for h in sorted(hashes)), encoding="utf8")
+    os.replace(tmp_file, cache_file)
+
+
+def merge_inputs(*, fuzz_pool, corpus, test_list, src_dir, fuzz_bin, merge_dirs, use_cache):
+    """Merge the inputs of merge_dirs into the corpus.
+
+    Only inputs whose content is neither in the target's corpus nor in its merge
+    cache are passed to libFuzzer, and targets without such inputs are skipped.
+    Afterwards, all considered inputs are added to the merge cache, including
+    the ones that were not merged because they add no coverage.
+    """
     logging.info(f"Merge the inputs from the passed dir into the corpus_dir. Passed dirs {merge_dirs}")
-    jobs = []
-    for t in test_list:
-        args = [
-            fuzz_bin,
-            '-rss_limit_mb=8000',
-            '-set_cover_merge=1',
-            # set_cover_merge is used instead of -merge=1 to reduce the overall
-            # size of the qa-assets git repository a bit, but more importantly,
-            # to cut the runtime to iterate over all fuzz inputs [0].
-            # [0] https://github.com/bitcoin-core/qa-assets/issues/130#issuecomment-1761760866
-            '-shuffle=0',
-            '-prefer_small=1',
-            '-use_value_profile=0',
-            # use_value_profile is enabled by oss-fuzz [0], but disabled for
-            # now to avoid bloating the qa-assets git repository [1].
-            # [0] https://github.com/google/oss-fuzz/issues/1406#issuecomment-387790487
-            # [1] https://github.com/bitcoin-core/qa-assets/issues/130#issuecomment-1749075891
-            os.path.join(corpus, t),
-        ] + [str(m_dir / t) for m_dir in merge_dirs]
-        os.makedirs(os.path.join(corpus, t), exist_ok=True)
+
+    def job(t):
+        corpus_path = corpus / t
+        corpus_path.mkdir(parents=True, exist_ok=True)
+        cache_file = corpus / MERGE_CACHE_DIR / t
+        known = load_merge_cache(cache_file) if use_cache else set()
+        known |= hash_inputs(corpus_path).keys()
+        new_inputs = {}
         for m_dir in merge_dirs:
             (m_dir / t).mkdir(exist_ok=True)
+            for h, path in hash_inputs(m_dir / t).items():
+                if h not in known:
+                    new_inputs.setdefault(h, path)
+        if not new_inputs:
+            logging.debug(f"Skip {t}, no new inputs to merge")
+            save_merge_cache(cache_file, known)
+            return
 
-        def job(t, args):
-            output = 'Run {} with args {}\n'.format(t, " ".join(args))
+        with tempfile.TemporaryDirectory(prefix=f"fuzz_merge_{t}_") as new_dir:
+            for h, path in new_inputs.items():
+                (Path(new_dir) / h).symlink_to(path.resolve())
+            args = [
+                fuzz_bin,
+                '-rss_limit_mb=8000',
+                '-set_cover_merge=1',
+                # set_cover_merge is used instead of -merge=1 to reduce the overall
+                # size of the qa-assets git repository a bit, but more importantly,
+                # to cut the runtime to iterate over all fuzz inputs [0].
+                # [0] https://github.com/bitcoin-core/qa-assets/issues/130#issuecomment-1761760866
+                '-shuffle=0',
+                '-prefer_small=1',
+                '-use_value_profile=0',
+                # use_value_profile is enabled by oss-fuzz [0], but disabled for
+                # now to avoid bloating the qa-assets git repository [1].
+                # [0] https://github.com/google/oss-fuzz/issues/1406#issuecomment-387790487
+                # [1] https://github.com/bitcoin-core/qa-assets/issues/130#issuecomment-1749075891
+                str(corpus_path),
+                new_dir,
+            ]
+            output = 'Run {} with {} new inputs and args {}\n'.format(t, len(new_inputs), " ".join(args))
             output += subprocess.run(
                 args,
                 env=get_fuzz_env(target=t, source_dir=src_dir),
@@ -320,65 +414,201 @@ def merge_inputs(*, fuzz_pool, corpus, test_list, src_dir, fuzz_bin, merge_dirs)
                 text=True,
             ).stderr
             logging.debug(output)
+        save_merge_cache(cache_file, known | new_inputs.keys())
 
-        jobs.append(fuzz_pool.submit(job, t, args))
-
+    jobs = [fuzz_pool.submit(job, t) for t in test_list]
     for future in as_completed(jobs):
         future.result()
 
 
-def run_once(*, fuzz_pool, corpus, test_list, src_dir, fuzz_bin, using_libfuzzer, use_valgrind, empty_min_time):
+def load_timings(timing_file):
+    """Return the runtime history, a dict mapping each target to the seconds it
+    took to run its corpus and the number of inputs in it."""
+    try:
+        with open(timing_file, encoding="utf8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable timing file {timing_file}: {e}")
+        return {}
+
+
+def save_timings(timing_file, timings):
+    tmp_file = timing_file.with_name(timing_file.name + ".tmp")
+    with open(tmp_file, "w", encoding="utf8") as f:
+        json.dump(timings, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, timing_file)
+
+
+@dataclass
+class FuzzJob:
+    target: str
+    inputs: list | None  # The corpus files to run, or None to run the whole corpus directory
+    num_inputs: int
+    shard: int = 0
+    shard_count: int = 1
+    estimate: float | None = None  # Expected runtime in seconds, None if unknown
+
+    @property
+    def name(self):
+        if self.shard_count == 1:
+            return self.target
+        return f"{self.target} [{self.shard + 1}/{self.shard_count}]"
+
+
+def plan_jobs(*, corpus, test_list, timings, shard_time, input_timing):
+    """Turn the targets into jobs, split corpora that are expected to take longer
+    than shard_time into shards, and order the jobs longest first. Targets
+    without runtime history are started before all others."""
     jobs = []
+    for t in test_list:
+        inputs = sorted(p for p in (corpus / t).rglob("*") if p.is_file())
+        estimate = None
+        history = timings.get(t)
+        if history:
+            estimate = history["seconds"]
+            if history["inputs"]:
+                estimate *= len(inputs) / history["inputs"]
+        shard_count = 1
+        if estimate and shard_time > 0:
+            shard_count = math.ceil(estimate / shard_time)
+        if input_timing:
+            shard_count = max(shard_count, math.ceil(len(inputs) / MAX_INPUTS_PER_COMMAND))
+        shard_count = max(1, min(shard_count, len(inputs)))
+        if shard_count == 1 and not (input_timing and inputs):
+            jobs.append(FuzzJob(target=t, inputs=None, num_inputs=len(inputs), estimate=estimate))
+            continue
+        for i in range(shard_count):
+            shard_inputs = inputs[i::shard_count]
+            jobs.append(FuzzJob(
+                target=t,
+                inputs=shard_inputs,
+                num_inputs=len(shard_inputs),
+                shard=i,
+                shard_count=shard_count,
+                estimate=None if estimate is None else estimate / shard_count,
+            ))
+    jobs.sort(key=lambda j: (j.estimate is not None, -(j.estimate or 0)))
+    return jobs
+
+
+def make_shard_dir(shard_root, fuzz_job, corpus_path):
+    """Create a directory with symlinks to the inputs of a shard."""
+    shard_dir = Path(shard_root) / f"{fuzz_job.target}_{fuzz_job.shard}"
+    shard_dir.mkdir()
+    for path in fuzz_job.inputs:
+        (shard_dir / str(path.relative_to(corpus_path)).replace(os.sep, "_")).symlink_to(path.resolve())
+    return shard_dir
+
+
+def run_once(*, fuzz_pool, corpus, test_list, src_dir, fuzz_bin, using_libfuzzer, use_valgrind, empty_min_time,
+             timing_file, shard_time, input_timing, slow_input_ms):
+    timings = load_timings(timing_file)
+    min_time_targets = []
+    run_targets = []
     for t in test_list:
         corpus_path = corpus / t
         os.makedirs(corpus_path, exist_ok=True)
-        args = [
-            fuzz_bin,
-        ]
         empty_dir = not any(corpus_path.iterdir())
-        if using_libfuzzer:
-            if empty_min_time and empty_dir:
-                args += [f"-max_total_time={empty_min_time}"]
-            else:
-                args += [
-                    "-runs=1",
-                    corpus_path,
-                ]
+        if using_libfuzzer and empty_min_time and empty_dir:
+            min_time_targets.append(t)
         else:
-            args += [corpus_path]
-        if use_valgrind:
-            args = ['valgrind', '--quiet', '--error-exitcode=1'] + args
-
-        def job(t, args):
-            output = 'Run {} with args {}'.format(t, args)
-            result = subprocess.run(
-                args,
-                env=get_fuzz_env(target=t, source_dir=src_dir),
-                stderr=subprocess.PIPE,
-                text=True,
-            )
-            output += result.stderr
-            return output, result, t
-
-        jobs.append(fuzz_pool.submit(job, t, args))
+            run_targets.append(t)
+    jobs = [FuzzJob(target=t, inputs=None, num_inputs=0) for t in min_time_targets]
+    jobs += plan_jobs(
+        corpus=corpus,
+        test_list=run_targets,
+        timings=timings,
+        shard_time=shard_time,
+        input_timing=input_timing,
+    )
 
-    stats = []
-    for future in as_completed(jobs):
-        output, result, target = future.result()
-        logging.debug(output)
-        try:
-            result.check_returncode()
-        except subprocess.CalledProcessError as e:
-            if e.stdout:
-                logging.info(e.stdout)
-            if e.stderr:
-                logging.info(e.stderr)
-            logging.info(f"⚠️ Failure generated from target with exit code {e.returncode}: {result.args}")
-            sys.exit(1)
-        if using_libfuzzer:
-            done_stat = [l for l in output.splitlines() if "DONE" in l]
-            assert len(done_stat) == 1
-            stats.append((target, done_stat[0]))
+    def job(fuzz_job, args):
+        output = 'Run {} with args {}'.format(fuzz_job.name, args)
+        start = time.monotonic()
+        result = subprocess.run(
+            args,
+            env=get_fuzz_env(target=fuzz_job.target, source_dir=src_dir),
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        output += result.stderr
+        return output, result, fuzz_job, time.monotonic() - start
+
+    with tempfile.TemporaryDirectory(prefix="fuzz_shards_") as shard_root:
+        futures = []
+        repro_args = {}
+        for fuzz_job in jobs:
+            run_path = corpus / fuzz_job.target
+            if fuzz_job.inputs is not None and not input_timing:
+                run_path = make_shard_dir(shard_root, fuzz_job, run_path)
+            args = [
+                fuzz_bin,
+            ]
+            if using_libfuzzer:
+                if fuzz_job.target in min_time_targets:
+                    args += [f"-max_total_time={empty_min_time}"]
+                elif fuzz_job.inputs is not None and input_timing:
+                    # Passing the inputs as files makes libFuzzer report the
+                    # execution time of each of them.
+                    args += ["-print_final_stats=1"] + fuzz_job.inputs
+                else:
+                    args += [
+                        "-runs=1",
+                        run_path,
+                    ]
+            else:
+                args += [run_path]
+            if use_valgrind:
+                args = ['valgrind', '--quiet', '--error-exitcode=1'] + args
+
+            future = fuzz_pool.submit(job, fuzz_job, args)
+            futures.append(future)
+            repro_args[future] = args
+            if run_path != corpus / fuzz_job.target:
+                # The shard directory is removed on exit, so a failing shard is
+                # reported with the paths of its inputs in the corpus instead.
+                i = args.index(run_path)
+                repro_args[future] = args[:i] + fuzz_job.inputs + args[i + 1:]
+
+        stats = []
+        input_times = []
+        runtimes = {}
+        for future in as_completed(futures):
+            output, result, fuzz_job, runtime = future.result()
+            logging.debug(output)
+            try:
+                result.check_returncode()
+            except subprocess.CalledProcessError as e:
+                if e.stdout:
+                    logging.info(e.stdout)
+                if e.stderr:
+                    logging.info(e.stderr)
+                logging.info(f"⚠️ Failure generated from target with exit code {e.returncode}: {repro_args[future]}")
+                sys.exit(1)
+            if fuzz_job.target not in min_time_targets:
+                seconds, inputs = runtimes.get(fuzz_job.target, (0, 0))
+                runtimes[fuzz_job.target] = (seconds + runtime, inputs + fuzz_job.num_inputs)
+            if using_libfuzzer and input_timing and fuzz_job.inputs is not None:
+                executed = [(int(m[2]), fuzz_job.target, m[1]) for m in re.finditer(r"^Executed (.+) in (\d+) ms$", output, re.MULTILINE)]
+                assert len(executed) == len(fuzz_job.inputs)
+                input_times += executed
+                peak_rss = re.search(r"^stat::peak_rss_mb:\s*(\d+)", output, re.MULTILINE)
+                stats.append((fuzz_job.name, "{} inputs in {} ms, slowest {} ms, peak rss {} MB".format(
+                    len(executed), sum(e[0] for e in executed), max(e[0] for e in executed),
+                    peak_rss[1] if peak_rss else "?")))
+            elif using_libfuzzer:
+                done_stat = [l for l in output.splitlines() if "DONE" in l]
+                assert len(done_stat) == 1
+                stats.append((fuzz_job.name, done_stat[0]))
+
+    for t, (seconds, inputs) in runtimes.items():
+        timings[t] = {"seconds": round(seconds, 3), "inputs": inputs}
+    try:
+        save_timings(timing_file, timings)
+    except OSError as e:
+        logging.warning(f"Could not write timing file {timing_file}: {e}")
 
     if using_libfuzzer:
         print("Summary:")
@@ -387,6 +617,14 @@ def run_once(*, fuzz_pool, corpus, test_list, src_dir, fuzz_bin, using_libfuzzer
             t = t.ljust(max_len + 1)
             print(f"{t}{s}")
 
+    if input_times:
+        input_times.sort(reverse=True)
+        slow = [i for i in input_times if i[0] >= slow_input_ms]
+        print(f"Slowest inputs ({len(slow)} of {len(input_times)} took at least {slow_input_ms} ms):")
+        for ms, target, path in input_times[:max(SLOWEST_INPUTS, len(slow))]:
+            flag = " ⚠️" if ms >= slow_input_ms else ""
+            print(f"{ms:>8} ms {target} {path}{flag}")
+
 
 def parse_test_list(*, fuzz_bin, source_dir):
     test_list_all = subprocess.run(
@@ -5,9 +5,13 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import contextlib
 from fnmatch import fnmatch
+from functools import partial
 import hashlib
+import http.server
+import io
 import os
 from pathlib import Path
 import platform
@@ -15,13 +19,23 @@ import re
 import shutil
 import subprocess
 import sys
+import tarfile
+import tempfile
+import threading
 import time
+import unittest
+from unittest import mock
 import zipfile
 
 sys.path.append(str(Path(__file__).resolve().parent))
 from download_utils import download_from_url
 
 TAR = os.getenv('TAR', 'tar')
+DEFAULT_BASE_URL = 'https://bitcoincore.org'
+DEFAULT_CACHE_DIR = Path(os.getenv('XDG_CACHE_HOME', Path.home() / '.cache')) / 'bitcoin-previous-releases'
+# Written into a release directory after its archive was verified and
+# extracted, in the format of sha256sum
+VERIFIED_FILE = '.verified'
 
 SHA256_SUMS = {
     "0e2819135366f150d9906e294b61dff58fd1996ebd26c2f8e979d6c0b7a79580": {"tag": "v0.14.3", "archive": "bitcoin-0.14.3-aarch64-linux-gnu.tar.gz"},
@@ -104,13 +118,8 @@ def pushd(new_dir) -> None:
         os.chdir(previous_dir)
 
 
-def download_binary(tag, args) -> int:
-    if Path(tag).is_dir():
-        if not args.remove_dir:
-            print('Using cached {}'.format(tag))
-            return 0
-        shutil.rmtree(tag)
-
+def release_archive(tag, host):
+    """Return the directory of the release on the server, and the archive name."""
     bin_path = 'bin/bitcoin-core-{}'.format(tag[1:])
 
     match = re.compile('v(.*)(rc[0-9]+)$').search(tag)
@@ -118,7 +127,6 @@ def download_binary(tag, args) -> int:
         bin_path = 'bin/bitcoin-core-{}/test.{}'.format(
             match.group(1), match.group(2))
 
-    host = args.host
     if tag < "v23" and host in ["x86_64-apple-darwin", "arm64-apple-darwin"]:
         host = "osx64"
 
@@ -126,66 +134,129 @@ def download_binary(tag, args) -> int:
     if host == 'win64':
         archive_format = 'zip'
 
-    archive = f'bitcoin-{tag[1:]}-{host}.{archive_format}'
-    archive_url = f'https://bitcoincore.org/{bin_path}/{archive}'
+    return bin_path, f'bitcoin-{tag[1:]}-{host}.{archive_format}'
+
+
+def hash_file(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def fetch_archive(archive_url, archive, expected_hash, args):
+    """Download the archive, or take it from the cache of verified archives.
+
+    Return the path of the archive, or None on failure. The checksum is
+    computed while downloading, and cached archives are hashed again before
+    they are used.
+    """
+    if args.cache_dir:
+        cached = Path(args.cache_dir) / expected_hash
+        if cached.is_file():
+            if hash_file(cached) == expected_hash:
+                print(f"Using cached archive {archive}")
+                return cached
+            print(f"Removing corrupted cached archive {cached}", file=sys.stderr)
+            cached.unlink(missing_ok=True)
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        download_path = cached.with_name(f'{expected_hash}.{os.getpid()}.tmp')
+    else:
+        download_path = Path(archive)
 
     try:
-        download_from_url(archive_url, archive)
+        archive_hash = download_from_url(archive_url, download_path, progress=args.jobs == 1)
     except Exception as e:
         print(f"\nDownload failed: {e}", file=sys.stderr)
         print("Retrying download after failure ...", file=sys.stderr)
         time.sleep(12)
         try:
-            download_from_url(archive_url, archive)
+            archive_hash = download_from_url(archive_url, download_path, progress=args.jobs == 1)
         except Exception as e2:
             print(f"\nDownload failed a second time: {e2}", file=sys.stderr)
-            return 1
+            download_path.unlink(missing_ok=True)
+            return None
 
-    hasher = hashlib.sha256()
-    with open(archive, "rb") as afile:
-        hasher.update(afile.read())
-    archiveHash = hasher.hexdigest()
-
-    if archiveHash not in SHA256_SUMS or SHA256_SUMS[archiveHash]['archive'] != archive:
-        if archive in [v['archive'] for v in SHA256_SUMS.values()]:
-            print(f"Checksum {archiveHash} did not match", file=sys.stderr)
-        else:
-            print("Checksum for given version doesn't exist", file=sys.stderr)
-        return 1
+    if archive_hash != expected_hash:
+        print(f"Checksum {archive_hash} did not match", file=sys.stderr)
+        download_path.unlink()
+        return None
 
     print("Checksum matched")
-    Path(tag).mkdir()
+    if args.cache_dir:
+        os.replace(download_path, cached)
+        return cached
+    return download_path
 
-    # Extract archive
-    if host == 'win64':
+
+def extract_archive(tag, archive, archive_path, target) -> int:
+    target.mkdir()
+    if archive.endswith('.zip'):
         try:
-            with zipfile.ZipFile(archive, 'r') as zip:
-                zip.extractall(tag)
+            with zipfile.ZipFile(archive_path, 'r') as zip:
+                zip.extractall(target)
             # Remove the top level directory to match tar's --strip-components=1
-            extracted_items = os.listdir(tag)
-            top_level_dir = os.path.join(tag, extracted_items[0])
+            extracted_items = os.listdir(target)
+            top_level_dir = os.path.join(target, extracted_items[0])
             # Move all files & subdirectories up one level
             for item in os.listdir(top_level_dir):
-                shutil.move(os.path.join(top_level_dir, item), tag)
+                shutil.move(os.path.join(top_level_dir, item), target)
             # Remove the now-empty top-level directory
             os.rmdir(top_level_dir)
         except Exception as e:
             print(f"Zip extraction failed: {e}", file=sys.stderr)
             return 1
     else:
-        ret = subprocess.run([TAR, '-zxf', archive, '-C', tag,
+        ret = subprocess.run([TAR, '-zxf', archive_path, '-C', target,
                               '--strip-components=1',
                               'bitcoin-{tag}'.format(tag=tag[1:])]).returncode
         if ret != 0:
             print(f"Failed to extract the {tag} tarball", file=sys.stderr)
             return ret
+    return 0
+
 
-    Path(archive).unlink()
+def download_binary(tag, args) -> int:
+    bin_path, archive = release_archive(tag, args.host)
+    expected_hash = {v['archive']: h for h, v in SHA256_SUMS.items()}.get(archive)
+    if expected_hash is None:
+        print("Checksum for given version doesn't exist", file=sys.stderr)
+        return 1
+    verified = f"{expected_hash}  {archive}\n"
+
+    if Path(tag).is_dir():
+        verified_file = Path(tag) / VERIFIED_FILE
+        if not args.remove_dir:
+            if not verified_file.is_file():
+                # Not extracted by this script, leave it alone
+                print('Using cached {}'.format(tag))
+                return 0
+            if verified_file.read_text() == verified:
+                print('Using cached {} (verified {})'.format(tag, archive))
+                return 0
+        shutil.rmtree(tag)
+
+    archive_url = f'{args.base_url}/{bin_path}/{archive}'
+    archive_path = fetch_archive(archive_url, archive, expected_hash, args)
+    if archive_path is None:
+        return 1
+
+    # Extract next to the final directory and rename it once complete, so
+    # that an interrupted run does not leave a partial release behind.
+    partial_dir = Path(f'{tag}.partial')
+    if partial_dir.exists():
+        shutil.rmtree(partial_dir)
+    ret = extract_archive(tag, archive, archive_path, partial_dir)
+    if not args.cache_dir:
+        archive_path.unlink()
+    if ret:
+        return ret
 
     if tag >= "v23" and tag < "v28.2" and args.host == "arm64-apple-darwin":
         # Starting with v23 there are arm64 binaries for ARM (e.g. M1, M2) mac.
         # Until v28.2 they had to be signed to run.
-        binary_path = f'{os.getcwd()}/{tag}/bin/'
+        binary_path = f'{os.getcwd()}/{partial_dir}/bin/'
 
         for arm_binary in os.listdir(binary_path):
             # Is it already signed?
@@ -210,6 +281,8 @@ def download_binary(tag, args) -> int:
                     print(f"Failed to verify the self-signed {tag} {arm_binary} arm64 binary", file=sys.stderr)
                     return 1
 
+    (partial_dir / VERIFIED_FILE).write_text(verified)
+    partial_dir.rename(tag)
     return 0
 
 
@@ -220,8 +293,8 @@ def set_host(args) -> int:
             return 1
         args.host = 'win64'
         return 0
-    host = os.environ.get('HOST', subprocess.check_output(
-        './depends/config.guess').decode())
+    host = os.environ.get('HOST') or subprocess.check_output(
+        './depends/config.guess').decode()
     platforms = {
         'aarch64-*-linux*': 'aarch64-linux-gnu',
         'powerpc64le-*-linux-*': 'powerpc64le-linux-gnu',
@@ -246,15 +319,13 @@ def main(args) -> int:
     ret = set_host(args)
     if ret:
         return ret
-    with pushd(args.target_dir):
-        for tag in args.tags:
-            ret = download_binary(tag, args)
-            if ret:
-                return ret
-    return 0
+    tags = list(dict.fromkeys(args.tags))
+    with pushd(args.target_dir), ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        results = list(pool.map(partial(download_binary, args=args), tags))
+    return next((ret for ret in results if ret), 0)
 
 
-if __name__ == '__main__':
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
         epilog='''
@@ -266,11 +337,110 @@ if __name__ == '__main__':
                         help='remove existing directory.')
     parser.add_argument('-t', '--target-dir', action='store',
                         help='target directory.', default='releases')
+    parser.add_argument('-j', '--jobs', type=int, default=4,
+                        help='number of releases to download and extract concurrently.')
+    parser.add_argument('--cache-dir', default=os.getenv('PREVIOUS_RELEASES_CACHE_DIR', DEFAULT_CACHE_DIR),
+                        help='directory of verified archives, named by their hash and shared between '
+                        'target directories (default can be set with PREVIOUS_RELEASES_CACHE_DIR).')
+    parser.add_argument('--no-cache', dest='cache_dir', action='store_const', const=None,
+                        help='do not keep the downloaded archives.')
+    parser.add_argument('--base-url', default=DEFAULT_BASE_URL,
+                        help='server to download the releases from.')
     all_tags = sorted([*set([v['tag'] for v in SHA256_SUMS.values()])])
     parser.add_argument('tags', nargs='*', default=all_tags,
                         help='release tags. e.g.: v0.18.1 v0.20.0rc2 '
                         '(if not specified, the full list needed for '
                         'backwards compatibility tests will be used)'
                         )
-    args = parser.parse_args()
-    sys.exit(main(args))
+    return parser.parse_args(argv)
+
+
+class TestGetPreviousReleases(unittest.TestCase):
+    """Run with: cd test && python3 -m unittest get_previous_releases"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.root = Path(self.tmp_dir.name)
+        self.requests = []
+        test = self
+
+        class Handler(http.server.SimpleHTTPRequestHandler):
+            def log_message(self, format, *args):
+                test.requests.append(self.path)
+
+        server_dir = self.root / 'server'
+        server_dir.mkdir()
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), partial(Handler, directory=str(server_dir)))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        # Stand-in releases and their checksums
+        sums = {}
+        for tag in ['v1.0.0', 'v2.0.0rc1']:
+            bin_path, archive = release_archive(tag, 'x86_64-linux-gnu')
+            (server_dir / bin_path).mkdir(parents=True)
+            with tarfile.open(server_dir / bin_path / archive, 'w:gz') as tar:
+                data = f'bitcoind {tag}'.encode()
+                info = tarfile.TarInfo(f'bitcoin-{tag[1:]}/bin/bitcoind')
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+            sums[hashlib.sha256((server_dir / bin_path / archive).read_bytes()).hexdigest()] = {'tag': tag, 'archive': archive}
+        self.server_dir = server_dir
+        for patch in [mock.patch.dict(SHA256_SUMS, sums, clear=True), mock.patch.dict(os.environ, {'HOST': 'x86_64-pc-linux-gnu'})]:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def run_main(self, *argv):
+        base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        args = parse_args(['--cache-dir', str(self.root / 'cache'), '--base-url', base_url, *argv])
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            return main(args)
+
+    def test_download(self):
+        target = self.root / 'releases'
+        self.assertEqual(self.run_main('-t', str(target)), 0)
+        self.assertEqual((target / 'v2.0.0rc1' / 'bin' / 'bitcoind').read_text(), 'bitcoind v2.0.0rc1')
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(sorted(os.listdir(target)), ['v1.0.0', 'v2.0.0rc1'])
+        self.assertEqual(len(os.listdir(self.root / 'cache')), 2)
+
+        # Warm runs use the verified directories, or the cached archives for
+        # other target directories, without downloading again.
+        self.assertEqual(self.run_main('-t', str(target)), 0)
+        self.assertEqual(self.run_main('-t', str(self.root / 'other')), 0)
+        self.assertEqual(self.run_main('-t', str(target), '--remove-dir', 'v1.0.0'), 0)
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual((self.root / 'other' / 'v1.0.0' / 'bin' / 'bitcoind').read_text(), 'bitcoind v1.0.0')
+
+        # A directory of another archive is replaced
+        (target / 'v1.0.0' / VERIFIED_FILE).write_text('other')
+        self.assertEqual(self.run_main('-t', str(target), 'v1.0.0'), 0)
+        self.assertEqual((target / 'v1.0.0' / VERIFIED_FILE).read_text().split(), [*SHA256_SUMS.keys()][:1] + [release_archive('v1.0.0', 'x86_64-linux-gnu')[1]])
+
+    def test_bad_checksum(self):
+        bin_path, archive = release_archive('v1.0.0', 'x86_64-linux-gnu')
+        (self.server_dir / bin_path / archive).write_bytes(b'corrupted')
+        target = self.root / 'releases'
+        self.assertEqual(self.run_main('--no-cache', '-t', str(target)), 1)
+        self.assertEqual(os.listdir(target), ['v2.0.0rc1'])
+        self.assertFalse((self.root / 'cache').exists())
+        self.assertEqual(self.run_main('-t', str(target), 'v1.0.0'), 1)
+        self.assertEqual(os.listdir(self.root / 'cache'), [])
+        self.assertEqual(self.run_main('-t', str(target), 'v3.0.0'), 1)
+
+    def test_corrupted_cache(self):
+        self.assertEqual(self.run_main('-t', str(self.root / 'releases')), 0)
+        self.assertEqual(len(self.requests), 2)
+        # A cached archive that does not match its hash is downloaded again
+        corrupted = self.root / 'cache' / [*SHA256_SUMS.keys()][0]
+        corrupted.write_bytes(b'corrupted')
+        self.assertEqual(self.run_main('-t', str(self.root / 'other')), 0)
+        self.assertEqual(len(self.requests), 3)
+        self.assertEqual(hash_file(corrupted), [*SHA256_SUMS.keys()][0])
+        self.assertEqual((self.root / 'other' / 'v1.0.0' / 'bin' / 'bitcoind').read_text(), 'bitcoind v1.0.0')
+
+
+if __name__ == '__main__':
+    sys.exit(main(parse_args()))
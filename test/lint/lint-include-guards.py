@@ -10,9 +10,9 @@ Check include guards.
 
 import re
 import sys
-from subprocess import check_output
 
 from lint_ignore_dirs import SHARED_EXCLUDED_SUBTREES
+from lint_source_tree import SourceFile, lint_main
 
 
 HEADER_ID_PREFIX = 'BITCOIN_'
@@ -24,19 +24,10 @@ EXCLUDE_FILES_WITH_PREFIX = ['contrib/devtools/bitcoin-tidy',
                              'src/test/fuzz/FuzzedDataProvider.h'] + SHARED_EXCLUDED_SUBTREES
 
 
-def _get_header_file_lst() -> list[str]:
-    """ Helper function to get a list of header filepaths to be
-        checked for include guards.
+def is_linted_file(path: str) -> bool:
+    """ Whether the file is a header to be checked for include guards.
     """
-    git_cmd_lst = ['git', 'ls-files', '--', '*.h']
-    header_file_lst = check_output(
-        git_cmd_lst, text=True).splitlines()
-
-    header_file_lst = [hf for hf in header_file_lst
-                       if not any(ef in hf for ef
-                                  in EXCLUDE_FILES_WITH_PREFIX)]
-
-    return header_file_lst
+    return path.endswith('.h') and not any(ef in path for ef in EXCLUDE_FILES_WITH_PREFIX)
 
 
 def _get_header_id(header_file: str) -> str:
@@ -61,36 +52,22 @@ def _get_header_id(header_file: str) -> str:
     return header_id
 
 
-def main():
-    exit_code = 0
-
-    header_file_lst = _get_header_file_lst()
-    for header_file in header_file_lst:
-        header_id = _get_header_id(header_file)
-
-        regex_pattern = f'^#(ifndef|define|endif //) {header_id}'
-
-        with open(header_file, 'r') as f:
-            header_file_contents = f.readlines()
-
-        count = 0
-        for header_file_contents_string in header_file_contents:
-            include_guard_lst = re.findall(
-                regex_pattern, header_file_contents_string)
+def lint_file(file: SourceFile) -> list[str]:
+    header_id = _get_header_id(file.path)
 
-            count += len(include_guard_lst)
+    regex_pattern = f'^#(ifndef|define|endif //) {header_id}'
 
-        if count != 3:
-            print(f'{header_file} seems to be missing the expected '
-                  'include guard to prevent the double inclusion problem:')
-            print(f'  #ifndef {header_id}')
-            print(f'  #define {header_id}')
-            print('  ...')
-            print(f'  #endif // {header_id}\n')
-            exit_code = 1
+    count = len(re.findall(regex_pattern, file.text, re.MULTILINE))
 
-    sys.exit(exit_code)
+    if count != 3:
+        return [f'{file.path} seems to be missing the expected '
+                'include guard to prevent the double inclusion problem:\n'
+                f'  #ifndef {header_id}\n'
+                f'  #define {header_id}\n'
+                '  ...\n'
+                f'  #endif // {header_id}\n']
+    return []
 
 
 if __name__ == '__main__':
-    main()
+    lint_main(sys.modules[__name__])
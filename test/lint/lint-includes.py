@@ -8,13 +8,13 @@
 # Guard against accidental introduction of new Boost dependencies.
 # Check includes: Check for duplicate includes. Enforce bracket syntax includes.
 
-import os
 import re
 import sys
 
 from subprocess import check_output, CalledProcessError
 
 from lint_ignore_dirs import SHARED_EXCLUDED_SUBTREES
+from lint_source_tree import SourceFile, SourceTree, lint_main
 
 
 EXCLUDED_DIRS = ["contrib/devtools/bitcoin-tidy/",
@@ -37,16 +37,12 @@ EXPECTED_BOOST_INCLUDES = [
                           ]
 
 
-def get_toplevel():
-    return check_output(["git", "rev-parse", "--show-toplevel"], text=True).rstrip("\n")
+def is_linted_file(path):
+    return path.endswith((".cpp", ".h"))
 
 
-def list_files_by_suffix(suffixes):
-    exclude_args = [":(exclude)" + dir for dir in EXCLUDED_DIRS]
-
-    files_list = check_output(["git", "ls-files", "src"] + exclude_args, text=True).splitlines()
-
-    return [file for file in files_list if file.endswith(suffixes)]
+def is_excluded(path):
+    return any(path.startswith(dir) for dir in EXCLUDED_DIRS)
 
 
 def find_duplicate_includes(include_list):
@@ -62,18 +58,6 @@ def find_duplicate_includes(include_list):
     return duplicates
 
 
-def find_included_cpps():
-    included_cpps = list()
-
-    try:
-        included_cpps = check_output(["git", "grep", "-E", r"^#include [<\"][^>\"]+\.cpp[>\"]", "--", "*.cpp", "*.h"], text=True).splitlines()
-    except CalledProcessError as e:
-        if e.returncode > 1:
-            raise e
-
-    return included_cpps
-
-
 def find_extra_boosts():
     included_boosts = list()
     filtered_included_boost_set = set()
@@ -98,85 +82,63 @@ def find_extra_boosts():
     return extra_boosts
 
 
-def find_quote_syntax_inclusions():
-    exclude_args = [":(exclude)" + dir for dir in EXCLUDED_DIRS]
-    quote_syntax_inclusions = list()
-
-    try:
-        quote_syntax_inclusions = check_output(["git", "grep", r"^#include \"", "--", "*.cpp", "*.h"] + exclude_args, text=True).splitlines()
-    except CalledProcessError as e:
-        if e.returncode > 1:
-            raise e
-
-    return quote_syntax_inclusions
-
-
-def main():
-    exit_code = 0
-
-    os.chdir(get_toplevel())
+def lint_file(file: SourceFile):
+    messages = []
+    lines = [line for line in file.text.split("\n") if line.startswith("#include")]
 
     # Check for duplicate includes
-    for filename in list_files_by_suffix((".cpp", ".h")):
-        with open(filename, "r") as file:
-            include_list = [line.rstrip("\n") for line in file if re.match(r"^#include", line)]
+    if file.path.startswith("src/") and not is_excluded(file.path):
+        include_list = [line for line in lines if re.match(r"^#include", line)]
 
         duplicates = find_duplicate_includes(include_list)
 
         if duplicates:
-            print(f"Duplicate include(s) in {filename}:")
-            for duplicate in duplicates:
-                print(duplicate)
-            print("")
-            exit_code = 1
+            messages.append(f"Duplicate include(s) in {file.path}:\n" + "".join(f"{duplicate}\n" for duplicate in duplicates))
 
     # Check if code includes .cpp-files
-    included_cpps = find_included_cpps()
+    included_cpps = [f"{file.path}:{line}" for line in lines if re.match(r"^#include [<\"][^>\"]+\.cpp[>\"]", line)]
 
     if included_cpps:
-        print("The following files #include .cpp files:")
-        for included_cpp in included_cpps:
-            print(included_cpp)
-        print("")
-        exit_code = 1
+        messages.append("The following files #include .cpp files:\n" + "".join(f"{included_cpp}\n" for included_cpp in included_cpps))
+
+    # Enforce bracket syntax includes
+    # *Rationale*: Bracket syntax is less ambiguous because the preprocessor
+    # searches a fixed list of include directories without taking location of the
+    # source file into account. This allows quoted includes to stand out more when
+    # the location of the source file actually is relevant.
+    if not is_excluded(file.path):
+        quote_syntax_inclusions = [f"{file.path}:{line}" for line in lines if re.match(r"^#include \"", line)]
+
+        if quote_syntax_inclusions:
+            messages.append("Please use bracket syntax includes (\"#include <foo.h>\") instead of quote syntax includes:\n" + "\n".join(quote_syntax_inclusions))
+
+    return messages
+
+
+def lint_tree(tree: SourceTree):
+    messages = []
 
     # Guard against accidental introduction of new Boost dependencies
     extra_boosts = find_extra_boosts()
 
-    if extra_boosts:
-        for boost in extra_boosts:
-            print(f"A new Boost dependency in the form of \"{boost}\" appears to have been introduced:")
-            print(check_output(["git", "grep", boost, "--", "*.cpp", "*.h"], text=True))
-        exit_code = 1
+    for boost in extra_boosts:
+        messages.append(f"A new Boost dependency in the form of \"{boost}\" appears to have been introduced:\n" +
+                        check_output(["git", "-C", tree.root, "grep", boost, "--", "*.cpp", "*.h"], text=True))
 
     # Check if Boost dependencies are no longer used
     for expected_boost in EXPECTED_BOOST_INCLUDES:
         try:
-            check_output(["git", "grep", "-q", r"^#include <%s>" % expected_boost, "--", "*.cpp", "*.h"], text=True)
+            check_output(["git", "-C", tree.root, "grep", "-q", r"^#include <%s>" % expected_boost, "--", "*.cpp", "*.h"], text=True)
         except CalledProcessError as e:
             if e.returncode > 1:
                 raise e
             else:
-                print(f"Good job! The Boost dependency \"{expected_boost}\" is no longer used. "
-                       "Please remove it from EXPECTED_BOOST_INCLUDES in test/lint/lint-includes.py "
-                       "to make sure this dependency is not accidentally reintroduced.\n")
-                exit_code = 1
-
-    # Enforce bracket syntax includes
-    quote_syntax_inclusions = find_quote_syntax_inclusions()
-    # *Rationale*: Bracket syntax is less ambiguous because the preprocessor
-    # searches a fixed list of include directories without taking location of the
-    # source file into account. This allows quoted includes to stand out more when
-    # the location of the source file actually is relevant.
-
-    if quote_syntax_inclusions:
-        print("Please use bracket syntax includes (\"#include <foo.h>\") instead of quote syntax includes:")
-        for quote_syntax_inclusion in quote_syntax_inclusions:
-            print(quote_syntax_inclusion)
-        exit_code = 1
+                messages.append(f"Good job! The Boost dependency \"{expected_boost}\" is no longer used. "
+                                "Please remove it from EXPECTED_BOOST_INCLUDES in test/lint/lint-includes.py "
+                                "to make sure this dependency is not accidentally reintroduced.\n")
 
-    sys.exit(exit_code)
+    return messages
 
 
 if __name__ == "__main__":
-    main()
+    lint_main(sys.modules[__name__])
@@ -38,9 +38,8 @@
 import re
 import sys
 
-from subprocess import check_output, CalledProcessError
-
 from lint_ignore_dirs import SHARED_EXCLUDED_SUBTREES
+from lint_source_tree import SourceFile, lint_main
 
 
 KNOWN_VIOLATIONS = [
@@ -209,45 +208,40 @@ LOCALE_DEPENDENT_FUNCTIONS = [
 ]
 
 
-def find_locale_dependent_function_uses():
-    regexp_locale_dependent_functions = "|".join(LOCALE_DEPENDENT_FUNCTIONS)
-    exclude_args = [":(exclude)" + excl for excl in REGEXP_EXTERNAL_DEPENDENCIES_EXCLUSIONS]
-    git_grep_command = ["git", "grep", "--extended-regexp", "[^a-zA-Z0-9_\\`'\"<>](" +  regexp_locale_dependent_functions + ")(_r|_s)?\\(", "--", "*.cpp", "*.h"] + exclude_args
-    git_grep_output = list()
+REGEXP_LOCALE_DEPENDENT_FUNCTIONS = re.compile("[^a-zA-Z0-9_\\`'\"<>](" + "|".join(LOCALE_DEPENDENT_FUNCTIONS) + ")(_r|_s)?\\(")
+REGEXP_IGNORE_KNOWN_VIOLATIONS = re.compile("|".join(KNOWN_VIOLATIONS))
+# Matching function calls by name first is much faster than searching for the
+# alternation of all locale dependent functions.
+REGEXP_FUNCTION_CALL = re.compile(r"\b(\w+)\(")
+LOCALE_DEPENDENT_CALLS = {f + suffix for f in LOCALE_DEPENDENT_FUNCTIONS for suffix in ["", "_r", "_s"]}
+
+FAILURE_HINT = """Unnecessary locale dependence can cause bugs that are very tricky to isolate and fix. Please avoid using locale-dependent functions if possible.
 
-    try:
-        git_grep_output = check_output(git_grep_command, text=True).splitlines()
-    except CalledProcessError as e:
-        if e.returncode > 1:
-            raise e
+Advice not applicable in this specific case? Add an exception by updating the ignore list in test/lint/lint-locale-dependence.py"""
 
-    return git_grep_output
 
+def is_linted_file(path: str) -> bool:
+    return path.endswith((".cpp", ".h")) and not any(path.startswith(excl) for excl in REGEXP_EXTERNAL_DEPENDENCIES_EXCLUSIONS)
 
-def main():
-    exit_code = 0
 
-    regexp_ignore_known_violations = "|".join(KNOWN_VIOLATIONS)
-    git_grep_output = find_locale_dependent_function_uses()
+def lint_file(file: SourceFile) -> list[str]:
+    if LOCALE_DEPENDENT_CALLS.isdisjoint(REGEXP_FUNCTION_CALL.findall(file.text)):
+        return []
+    # Lines in the format of git grep
+    uses = [f"{file.path}:{line}" for line in file.text.split("\n")
+            if not LOCALE_DEPENDENT_CALLS.isdisjoint(REGEXP_FUNCTION_CALL.findall(line))
+            and REGEXP_LOCALE_DEPENDENT_FUNCTIONS.search(line)]
 
+    messages = []
     for locale_dependent_function in LOCALE_DEPENDENT_FUNCTIONS:
-        matches =  [line for line in git_grep_output
+        matches =  [line for line in uses
                     if re.search("[^a-zA-Z0-9_\\`'\"<>]" + locale_dependent_function + "(_r|_s)?\\(", line)
                     and not re.search("\\.(c|cpp|h):\\s*//.*" + locale_dependent_function, line)
-                    and not re.search(regexp_ignore_known_violations, line)]
+                    and not REGEXP_IGNORE_KNOWN_VIOLATIONS.search(line)]
         if matches:
-            print(f"The locale dependent function {locale_dependent_function}(...) appears to be used:")
-            for match in matches:
-                print(match)
-            print("")
-            exit_code = 1
-
-    if exit_code == 1:
-        print("Unnecessary locale dependence can cause bugs that are very tricky to isolate and fix. Please avoid using locale-dependent functions if possible.\n")
-        print(f"Advice not applicable in this specific case? Add an exception by updating the ignore list in {sys.argv[0]}")
-
-    sys.exit(exit_code)
+            messages.append(f"The locale dependent function {locale_dependent_function}(...) appears to be used:\n" + "".join(f"{match}\n" for match in matches))
+    return messages
 
 
 if __name__ == "__main__":
-    main()
+    lint_main(sys.modules[__name__])
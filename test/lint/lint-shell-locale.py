@@ -10,52 +10,30 @@ Make sure all shell scripts explicitly opt out of locale dependence using
 Python. See: https://docs.python.org/3/library/os.html#python-utf-8-mode
 """
 
-import subprocess
 import sys
 import re
 
+from lint_source_tree import SourceFile, lint_main
+
 OPT_OUT_LINES = [
     'export LC_ALL=C',
     'export LC_ALL=C.UTF-8',
 ]
 
-def get_shell_files_list():
-    command = [
-        'git',
-        'ls-files',
-        '--',
-        '*.sh',
-    ]
-    try:
-        return subprocess.check_output(command, stderr = subprocess.STDOUT, text=True).splitlines()
-    except subprocess.CalledProcessError as e:
-        if e.returncode > 1: # return code is 1 when match is empty
-            print(e.output, end='')
-            sys.exit(1)
-        return []
-
-def main():
-    exit_code = 0
-    shell_files = get_shell_files_list()
-    for file_path in shell_files:
-        if re.search('src/(secp256k1|minisketch)/', file_path):
-            continue
+NON_COMMENT_PATTERN = re.compile(r'^\s*((?!#).+)$', re.MULTILINE)
 
-        with open(file_path, 'r') as file_obj:
-            contents = file_obj.read()
+def is_linted_file(path):
+    return path.endswith('.sh') and not re.search('src/(secp256k1|minisketch)/', path)
 
-        non_comment_pattern = re.compile(r'^\s*((?!#).+)$', re.MULTILINE)
-        non_comment_lines = re.findall(non_comment_pattern, contents)
-        if not non_comment_lines:
-            continue
-
-        first_non_comment_line = non_comment_lines[0]
-        if first_non_comment_line not in OPT_OUT_LINES:
-            print(f'Missing "export LC_ALL=C" (to avoid locale dependence) as first non-comment non-empty line in {file_path}')
-            exit_code = 1
+def lint_file(file: SourceFile):
+    non_comment_lines = re.findall(NON_COMMENT_PATTERN, file.text)
+    if not non_comment_lines:
+        return []
 
-    return sys.exit(exit_code)
+    first_non_comment_line = non_comment_lines[0]
+    if first_non_comment_line not in OPT_OUT_LINES:
+        return [f'Missing "export LC_ALL=C" (to avoid locale dependence) as first non-comment non-empty line in {file.path}']
+    return []
 
 if __name__ == '__main__':
-    main()
-
+    lint_main(sys.modules[__name__])
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2025-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or https://opensource.org/license/mit.
+
+"""
+Enumerate the files tracked by git once and share their contents between
+linters.
+
+A linter using this module defines:
+
+- is_linted_file(path) -> bool: whether the file at the given path (relative
+  to the repository root) is checked by lint_file.
+- lint_file(file: SourceFile) -> list[str]: the error messages for a single
+  file. The result may only depend on the file's path, mode and contents, so
+  that it can be cached by run-python-linters.py.
+- optionally lint_tree(tree: SourceTree) -> list[str]: the error messages of
+  checks spanning several files, which are never cached.
+- optionally FAILURE_HINT: printed after the error messages, where {count} is
+  replaced by the number of messages.
+
+and calls lint_main() when run as a script.
+"""
+
+import hashlib
+import os
+import subprocess
+import sys
+from typing import Callable, NoReturn, Optional
+
+
+class SourceFile:
+    def __init__(self, tree: "SourceTree", path: str, mode: int, blob: Optional[str]):
+        self.tree = tree
+        self.path = path
+        # The octal mode of the file in the index. Internally, git only keeps
+        # an 'executable' bit, so the permissions will always be 0o644 or 0o755.
+        self.mode = mode
+        # The git blob hash of the file in the index, or None if the file was
+        # modified in the working tree.
+        self._blob = blob
+        self._data: Optional[bytes] = None
+
+    @property
+    def permissions(self) -> int:
+        return self.mode & 0o7777
+
+    @property
+    def data(self) -> bytes:
+        if self._data is None:
+            with open(os.path.join(self.tree.root, self.path), "rb") as f:
+                self._data = f.read()
+        return self._data
+
+    @property
+    def text(self) -> str:
+        return self.data.decode("utf-8")
+
+    @property
+    def blob(self) -> str:
+        """The git blob hash of the contents in the working tree."""
+        if self._blob is None:
+            data = self.data
+            self._blob = hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+        return self._blob
+
+
+class SourceTree:
+    def __init__(self, root: Optional[str] = None):
+        if root is None:
+            root = subprocess.check_output(["git", "rev-parse", "--show-toplevel"], text=True).strip()
+        self.root = root
+        git = ["git", "-C", root, "ls-files", "-z", "--full-name"]
+        modified = set(subprocess.check_output(git + ["--modified"], text=True).split("\0"))
+        deleted = set(subprocess.check_output(git + ["--deleted"], text=True).split("\0"))
+        self.files: dict[str, SourceFile] = {}
+        for file_spec in subprocess.check_output(git + ["--stage"], text=True).rstrip("\0").split("\0"):
+            # 100755 5a150d5f8031fcd75e80a4dd9843afa33655f579 0       ci/test/00_setup_env.sh
+            meta, path = file_spec.split("\t", 1)
+            mode, blob, _ = meta.split()
+            if path in deleted or path in self.files:
+                # Deleted in the working tree, or listed once per stage during
+                # a merge conflict
+                continue
+            self.files[path] = SourceFile(self, path, int(mode, 8), None if path in modified else blob)
+
+    def select(self, predicate: Callable[[str], bool]) -> list[SourceFile]:
+        return [f for p, f in self.files.items() if predicate(p)]
+
+
+def run_linter(linter, tree: SourceTree, cache: Optional[dict[str, list[str]]] = None) -> list[str]:
+    """Return the error messages of a linter module.
+
+    If given, cache maps a key for the path, mode and blob hash of each file to
+    the messages lint_file returned for it. Files found in the cache are not
+    linted again. Afterwards, the cache holds the entries of all linted files.
+    """
+    messages = []
+    results = {}
+    for file in tree.select(linter.is_linted_file):
+        if cache is None:
+            messages += linter.lint_file(file)
+            continue
+        key = f"{file.mode:o} {file.blob} {file.path}"
+        results[key] = cache[key] if key in cache else linter.lint_file(file)
+        messages += results[key]
+    if cache is not None:
+        cache.clear()
+        cache.update(results)
+    if hasattr(linter, "lint_tree"):
+        messages += linter.lint_tree(tree)
+    return messages
+
+
+def format_report(linter, messages: list[str]) -> str:
+    report = "".join(f"{m}\n" for m in messages)
+    if messages and hasattr(linter, "FAILURE_HINT"):
+        report += linter.FAILURE_HINT.format(count=len(messages)) + "\n"
+    return report
+
+
+def lint_main(linter) -> NoReturn:
+    tree = SourceTree()
+    messages = run_linter(linter, tree)
+    print(format_report(linter, messages), end="")
+    sys.exit(1 if messages else 0)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2025-present The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or https://opensource.org/license/mit.
+
+"""
+Run the Python linters in test/lint concurrently.
+
+The files tracked by git are enumerated once, and their contents are shared
+between the linters built on lint_source_tree.py. The per-file results of these
+linters are cached by git blob hash, so that only changed files are linted
+again. All other linters run in separate processes.
+"""
+
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from lint_source_tree import SourceTree, format_report, run_linter
+
+LINT_DIR = Path(__file__).resolve().parent
+CACHE_FILE = "lint-cache.json"
+CACHE_VERSION = 1
+# Changes to these modules invalidate the cached results of all linters.
+SHARED_MODULES = ["lint_ignore_dirs.py", "lint_source_tree.py"]
+
+
+def uses_source_tree(path: Path) -> bool:
+    return "from lint_source_tree import" in path.read_text()
+
+
+def load_linter(path: Path):
+    spec = importlib.util.spec_from_file_location(path.stem.replace("-", "_"), path)
+    assert spec is not None and spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def linter_hash(path: Path) -> str:
+    hasher = hashlib.sha256()
+    for source in [path] + [LINT_DIR / m for m in SHARED_MODULES]:
+        hasher.update(source.read_bytes())
+    return hasher.hexdigest()
+
+
+def load_cache(cache_file: Path) -> dict:
+    try:
+        with open(cache_file, encoding="utf8") as f:
+            cache = json.load(f)
+        if cache.get("version") == CACHE_VERSION:
+            return cache
+    except (OSError, ValueError):
+        pass
+    return {"version": CACHE_VERSION, "linters": {}}
+
+
+def save_cache(cache_file: Path, cache: dict) -> None:
+    tmp_file = cache_file.with_name(cache_file.name + ".tmp")
+    with open(tmp_file, "w", encoding="utf8") as f:
+        json.dump(cache, f)
+    os.replace(tmp_file, cache_file)
+
+
+def run_subprocess(path: Path) -> tuple[bool, str]:
+    result = subprocess.run([sys.executable, path], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    return result.returncode == 0, result.stdout
+
+
+def run_in_process(linter, tree: SourceTree, cache: dict) -> tuple[bool, str]:
+    messages = run_linter(linter, tree, cache)
+    return not messages, format_report(linter, messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of linters to run concurrently (default: %(default)s)")
+    parser.add_argument("--no-cache", action="store_true", help="lint all files, ignoring the cached results")
+    parser.add_argument("linters", nargs="*", help="file names of the linters to run (default: all test/lint/lint-*.py)")
+    args = parser.parse_args()
+
+    root = subprocess.check_output(["git", "rev-parse", "--show-toplevel"], text=True).strip()
+    os.chdir(root)
+    cache_file = Path(root) / subprocess.check_output(["git", "rev-parse", "--git-path", CACHE_FILE], text=True).strip()
+
+    if args.linters:
+        paths = [LINT_DIR / name for name in args.linters]
+        for path in paths:
+            if not path.is_file():
+                sys.exit(f"No linter {path.name} found in {LINT_DIR}")
+    else:
+        paths = sorted(LINT_DIR.glob("lint-*.py"))
+
+    # Linters running in separate processes are started first, they do not
+    # compete for the interpreter of this process.
+    subprocess_paths = [p for p in paths if not uses_source_tree(p)]
+    in_process_paths = [p for p in paths if uses_source_tree(p)]
+
+    cache = {"version": CACHE_VERSION, "linters": {}} if args.no_cache else load_cache(cache_file)
+    tree = SourceTree(root)
+    linter_caches = {}
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        futures = {p: pool.submit(run_subprocess, p) for p in subprocess_paths}
+        for path in in_process_paths:
+            source_hash = linter_hash(path)
+            entry = cache["linters"].get(path.name, {})
+            linter_caches[path.name] = {
+                "hash": source_hash,
+                "files": entry.get("files", {}) if entry.get("hash") == source_hash else {},
+            }
+            futures[path] = pool.submit(run_in_process, load_linter(path), tree, linter_caches[path.name]["files"])
+
+        good = True
+        for path in paths:
+            success, output = futures[path].result()
+            print(output, end="")
+            if not success:
+                good = False
+                print(f"^---- ⚠️ Failure generated from {path.name}")
+
+    cache["linters"].update(linter_caches)
+    try:
+        save_cache(cache_file, cache)
+    except OSError as e:
+        print(f"Warning: could not write the lint cache {cache_file}: {e}")
+
+    sys.exit(0 if good else 1)
+
+
+if __name__ == "__main__":
+    main()
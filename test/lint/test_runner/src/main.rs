@@ -10,7 +10,6 @@ mod lint_text_format;
 mod util;
 
 use std::env;
-use std::fs;
 use std::process::{Command, ExitCode};
 
 use lint_cpp::{
@@ -178,24 +177,13 @@ fn parse_lint_args(args: &[String]) -> Vec<&'static Linter> {
 }
 
 fn run_all_python_linters() -> LintResult {
-    let mut good = true;
-    let lint_dir = get_git_root().join("test/lint");
-    for entry in fs::read_dir(lint_dir).unwrap() {
-        let entry = entry.unwrap();
-        let entry_fn = entry.file_name().into_string().unwrap();
-        if entry_fn.starts_with("lint-")
-            && entry_fn.ends_with(".py")
-            && !Command::new("python3")
-                .arg(entry.path())
-                .status()
-                .expect("command error")
-                .success()
-        {
-            good = false;
-            println!("^---- ⚠️ Failure generated from {entry_fn}");
-        }
-    }
-    if good {
+    // The runner prints the output of each linter, and which of them failed
+    if Command::new("python3")
+        .arg(get_git_root().join("test/lint/run-python-linters.py"))
+        .status()
+        .expect("command error")
+        .success()
+    {
         Ok(())
     } else {
         Err("".to_string())